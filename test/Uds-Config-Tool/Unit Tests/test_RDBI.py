@@ -1,3 +1,4 @@
+import asyncio
 import traceback
 from pathlib import Path
 
@@ -82,6 +83,31 @@ def test_RDBI_static_length(monkeypatch, default_tp_config, default_uds_config):
     assert expected == actual
 
 
+def test_RDBI_async(monkeypatch, default_tp_config, default_uds_config):
+
+    here = Path(__file__).parent
+    odx_file = here.joinpath("Bootloader.odx")
+
+    async def mock_send_async(self, payload, functional_req):
+        assert payload == [0x22, 0xF1, 0x8C]
+        assert functional_req == False
+
+    async def mock_return_async(self, timeout_s):
+        return [0x62, 0xF1, 0x8C] + list(b"ABC0011223344556")
+
+    expected = {"ECU_Serial_Number": "ABC0011223344556"}
+
+    monkeypatch.setattr(CanTp, "send_async", mock_send_async)
+    monkeypatch.setattr(CanTp, "recv_async", mock_return_async)
+
+    Config.load_com_layer_config(default_tp_config, default_uds_config)
+    uds = Uds(odx_file)
+
+    actual = asyncio.run(uds.readDataByIdentifier_async("ECU Serial Number"))
+
+    assert expected == actual
+
+
 def test_RDBI_min_max_length(monkeypatch, default_tp_config, default_uds_config):
     here = Path(__file__).parent
     odx_file = here.joinpath("minmaxlength.odx")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Measure throughput and memory allocation of CanTp segmentation and reassembly.
+
+A 4 KB payload is sent and received through CanTp with a flow control
+requesting BS=0 and STmin=0, so the numbers only reflect the Python side
+of the transport protocol. Both the list API and the bytes API are measured.
+"""
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import time
+import tracemalloc
+
+from profiling_config import TP_CONFIG
+
+from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+
+PAYLOAD_LENGTH = 4095
+ITERATIONS = 500
+
+FLOW_CONTROL = bytearray([0x30, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+
+
+class NullConnector:
+    def transmit(self, data, reqId):
+        pass
+
+
+class FrameRecorder:
+    def __init__(self):
+        self.frames = []
+
+    def transmit(self, data, reqId):
+        self.frames.append(bytearray(data))
+
+
+def measure(func) -> tuple:
+    """Return the time per call in seconds and the peak traced memory of one call."""
+    func()
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    duration = (time.perf_counter() - start) / ITERATIONS
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    Config.load_isotp_config(TP_CONFIG)
+    listPayload = [i & 0xFF for i in range(PAYLOAD_LENGTH)]
+    bytesPayload = bytes(listPayload)
+
+    sender = CanTp(connector=NullConnector())
+    sender.getNextBufferedMessage = lambda timeout: FLOW_CONTROL
+
+    # frames of a complete transfer, as the ECU would send them
+    recorder = FrameRecorder()
+    frameSource = CanTp(connector=recorder)
+    frameSource.getNextBufferedMessage = lambda timeout: FLOW_CONTROL
+    frameSource.send(bytesPayload)
+    frames = recorder.frames
+
+    receiver = CanTp(connector=NullConnector())
+
+    def recv(**kwargs):
+        rxFrames = iter(frames)
+        receiver.getNextBufferedMessage = lambda timeout: next(rxFrames)
+        return receiver.recv(**kwargs)
+
+    cases = (
+        ("send list", lambda: sender.send(listPayload)),
+        ("send bytes", lambda: sender.send(bytesPayload)),
+        ("recv list", lambda: recv()),
+        ("recv bytes", lambda: recv(as_bytes=True)),
+    )
+    print(f"{'case':>12} {'time [us]':>10} {'MB/s':>8} {'peak alloc [B]':>15}")
+    for name, func in cases:
+        duration, peak = measure(func)
+        print(f"{name:>12} {duration * 1e6:>10.1f} {PAYLOAD_LENGTH / duration / 1e6:>8.2f} {peak:>15}")
+
+
+if __name__ == "__main__":
+    main()
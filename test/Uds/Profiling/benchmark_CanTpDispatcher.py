@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Compare fanning every received frame out to all CanTp callbacks with the CanTpDispatcher.
+
+100 virtual ECUs are attached to one bus listener, the bus carries frames
+for all of them plus a share of unrelated traffic.
+"""
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import random
+import time
+
+import can
+
+import profiling_config
+
+from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+from uds.uds_communications.TransportProtocols.Can.CanTpDispatcher import CanTpDispatcher
+
+ECU_COUNT = 100
+FRAME_COUNT = 20000
+BASE_RES_ID = 0x700
+
+TP_CONFIG = {**profiling_config.TP_CONFIG, "res_id": BASE_RES_ID}
+
+
+def make_ecus():
+    Config.load_isotp_config(TP_CONFIG)
+    tps = []
+    for i in range(ECU_COUNT):
+        tp = CanTp()
+        tp.reqIdAddress = 0x600 + i
+        tp.resIdAddress = BASE_RES_ID + i
+        tps.append(tp)
+    return tps
+
+
+def make_frames():
+    rng = random.Random(0)
+    # one frame out of five is traffic not addressed to any ECU
+    return [
+        can.Message(
+            arbitration_id=BASE_RES_ID + rng.randrange(int(ECU_COUNT * 1.25)),
+            data=[0x02, 0x50, 0x01, 0, 0, 0, 0, 0],
+            is_extended_id=False,
+        )
+        for _ in range(FRAME_COUNT)
+    ]
+
+
+def run(name, listener, frames, tps):
+    start = time.perf_counter()
+    for msg in frames:
+        listener(msg)
+    duration = time.perf_counter() - start
+    for tp in tps:
+        tp.clearBufferedMessages()
+    print(f"{name:>11} {duration / len(frames) * 1e6:>12.2f} {len(frames) / duration:>12.0f}")
+
+
+def main():
+    tps = make_ecus()
+    frames = make_frames()
+
+    callbacks = [tp.callback_onReceive for tp in tps]
+
+    def fan_out(msg):
+        for callback in callbacks:
+            callback(msg)
+
+    dispatcher = CanTpDispatcher()
+    for tp in tps:
+        dispatcher.register(tp)
+
+    print(f"{ECU_COUNT} ECUs, {FRAME_COUNT} frames")
+    print(f"{'listener':>11} {'us / frame':>12} {'frames / s':>12}")
+    run("fan-out", fan_out, frames, tps)
+    run("dispatcher", dispatcher.callback_onReceive, frames, tps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Measure the callback_onReceive to getNextBufferedMessage path for each receive queue.
+
+Throughput queues a burst of frames from the bus callback and reads them
+back in the same thread. Latency has a notifier thread send frames one at
+a time to a reader blocked in getNextBufferedMessage and records how long
+each frame takes to come out.
+"""
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import statistics
+import threading
+import time
+
+import can
+
+import profiling_config
+
+from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+from uds.uds_communications.TransportProtocols.Can.CanTpRxQueue import RX_QUEUE_TYPES
+
+FRAME_COUNT = 100000
+LATENCY_FRAME_COUNT = 2000
+RES_ID = 0x650
+
+TP_CONFIG = {**profiling_config.TP_CONFIG, "res_id": RES_ID}
+
+
+def make_tp(rx_queue):
+    Config.load_isotp_config(dict(TP_CONFIG, rx_queue=rx_queue))
+    return CanTp()
+
+
+def throughput(tp):
+    msg = can.Message(arbitration_id=RES_ID, data=[0x21] + [0x00] * 7, is_extended_id=False)
+    start = time.perf_counter()
+    for _ in range(FRAME_COUNT):
+        tp.callback_onReceive(msg)
+    for _ in range(FRAME_COUNT):
+        tp.getNextBufferedMessage()
+    return FRAME_COUNT / (time.perf_counter() - start)
+
+
+def latency(tp):
+    latencies = []
+    received = threading.Event()
+
+    def reader():
+        for _ in range(LATENCY_FRAME_COUNT):
+            rxPdu = tp.getNextBufferedMessage(1)
+            latencies.append(time.perf_counter() - rxPdu.timestamp)
+            received.set()
+
+    readerThread = threading.Thread(target=reader)
+    readerThread.start()
+    for _ in range(LATENCY_FRAME_COUNT):
+        received.clear()
+        # give the reader time to block on the empty queue
+        time.sleep(0.0002)
+        frame = bytearray(8)
+        msg = can.Message(arbitration_id=RES_ID, data=frame, is_extended_id=False)
+        # the frame buffer is queued as is, carry the sending time on it
+        msg.data = TimedFrame(frame, time.perf_counter())
+        tp.callback_onReceive(msg)
+        received.wait(1)
+    readerThread.join()
+    return statistics.median(latencies), max(latencies)
+
+
+class TimedFrame(bytearray):
+    def __new__(cls, data, timestamp):
+        return super().__new__(cls, data)
+
+    def __init__(self, data, timestamp):
+        super().__init__(data)
+        self.timestamp = timestamp
+
+
+def main():
+    print(f"{FRAME_COUNT} frames for throughput, {LATENCY_FRAME_COUNT} frames for latency")
+    print(f"{'queue':>8} {'frames / s':>12} {'median us':>10} {'max us':>10}")
+    for name in RX_QUEUE_TYPES:
+        framesPerSecond = throughput(make_tp(name))
+        median, worst = latency(make_tp(name))
+        print(f"{name:>8} {framesPerSecond:>12.0f} {median * 1e6:>10.1f} {worst * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
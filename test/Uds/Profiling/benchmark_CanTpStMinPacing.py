@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""Measure CPU time and inter-frame jitter of CanTp consecutive frame pacing.
+
+A 4095 byte payload is sent against a flow control frame requesting the
+given STmin, once with a pure busy-wait (spin threshold larger than STmin)
+and once with the sleeping pacing mode.
+"""
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import statistics
+import sys
+import time
+
+from profiling_config import TP_CONFIG
+
+from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+
+PAYLOAD_LENGTH = 4095
+
+
+class TimestampConnector:
+    """Connector recording the time at which each frame is transmitted."""
+
+    def __init__(self):
+        self.timestamps = []
+
+    def transmit(self, data, reqId):
+        self.timestamps.append(time.perf_counter())
+
+
+def run(st_min: float, spin_threshold: float) -> dict:
+    connector = TimestampConnector()
+    tp = CanTp(connector=connector)
+    tp.st_min_spin_threshold = spin_threshold
+    flow_control = [0x30, 0x00, CanTp.encode_stMin(st_min), 0, 0, 0, 0, 0]
+    tp.getNextBufferedMessage = lambda timeout: flow_control
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    tp.send([0x55] * PAYLOAD_LENGTH)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    # skip the first frame, the first gap is measured from the flow control
+    gaps = [b - a for a, b in zip(connector.timestamps[1:], connector.timestamps[2:])]
+    jitter = [gap - st_min for gap in gaps]
+    return {
+        "frames": len(connector.timestamps),
+        "wall": wall_time,
+        "cpu": cpu_time,
+        "jitter_mean": statistics.mean(jitter),
+        "jitter_max": max(jitter),
+        "jitter_min": min(jitter),
+    }
+
+
+def main(st_min_values=(0.001, 0.005, 0.010)):
+    Config.load_isotp_config(TP_CONFIG)
+    print(f"{'STmin':>7} {'mode':>8} {'frames':>6} {'wall [s]':>9} {'cpu [s]':>8} "
+          f"{'cpu %':>6} {'jit mean [us]':>13} {'jit min [us]':>12} {'jit max [us]':>12}")
+    for st_min in st_min_values:
+        for mode, threshold in (("spin", 1.0), ("sleep", Config.isotp.st_min_spin_threshold)):
+            r = run(st_min, threshold)
+            print(
+                f"{st_min * 1000:>5.1f}ms {mode:>8} {r['frames']:>6} {r['wall']:>9.3f} {r['cpu']:>8.3f} "
+                f"{100 * r['cpu'] / r['wall']:>5.0f}% {r['jitter_mean'] * 1e6:>13.1f} "
+                f"{r['jitter_min'] * 1e6:>12.1f} {r['jitter_max'] * 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(tuple(float(arg) for arg in sys.argv[1:]) or (0.001, 0.005, 0.010))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Measure end to end request/response throughput and latency of CanTp against a simulated ECU.
+
+The tester and the ECU talk over a VirtualCanBus, with and without bus
+impairments, so the segmentation, the flow control handshakes and the
+STmin pacing are all exercised without hardware.
+"""
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import statistics
+import time
+
+import profiling_config
+
+from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+from uds.uds_communications.TransportProtocols.Can.CanTpVirtualBus import (
+    SimulatedIsoTpEcu,
+    VirtualCanBus,
+    VirtualCanConnector,
+)
+
+ROUNDS = 50
+PAYLOAD_LENGTH = 4000
+
+TP_CONFIG = {**profiling_config.TP_CONFIG, "st_min": 0}
+
+SCENARIOS = [
+    # name, tx_dl, bus parameters, ECU parameters
+    ("classic", 8, {}, {}),
+    ("classic bs 8", 8, {}, {"block_size": 8}),
+    ("classic wait", 8, {}, {"block_size": 8, "wait_count": 1}),
+    ("fd", 64, {}, {}),
+    ("fd latency", 64, {"latency": 0.0002, "jitter": 0.0001}, {}),
+]
+
+
+def run(name, txDl, busParameters, ecuParameters):
+    Config.load_isotp_config({**TP_CONFIG, "tx_dl": txDl})
+    payload = bytes([0x36, 0x01]) + bytes(PAYLOAD_LENGTH)
+    with VirtualCanBus(seed=0, **busParameters) as bus:
+        connector = VirtualCanConnector(bus)
+        tp = CanTp(connector=connector)
+        connector.listener = tp.callback_onReceive
+        with SimulatedIsoTpEcu(bus, 0x600, 0x650, tx_dl=txDl, **ecuParameters):
+            durations = []
+            for _ in range(ROUNDS):
+                start = time.perf_counter()
+                tp.send(payload)
+                tp.recv(1)
+                durations.append(time.perf_counter() - start)
+    total = sum(durations)
+    print(
+        f"{name:>14} {statistics.median(durations) * 1e3:>10.2f} {max(durations) * 1e3:>10.2f}"
+        f" {2 * len(payload) * ROUNDS / total / 1e3:>10.0f}"
+    )
+
+
+def main():
+    print(f"{ROUNDS} rounds of {PAYLOAD_LENGTH + 2} bytes sent and echoed")
+    print(f"{'scenario':>14} {'median ms':>10} {'max ms':>10} {'kB / s':>10}")
+    for scenario in SCENARIOS:
+        run(*scenario)
+
+
+if __name__ == "__main__":
+    main()
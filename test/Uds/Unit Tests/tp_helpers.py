@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+from uds import CanTp
+from uds.config import Config
+
+
+def make_tp(resId=0x650, connector=None, **isotpConfig):
+    """Load an ISO-TP configuration and create a CanTp instance with it.
+
+    :param resId: response ID, the request ID being 0x50 below it
+    :param connector: connector given to the CanTp instance
+    :param isotpConfig: IsoTpConfig fields replacing the defaults
+    """
+    Config.load_isotp_config(
+        {
+            "req_id": resId - 0x50,
+            "res_id": resId,
+            "addressing_type": "NORMAL",
+            "n_sa": 0xFF,
+            "n_ta": 0xFF,
+            "n_ae": 0xFF,
+            "m_type": "DIAGNOSTICS",
+            "discard_neg_resp": False,
+            **isotpConfig,
+        }
+    )
+    return CanTp(connector=connector)
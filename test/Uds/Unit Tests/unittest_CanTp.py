@@ -10,14 +10,22 @@ __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
 
+import asyncio
+import threading
 import unittest
+from time import perf_counter, sleep
 from unittest.mock import patch
 from parameterized import parameterized
 
-from uds import CanTp
+import can
+
+from uds import CanTp, CanTpError, CanTpTimeoutError
 from uds.config import Config
+from uds.uds_communications.TransportProtocols.Can.CanTpTracer import TRACE_RX, TRACE_TX
+from uds.uds_communications.TransportProtocols.Can.CanTpTypes import N_Result
 
 PADDING_PATTERN = [CanTp.PADDING_PATTERN]
+FC_STMIN = 2
 
 
 class CanTpMocker(CanTp):
@@ -28,10 +36,39 @@ class CanTpMocker(CanTp):
         Mtype="DIAGNOSTICS",
         adressing_type="NORMAL",
         connector=None,
+        tx_dl=64,
+        block_size=0,
+        adaptive_st_min=False,
+        rx_queue="queue",
+        trace_capacity=0,
+        rx_queue_capacity=0,
+        rx_queue_overflow="drop_oldest",
         **kwargs
     ):
         iso_mocker.m_type = Mtype
         iso_mocker.addressing_type = adressing_type
+        iso_mocker.n_sa = 0xF1
+        iso_mocker.n_ta = 0x10
+        iso_mocker.n_ae = 0x42
+        iso_mocker.tx_dl = tx_dl
+        iso_mocker.st_min_spin_threshold = 0.001
+        iso_mocker.max_rx_payload_length = 0x100000
+        iso_mocker.n_wft_max = 2
+        iso_mocker.block_size = block_size
+        iso_mocker.st_min = 0.030
+        iso_mocker.adaptive_st_min = adaptive_st_min
+        iso_mocker.n_as = 1
+        iso_mocker.n_ar = 1
+        iso_mocker.n_bs = 1
+        iso_mocker.n_cr = 1
+        iso_mocker.func_req_id = 0x7DF
+        iso_mocker.func_n_ta = 0x33
+        iso_mocker.functional_ecus = {0x651: 0x601}
+        iso_mocker.rx_queue = rx_queue
+        iso_mocker.rx_queue_capacity = rx_queue_capacity
+        iso_mocker.rx_queue_overflow = rx_queue_overflow
+        iso_mocker.apply_can_filters = False
+        iso_mocker.trace_capacity = trace_capacity
         Config.isotp = iso_mocker
 
         super().__init__(connector=connector, **kwargs)
@@ -147,12 +184,936 @@ class CanTpTestCase(unittest.TestCase):
         )
 
     def test_canTpRaiseExceptionOnTooLargePayload(self):
-        payload = []
-        for i in range(0, 4096):
-            payload.append(0)
+        class HugePayload:
+            def __len__(self):
+                return 0xFFFFFFFF + 1
+
+        tpConnection = CanTpMocker()
+        with self.assertRaises(ValueError):
+            tpConnection.send(HugePayload())
+
+    def test_classic_can_tx_dl_sends_8_byte_frames(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector(), tx_dl=8)
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0x00] + [0x00] * 5
+
+        payload = list(range(1, 21))
+        tpConnection.send(payload)
+
+        self.assertEqual(
+            frames,
+            [
+                bytearray([0x10, 20] + payload[0:6]),
+                bytearray([0x21] + payload[6:13]),
+                bytearray([0x22] + payload[13:20]),
+            ],
+        )
+
+        frames.clear()
+        tpConnection.send(payload[:7])
+        self.assertEqual(frames, [bytearray([0x07] + payload[:7])])
+
+    @parameterized.expand([(10, 12), (20, 24), (62, 64)])
+    def test_can_fd_single_frame_padded_to_minimal_length(self, len_payload, expected_frame_length):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.send(bytes(len_payload))
+
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0][:2], bytes([0x00, len_payload]))
+        self.assertEqual(len(frames[0]), expected_frame_length)
+
+    def test_invalid_tx_dl_raises(self):
+        with self.assertRaises(ValueError):
+            CanTpMocker(tx_dl=10)
+
+    def test_recv_rejects_consecutive_frame_shorter_than_rx_dl(self):
+        frames = iter(
+            [
+                bytearray([0x10, 100]) + bytes(62),
+                bytearray([0x21]) + bytes(7),
+            ]
+        )
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+        with self.assertRaises(ValueError):
+            tpConnection.recv()
+
+    def test_send_escape_first_frame_above_4095_bytes(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0x00] + [0x00] * 5
+
+        payload = bytes(i & 0xFF for i in range(5000))
+        tpConnection.send(payload)
+
+        self.assertEqual(frames[0][:6], bytes([0x10, 0x00, 0x00, 0x00, 0x13, 0x88]))
+        self.assertEqual(len(frames[0]), 64)
+        data = bytes(frames[0][6:]) + b"".join(bytes(frame[1:]) for frame in frames[1:])
+        self.assertEqual(data[:5000], payload)
+
+    def test_recv_escape_first_frame(self):
+        payload = bytes(i & 0xFF for i in range(5000))
+        frames = iter(
+            [bytearray([0x10, 0x00, 0x00, 0x00, 0x13, 0x88]) + payload[:58]]
+            + [
+                bytearray([0x20 + (i + 1) % 16]) + payload[58 + 63 * i : 58 + 63 * (i + 1)]
+                for i in range((5000 - 58 + 62) // 63)
+            ]
+        )
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+        self.assertEqual(tpConnection.recv(as_bytes=True), payload)
+
+    def test_recv_can_fd_single_frame_escape(self):
+        payload = bytes(range(20))
+        tpConnection = CanTpMocker()
+        tpConnection.getNextBufferedMessage = lambda timeout: bytearray([0x00, 20]) + payload + bytes(2)
+
+        self.assertEqual(tpConnection.recv(as_bytes=True), payload)
+
+    def test_recv_ignores_single_frame_escape_on_classic_can_frame(self):
+        tpConnection = CanTpMocker()
+        tpConnection.getNextBufferedMessage = lambda timeout: bytearray([0x00, 0x02, 0x50, 0x01, 0x00, 0x00, 0x00, 0x00])
+
+        with self.assertRaises(ValueError):
+            tpConnection.recv()
+
+    def test_recv_ignores_escape_first_frame_below_4096_bytes(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        frames = iter([bytearray([0x10, 0x00, 0x00, 0x00, 0x0F, 0xFF]) + bytes(58)])
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames, None)
+
+        with self.assertRaises(ValueError):
+            tpConnection.recv()
+
+    def test_recv_refuses_first_frame_above_max_length_with_overflow(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.max_rx_payload_length = 4095
+        tpConnection.getNextBufferedMessage = lambda timeout: bytearray([0x10, 0x00, 0x00, 0x00, 0x13, 0x88]) + bytes(58)
+
+        with self.assertRaises(ValueError):
+            tpConnection.recv()
+        self.assertEqual(frames, [bytearray([0x32, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])])
+
+    def test_consecutive_frames_respect_st_min(self):
+        sendTimes = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                sendTimes.append(perf_counter())
+
+        tpConnection = CanTpMocker(connector=Connector())
+        # flow control: continue to send, BS=0, STmin=5ms
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0x05] + [0x00] * 5
+
+        tpConnection.send([0xFF] * 300)
+
+        # first frame followed by 4 consecutive frames
+        self.assertEqual(len(sendTimes), 5)
+        gaps = [end - start for start, end in zip(sendTimes[1:], sendTimes[2:])]
+        for gap in gaps:
+            self.assertGreaterEqual(gap, 0.005)
+
+    def test_iter_consecutive_frames_pads_only_last_frame(self):
+        tpConnection = CanTpMocker()
+        payload = bytes(63 * 17 + 10)
+
+        frames = list(tpConnection.iter_consecutive_frames(payload))
+
+        self.assertEqual(len(frames), 18)
+        self.assertEqual([frame[0] for frame in frames], [0x20 + (i + 1) % 16 for i in range(18)])
+        for frame in frames[:-1]:
+            self.assertEqual(len(frame), 64)
+        # 10 data bytes padded to a 12 byte CAN FD frame
+        self.assertEqual(len(frames[-1]), 12)
+
+    def test_send_requests_flow_control_after_each_block(self):
+        frames = []
+        flowControlRequests = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        def getNextBufferedMessage(timeout):
+            flowControlRequests.append(len(frames))
+            # continue to send, BS=2, STmin=0
+            return [0x30, 0x02, 0x00] + [0x00] * 5
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = getNextBufferedMessage
+
+        tpConnection.send(bytes(62 + 63 * 4 + 1))
+
+        self.assertEqual(len(frames), 6)
+        self.assertEqual(flowControlRequests, [1, 3, 5])
+
+    def test_send_bytes_payload_hands_buffers_to_connector(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0x00] + [0x00] * 5
+
+        payload = bytes(range(100))
+        tpConnection.send(payload)
+
+        self.assertEqual(len(frames), 2)
+        for frame in frames:
+            self.assertIsInstance(frame, bytearray)
+        self.assertEqual(frames[0], bytes([0x10, 100]) + payload[:62])
+        # 38 bytes of data, padded to the 48 bytes CAN FD frame
+        self.assertEqual(frames[1], bytes([0x21]) + payload[62:] + bytes(9))
+
+    def test_recv_as_bytes_and_as_list(self):
+        payload = bytes(range(100))
+        rxFrames = [
+            bytearray([0x10, 100]) + payload[:62],
+            bytearray([0x21]) + payload[62:] + bytes(1),
+        ]
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        for as_bytes, expected in ((True, payload), (False, list(payload))):
+            frames = iter(rxFrames)
+            tpConnection = CanTpMocker(connector=Connector())
+            tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+            result = tpConnection.recv(as_bytes=as_bytes)
+
+            self.assertEqual(result, expected)
+            self.assertIsInstance(result, type(expected))
+
+    def test_recv_reassembles_classic_can_frames(self):
+        payload = list(range(20))
+        frames = iter(
+            [
+                [0x10, 20] + payload[0:6],
+                [0x21] + payload[6:13],
+                [0x22] + payload[13:20],
+            ]
+        )
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+        self.assertEqual(tpConnection.recv(), payload)
+
+    @parameterized.expand(
+        [
+            ("single frame longer than its data", [[0x07, 0x62, 0xF1, 0x8C]]),
+            ("first frame length fitting in the frame", [[0x10, 0x05, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06]]),
+        ]
+    )
+    def test_recv_rejects_inconsistent_declared_length(self, _, rxFrames):
+        frames = iter(rxFrames)
+        tpConnection = CanTpMocker()
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+        with self.assertRaises(ValueError):
+            tpConnection.recv()
+
+    def test_callback_onReceive_queues_frame_without_copy(self):
+        tpConnection = CanTpMocker()
+        tpConnection.resIdAddress = 0x650
+        msg = can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01], is_extended_id=False)
+
+        tpConnection.callback_onReceive(msg)
+
+        self.assertIs(tpConnection.getNextBufferedMessage(), msg.data)
+
+    def test_recv_sends_flow_control_per_block(self):
+        payload = list(range(41))
+        rxFrames = iter(
+            [[0x10, 41] + payload[0:6]]
+            + [[0x20 + i + 1] + payload[6 + 7 * i : 13 + 7 * i] for i in range(5)]
+        )
+        flowControls = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                flowControls.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector(), block_size=2)
+        tpConnection.st_min = 0.005
+        tpConnection.getNextBufferedMessage = lambda timeout: next(rxFrames)
+
+        self.assertEqual(tpConnection.recv(), payload)
+        self.assertEqual(flowControls, [bytes([0x30, 0x02, 0x05]) + bytes(5)] * 3)
+
+    def test_recv_adaptive_st_min_per_ecu(self):
+        payload = list(range(13))
+        flowControls = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                flowControls.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector(), adaptive_st_min=True)
+        tpConnection.resIdAddress = 0x650
+        for _ in range(2):
+            rxFrames = iter([[0x10, 13] + payload[0:6], [0x21] + payload[6:13]])
+            tpConnection.getNextBufferedMessage = lambda timeout: next(rxFrames)
+            self.assertEqual(tpConnection.recv(), payload)
+
+        # a lost frame backs off to the last STmin that worked
+        rxFrames = iter([[0x10, 13] + payload[0:6], None])
+        tpConnection.getNextBufferedMessage = lambda timeout: next(rxFrames)
+        with self.assertRaises(TimeoutError):
+            tpConnection.recv()
+
+        self.assertEqual([frame[FC_STMIN] for frame in flowControls], [30, 15, 7])
+        self.assertEqual(tpConnection.st_min_adapter.st_min(0x650), 0.015)
+
+    def test_send_rides_out_wait_flow_controls(self):
+        frames = []
+        flowControls = iter([[0x31, 0x00, 0x00], [0x31, 0x00, 0x00], [0x30, 0x00, 0x00]])
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: next(flowControls) + [0x00] * 5
+
+        tpConnection.send(bytes(100))
+
+        self.assertEqual(len(frames), 2)
+        statistics = tpConnection.last_tx_statistics
+        self.assertEqual(statistics.payload_length, 100)
+        self.assertEqual(statistics.flow_control_count, 3)
+        self.assertEqual(statistics.wait_count, 2)
+
+    def test_send_records_timing_statistics(self):
+        reported = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector(), tx_dl=8)
+        tpConnection.statistics_callback = reported.append
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0x01] + [0x00] * 5
+
+        tpConnection.send(bytes(100))
+
+        statistics = tpConnection.last_tx_statistics
+        self.assertEqual(reported, [statistics])
+        self.assertTrue(statistics.sent)
+        self.assertEqual(statistics.flow_control_count, 1)
+        self.assertEqual(len(statistics.flow_control_latencies), 1)
+        self.assertEqual(statistics.st_min, 0.001)
+        # 14 consecutive frames carry the 94 bytes left after the first frame
+        self.assertEqual(len(statistics.cf_gaps), 13)
+        self.assertGreaterEqual(min(statistics.cf_gaps), 0.001)
+        self.assertGreaterEqual(statistics.st_min_jitter, 0)
+        self.assertGreaterEqual(statistics.total_time, sum(statistics.cf_gaps))
+
+    def test_recv_records_timing_statistics(self):
+        reported = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        frames = iter(
+            [
+                [0x10, 25] + [0x01] * 6,
+                [0x21] + [0x02] * 7,
+                [0x22] + [0x03] * 7,
+                [0x23] + [0x04] * 7,
+            ]
+        )
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.statistics_callback = reported.append
+        tpConnection.getNextBufferedMessage = lambda timeout: next(frames)
+
+        tpConnection.recv()
+
+        statistics = tpConnection.last_rx_statistics
+        self.assertEqual(reported, [statistics])
+        self.assertFalse(statistics.sent)
+        self.assertEqual(statistics.payload_length, 25)
+        self.assertEqual(statistics.flow_control_count, 1)
+        self.assertEqual(len(statistics.flow_control_latencies), 1)
+        self.assertEqual(statistics.st_min, 0.030)
+        self.assertEqual(len(statistics.cf_gaps), 2)
+        self.assertIsNone(tpConnection.last_tx_statistics)
+
+    def test_recv_gives_bus_timestamps_of_first_and_last_frame(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector(), tx_dl=8)
+        tpConnection.resIdAddress = 0x650
+        frames = [[0x10, 10] + [0x01] * 6, [0x21] + [0x02] * 7]
+        for timestamp, data in zip([10.0, 10.02], frames):
+            tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=data, timestamp=timestamp))
+
+        self.assertEqual(tpConnection.recv(), [0x01] * 6 + [0x02] * 4)
+        self.assertEqual(tpConnection.last_rx_statistics.first_frame_timestamp, 10.0)
+        self.assertEqual(tpConnection.last_rx_statistics.last_frame_timestamp, 10.02)
+
+        # an overwritten receive method gives no timestamp
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x02, 0x50, 0x01]
+        tpConnection.recv()
+        self.assertIsNone(tpConnection.last_rx_statistics.last_frame_timestamp)
+
+    def test_send_gives_bus_timestamp_of_the_echo_of_its_last_frame(self):
+        timestamps = iter([10.0, 10.01, 10.02, 10.03])
+
+        class Connector:
+            def transmit(self, data, reqId):
+                # the bus gives back the frames sent, python-can receive_own_messages
+                echo = can.Message(arbitration_id=reqId, data=data, is_rx=False, timestamp=next(timestamps))
+                tpConnection.callback_onReceive(echo)
+                if data[0] >> 4 == 1:
+                    tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x30, 0x00, 0x00]))
+
+        tpConnection = CanTpMocker(connector=Connector(), tx_dl=8, st_min=0)
+        tpConnection.resIdAddress = 0x650
+
+        tpConnection.send(bytes(20))
+        statistics = tpConnection.last_tx_statistics
+        self.assertEqual(statistics.last_frame_echo_timestamp, 10.02)
+
+        # the echo of a flow control sent once the response started is not taken
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x10, 20] + [0x00] * 6))
+        flowControlEcho = can.Message(arbitration_id=0x600, data=[0x30, 0x00, 0x00], is_rx=False, timestamp=10.1)
+        tpConnection.callback_onReceive(flowControlEcho)
+        self.assertEqual(statistics.last_frame_echo_timestamp, 10.02)
+
+    def test_send_aborts_after_n_wft_max_wait_flow_controls(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x31, 0x00, 0x00] + [0x00] * 5
+
+        with self.assertRaises(CanTpError) as context:
+            tpConnection.send(bytes(100))
+
+        self.assertEqual(context.exception.result, N_Result.N_WFT_OVFLW)
+        self.assertEqual(tpConnection.last_tx_statistics.wait_count, 3)
+
+    @parameterized.expand(
+        [
+            ("single block", [0x30, 0x00, 0x00], [6]),
+            ("blocks of 4 frames", [0x30, 0x04, 0x00], [4, 2]),
+        ]
+    )
+    def test_send_hands_blocks_to_connector_transmit_many(self, _, flowControl, batches):
+        calls = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                calls.append(data)
+
+            def transmit_many(self, frames, can_id):
+                calls.append(frames)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: flowControl + [0x00] * 5
+
+        payload = bytes(range(200)) * 2
+        tpConnection.send(payload)
+
+        self.assertEqual([len(call) for call in calls[1:]], batches)
+        frames = [frame for call in calls[1:] for frame in call]
+        self.assertEqual(frames[0], bytes([0x21]) + payload[62:125])
+        self.assertEqual(frames[-1], bytes([0x26]) + payload[377:])
+
+    def test_send_uses_transmit_with_st_min(self):
+        calls = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                calls.append("transmit")
+
+            def transmit_many(self, frames, can_id):
+                calls.append("transmit_many")
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.getNextBufferedMessage = lambda timeout: [0x30, 0x00, 0xF1] + [0x00] * 5
+
+        tpConnection.send(bytes(200))
+
+        self.assertEqual(calls, ["transmit"] * 4)
+
+    def test_send_times_out_on_n_bs(self):
+        timeouts = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        def getNextBufferedMessage(timeout):
+            timeouts.append(timeout)
+            return None
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.n_bs = 0.05
+        tpConnection.getNextBufferedMessage = getNextBufferedMessage
+
+        with self.assertRaises(CanTpTimeoutError) as context:
+            tpConnection.send(bytes(100))
+
+        self.assertEqual(context.exception.result, N_Result.N_TIMEOUT_Bs)
+        self.assertIsInstance(context.exception, TimeoutError)
+        self.assertLessEqual(timeouts[0], 0.05)
+
+    def test_recv_times_out_on_n_cr(self):
+        timeouts = []
+        rxFrames = iter([[0x10, 13] + list(range(6)), None])
+
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        def getNextBufferedMessage(timeout):
+            timeouts.append(timeout)
+            return next(rxFrames)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.n_cr = 0.05
+        tpConnection.getNextBufferedMessage = getNextBufferedMessage
+
+        with self.assertRaises(CanTpTimeoutError) as context:
+            tpConnection.recv(timeout_s=2)
+
+        self.assertEqual(context.exception.result, N_Result.N_TIMEOUT_Cr)
+        self.assertGreater(timeouts[0], 1)
+        self.assertLessEqual(timeouts[1], 0.05)
+
+    def test_send_times_out_on_n_as(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                sleep(0.02)
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.n_as = 0.01
+
+        with self.assertRaises(CanTpTimeoutError) as context:
+            tpConnection.send([0x10, 0x01])
+
+        self.assertEqual(context.exception.result, N_Result.N_TIMEOUT_A)
+
+    def test_callback_onReceive_routes_flow_controls_to_the_sender(self):
         tpConnection = CanTpMocker()
-        with self.assertRaises(Exception):
-            tpConnection.send(payload)
+        tpConnection.resIdAddress = 0x650
+        flowControl = can.Message(arbitration_id=0x650, data=[0x30, 0x00, 0x00] + [0x00] * 5)
+        singleFrame = can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01])
+
+        tpConnection.callback_onReceive(flowControl)
+        tpConnection.callback_onReceive(singleFrame)
+
+        self.assertIs(tpConnection.getNextFlowControlMessage(), flowControl.data)
+        self.assertIs(tpConnection.getNextBufferedMessage(), singleFrame.data)
+        self.assertIsNone(tpConnection.getNextFlowControlMessage())
+
+    def test_full_duplex_receive_while_sending(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+                if len(frames) == 1:
+                    # a response comes in before the flow control of the request being sent
+                    response = can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01])
+                    flowControl = can.Message(arbitration_id=0x650, data=[0x30, 0x00, 0x00] + [0x00] * 5)
+                    threading.Timer(0.01, tpConnection.callback_onReceive, (response,)).start()
+                    threading.Timer(0.02, tpConnection.callback_onReceive, (flowControl,)).start()
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        received = []
+        receiver = threading.Thread(target=lambda: received.append(tpConnection.recv(timeout_s=1)))
+        receiver.start()
+        tpConnection.send(bytes(100))
+        receiver.join()
+
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(received, [[0x50, 0x01]])
+
+    def test_normal_fixed_addressing_ids(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append((data, reqId))
+
+        tpConnection = CanTpMocker(connector=Connector(), adressing_type="NORMAL_FIXED")
+        tpConnection.send([0x10, 0x01])
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x18DAF110, data=[0x02, 0x50, 0x01]))
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x18DAF111, data=[0x02, 0x50, 0x02]))
+
+        self.assertEqual(tpConnection.reqIdAddress, 0x18DA10F1)
+        self.assertEqual(frames[0][1], 0x18DA10F1)
+        self.assertEqual(tpConnection.recv(), [0x50, 0x01])
+        self.assertIsNone(tpConnection.getNextBufferedMessage())
+
+    def test_mixed_29_addressing_ids(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append((bytes(data), reqId))
+
+        tpConnection = CanTpMocker(connector=Connector(), adressing_type="MIXED_29")
+        tpConnection.send([0x10, 0x01])
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x18CEF110, data=[0x42, 0x02, 0x50, 0x01]))
+
+        self.assertEqual(frames[0], (bytes([0x42, 0x02, 0x10, 0x01]) + bytes(4), 0x18CE10F1))
+        self.assertEqual(tpConnection.can_filters[0], {"can_id": 0x18CEF110, "can_mask": 0x1FFFFFFF, "extended": True})
+        self.assertEqual(tpConnection.recv(), [0x50, 0x01])
+
+        tpConnection.send([0x3E, 0x80], functionalReq=True)
+
+        self.assertEqual(frames[1], (bytes([0x42, 0x02, 0x3E, 0x80]) + bytes(4), 0x18CD33F1))
+
+    def test_extended_addressing_functional_target_address(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append((bytes(data), reqId))
+
+        tpConnection = CanTpMocker(connector=Connector(), adressing_type="EXTENDED")
+        tpConnection.send([0x3E, 0x80], functionalReq=True)
+        tpConnection.send([0x3E, 0x80])
+
+        self.assertEqual(frames[0][0][0], 0x33)
+        self.assertEqual(frames[0][1], 0x7DF)
+        self.assertEqual(frames[1][0][0], 0x10)
+
+    @parameterized.expand(
+        [
+            # extended addressing sends N_TA and receives frames carrying N_SA
+            ("EXTENDED", 0x10, 0xF1),
+            ("MIXED", 0x42, 0x42),
+            ("MIXED_29", 0x42, 0x42),
+        ]
+    )
+    def test_address_byte_is_added_and_checked(self, addressingType, txAddress, rxAddress):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+
+        tpConnection = CanTpMocker(connector=Connector(), adressing_type=addressingType)
+        tpConnection.resIdAddress = 0x650
+        tpConnection.send([0x10, 0x01])
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x00, 0x02, 0x50, 0x02]))
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[rxAddress, 0x02, 0x50, 0x01]))
+
+        self.assertEqual(frames[0], bytes([txAddress, 0x02, 0x10, 0x01]) + bytes(4))
+        self.assertEqual(tpConnection.rxAddressExtension, rxAddress)
+        self.assertEqual(tpConnection.recv(), [0x50, 0x01])
+        self.assertIsNone(tpConnection.getNextBufferedMessage())
+
+    def test_functional_request_collects_responses_of_every_ecu(self):
+        frames = []
+        payload = list(range(20))
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append((bytes(data), reqId))
+                if reqId == 0x7DF:
+                    for canId, data in (
+                        (0x650, [0x02, 0x7E, 0x00]),
+                        (0x651, [0x10, 20] + payload[0:6]),
+                        (0x652, [0x02, 0x7E, 0x00]),
+                    ):
+                        tpConnection.callback_onReceive(can.Message(arbitration_id=canId, data=data))
+                elif reqId == 0x601:
+                    # the ECU sending a first frame gets its flow control on its own request ID
+                    for data in ([0x21] + payload[6:13], [0x22] + payload[13:20]):
+                        tpConnection.callback_onReceive(can.Message(arbitration_id=0x651, data=data))
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+        tpConnection.reqIdAddress = 0x600
+
+        tpConnection.send([0x3E, 0x00], functionalReq=True)
+        responses = tpConnection.recv_functional(timeout_s=0.1)
+
+        self.assertEqual(frames[0], (bytes([0x02, 0x3E, 0x00]) + bytes(5), 0x7DF))
+        self.assertEqual(frames[1][1], 0x601)
+        self.assertEqual(responses, {0x650: [[0x7E, 0x00]], 0x651: [payload]})
+        # back to physical reception once the responses are collected
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x651, data=[0x02, 0x7E, 0x00]))
+        self.assertIsNone(tpConnection.getNextBufferedMessage())
+
+    def test_physical_request_leaves_functional_collection_going(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        tpConnection.send([0x3E, 0x00], functionalReq=True)
+        # e.g. a tester present sent by another thread
+        tpConnection.send([0x3E, 0x80])
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x651, data=[0x02, 0x7E, 0x00]))
+
+        self.assertTrue(tpConnection.functional_rx)
+        self.assertEqual(tpConnection.recv_functional(timeout_s=0.05), {0x651: [[0x7E, 0x00]]})
+        self.assertFalse(tpConnection.functional_rx)
+
+    def test_end_functional_reception(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        tpConnection.send([0x3E, 0x80], functionalReq=True)
+        tpConnection.end_functional_reception()
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01]))
+
+        self.assertFalse(tpConnection.functional_rx)
+        self.assertEqual(tpConnection.recv(), [0x50, 0x01])
+
+    def test_failed_functional_request_ends_reception(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                raise OSError("bus off")
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        with self.assertRaises(OSError):
+            tpConnection.send([0x3E, 0x80], functionalReq=True)
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01]))
+
+        self.assertFalse(tpConnection.functional_rx)
+        self.assertEqual(tpConnection.recv(0.2), [0x50, 0x01])
+
+    def test_functional_request_must_fit_in_a_single_frame(self):
+        tpConnection = CanTpMocker()
+
+        with self.assertRaises(ValueError):
+            tpConnection.send(bytes(100), functionalReq=True)
+
+    @parameterized.expand([("queue",), ("simple",), ("deque",)])
+    def test_recv_with_each_rx_queue(self, rxQueue):
+        payload = list(range(20))
+
+        class Connector:
+            def transmit(self, data, reqId):
+                for data in ([0x21] + payload[6:13], [0x22] + payload[13:20]):
+                    tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=data))
+
+        tpConnection = CanTpMocker(connector=Connector(), rx_queue=rxQueue)
+        tpConnection.resIdAddress = 0x650
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x10, 20] + payload[0:6]))
+
+        self.assertEqual(tpConnection.recv(), payload)
+
+    def test_bounded_rx_queue_counts_dropped_frames(self):
+        tpConnection = CanTpMocker(rx_queue_capacity=2)
+        tpConnection.resIdAddress = 0x650
+        for i in range(5):
+            tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, i]))
+
+        self.assertEqual(tpConnection.rx_dropped_count, 3)
+        self.assertEqual(tpConnection.rx_high_water_mark, 2)
+        self.assertEqual(tpConnection.recv(), [0x50, 0x03])
+
+    def test_bounded_async_rx_queue_counts_dropped_frames(self):
+        tpConnection = CanTpMocker(rx_queue_capacity=2, rx_queue_overflow="drop_newest")
+        tpConnection.resIdAddress = 0x650
+
+        async def receive():
+            # nothing received yet
+            await tpConnection.getNextBufferedMessageAsync()
+            for i in range(5):
+                tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, i]))
+            return await tpConnection.recv_async()
+
+        self.assertEqual(asyncio.run(receive()), [0x50, 0x00])
+        self.assertEqual(tpConnection.rx_dropped_count, 3)
+        self.assertEqual(tpConnection.rx_high_water_mark, 2)
+
+    def test_invalid_rx_queue(self):
+        with self.assertRaises(ValueError):
+            CanTpMocker(rx_queue="list")
+
+    def test_tracer_records_sent_and_received_frames(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector(), tx_dl=8, trace_capacity=16)
+        tpConnection.reqIdAddress = 0x600
+        tpConnection.resIdAddress = 0x650
+
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x30, 0x00, 0x00]))
+        tpConnection.send(list(range(10)))
+
+        frames = tpConnection.tracer.frames()
+        self.assertEqual(
+            [(frame.direction, frame.can_id, frame.data) for frame in frames],
+            [
+                (TRACE_RX, 0x650, bytes([0x30, 0x00, 0x00])),
+                (TRACE_TX, 0x600, bytes([0x10, 10, 0, 1, 2, 3, 4, 5])),
+                (TRACE_TX, 0x600, bytes([0x21, 6, 7, 8, 9, 0, 0, 0])),
+            ],
+        )
+        self.assertIsNone(CanTpMocker().tracer)
+
+    def test_can_filters_cover_response_and_functional_ids(self):
+        tpConnection = CanTpMocker()
+        tpConnection.resIdAddress = 0x650
+
+        self.assertEqual(
+            tpConnection.can_filters,
+            [
+                {"can_id": 0x650, "can_mask": 0x7FF, "extended": False},
+                {"can_id": 0x651, "can_mask": 0x7FF, "extended": False},
+            ],
+        )
+
+    def test_can_filters_normal_fixed_are_extended(self):
+        tpConnection = CanTpMocker(adressing_type="NORMAL_FIXED")
+
+        self.assertEqual(
+            tpConnection.can_filters[0],
+            {"can_id": 0x18DAF110, "can_mask": 0x1FFFFFFF, "extended": True},
+        )
+
+    def test_apply_can_filters_sets_bus_filters(self):
+        class Bus:
+            def set_filters(self, filters):
+                self.filters = filters
+
+        class Connector:
+            bus = Bus()
+
+            def transmit(self, data, reqId):
+                pass
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        self.assertTrue(tpConnection.apply_can_filters())
+        self.assertEqual(Connector.bus.filters, tpConnection.can_filters)
+        # a connector without python-can bus cannot be filtered
+        tpConnection = CanTpMocker(connector=object())
+        tpConnection.resIdAddress = 0x650
+        self.assertFalse(tpConnection.apply_can_filters())
+
+    def test_send_async_awaits_flow_control_from_bus_callback(self):
+        frames = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                frames.append(data)
+                if len(frames) == 1:
+                    # the ECU answers the first frame from the notifier thread
+                    flowControl = can.Message(arbitration_id=0x650, data=[0x30, 0x00, 0x00] + [0x00] * 5)
+                    threading.Timer(0.01, tpConnection.callback_onReceive, (flowControl,)).start()
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+
+        payload = bytes(range(100))
+        asyncio.run(tpConnection.send_async(payload))
+
+        self.assertEqual(frames[0], bytes([0x10, 100]) + payload[:62])
+        self.assertEqual(frames[1], bytes([0x21]) + payload[62:] + bytes(9))
+
+    def test_recv_async_reassembles_frames_from_bus_callback(self):
+        payload = bytes(range(100))
+        flowControls = []
+
+        class Connector:
+            def transmit(self, data, reqId):
+                flowControls.append(data)
+                consecutiveFrame = can.Message(arbitration_id=0x650, data=bytes([0x21]) + payload[62:] + bytes(9))
+                threading.Timer(0.01, tpConnection.callback_onReceive, (consecutiveFrame,)).start()
+
+        tpConnection = CanTpMocker(connector=Connector())
+        tpConnection.resIdAddress = 0x650
+        # received before any event loop is running, taken from the receive queue by the awaiting reader
+        tpConnection.callback_onReceive(can.Message(arbitration_id=0x650, data=bytes([0x10, 100]) + payload[:62]))
+
+        result = asyncio.run(tpConnection.recv_async(as_bytes=True))
+
+        self.assertEqual(result, payload)
+        self.assertEqual(flowControls[0][0], 0x30)
+
+    def test_recv_async_times_out(self):
+        tpConnection = CanTpMocker()
+
+        with self.assertRaises(TimeoutError):
+            asyncio.run(tpConnection.recv_async(timeout_s=0.05))
+
+    def test_callback_onReceive_returns_to_blocking_buffer_once_loop_closed(self):
+        tpConnection = CanTpMocker()
+        tpConnection.resIdAddress = 0x650
+
+        async def bind():
+            self.assertIsNone(await tpConnection.getNextBufferedMessageAsync())
+
+        asyncio.run(bind())
+        msg = can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01])
+        tpConnection.callback_onReceive(msg)
+
+        self.assertIs(tpConnection.getNextBufferedMessage(), msg.data)
 
     @patch("can.interfaces.virtual.VirtualBus.send")
     def test_canTpSendSingleFrame(self, sendMock):
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import unittest
+
+from parameterized import parameterized
+
+from uds import CanTp, CanTpAdaptiveStMin
+
+
+class CanTpAdaptiveStMinTestCase(unittest.TestCase):
+    def test_success_lowers_st_min_per_ecu(self):
+        adapter = CanTpAdaptiveStMin(initial=0.020)
+
+        adapter.record_success(0x650, adapter.st_min(0x650))
+
+        self.assertEqual(adapter.st_min(0x650), 0.010)
+        self.assertEqual(adapter.st_min(0x651), 0.020)
+        self.assertEqual(adapter.learned, {0x650: 0.020})
+
+    def test_failure_backs_off_and_holds_the_working_value(self):
+        adapter = CanTpAdaptiveStMin(initial=0.004)
+        adapter.record_success(0x650, 0.004)
+        adapter.record_failure(0x650, adapter.st_min(0x650))
+
+        self.assertEqual(adapter.st_min(0x650), 0.004)
+
+        adapter.record_success(0x650, 0.004)
+
+        self.assertEqual(adapter.st_min(0x650), 0.004)
+
+    def test_failure_without_working_value_doubles_st_min(self):
+        adapter = CanTpAdaptiveStMin(initial=0.100)
+
+        adapter.record_failure(0x650, 0.100)
+
+        self.assertEqual(adapter.st_min(0x650), 0.127)
+
+    @parameterized.expand(
+        [
+            (0.00005, 0),
+            (0.00049, 0.0004),
+            (0.0075, 0.007),
+            (0.015, 0.015),
+            (0.5, 0.127),
+        ]
+    )
+    def test_quantize(self, st_min, expected):
+        self.assertEqual(CanTpAdaptiveStMin.quantize(st_min), expected)
+
+    def test_quantized_values_round_trip_through_flow_control(self):
+        for code in [*range(0x00, 0x80), *range(0xF1, 0xFA)]:
+            st_min = CanTpAdaptiveStMin.quantize(CanTp.decode_stMin(code))
+
+            self.assertEqual(CanTp.encode_stMin(st_min), code, st_min)
+            self.assertEqual(CanTp.decode_stMin(CanTp.encode_stMin(st_min)), st_min)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import unittest
+
+import can
+
+from tp_helpers import make_tp
+
+from uds import CanTpDispatcher
+
+
+class CanTpDispatcherTestCase(unittest.TestCase):
+    def test_frames_are_routed_by_response_id(self):
+        tp1 = make_tp(0x650)
+        tp2 = make_tp(0x651)
+        dispatcher = CanTpDispatcher()
+        dispatcher.register(tp1)
+        dispatcher.register(tp2)
+
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x651, data=[0x02, 0x50, 0x01], is_extended_id=False))
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x652, data=[0x02, 0x50, 0x02], is_extended_id=False))
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x03], is_extended_id=False))
+
+        self.assertEqual(tp1.getNextBufferedMessage(), bytearray([0x02, 0x50, 0x03]))
+        self.assertIsNone(tp1.getNextBufferedMessage())
+        self.assertEqual(tp2.getNextBufferedMessage(), bytearray([0x02, 0x50, 0x01]))
+        self.assertIsNone(tp2.getNextBufferedMessage())
+        self.assertEqual(sorted(dispatcher.registeredIds), [0x650, 0x651])
+
+    def test_unregister_stops_routing(self):
+        tp = make_tp(0x650)
+        dispatcher = CanTpDispatcher()
+        dispatcher.register(tp)
+        dispatcher.unregister(tp)
+
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01], is_extended_id=False))
+
+        self.assertIsNone(tp.getNextBufferedMessage())
+        with self.assertRaises(ValueError):
+            dispatcher.unregister(tp)
+
+    def test_register_same_response_id_twice_raises(self):
+        dispatcher = CanTpDispatcher()
+        tp = make_tp(0x650)
+        dispatcher.register(tp)
+        # registering the same instance again is harmless
+        dispatcher.register(tp)
+
+        with self.assertRaises(ValueError):
+            dispatcher.register(make_tp(0x650))
+
+    def test_mixed_addressing_frames_are_routed_by_address_byte(self):
+        tp1 = make_tp(0x650, addressing_type="MIXED", n_ae=0x01)
+        tp2 = make_tp(0x650, addressing_type="MIXED", n_ae=0x02)
+        dispatcher = CanTpDispatcher()
+        dispatcher.register(tp1)
+        dispatcher.register(tp2)
+
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x02, 0x50, 0x01], is_extended_id=False))
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x03, 0x02, 0x50, 0x02], is_extended_id=False))
+
+        self.assertIsNone(tp1.getNextBufferedMessage())
+        self.assertEqual(bytes(tp2.getNextBufferedMessage()), bytes([0x02, 0x50, 0x01]))
+        self.assertEqual(dispatcher.registeredIds, [0x650])
+        with self.assertRaises(ValueError):
+            dispatcher.register(make_tp(0x650))
+
+    def test_can_filters_follow_registrations(self):
+        class Bus:
+            filters = None
+
+            def set_filters(self, filters):
+                self.filters = filters
+
+        class Connector:
+            bus = Bus()
+
+        tp1 = make_tp(0x650)
+        tp2 = make_tp(0x651)
+        dispatcher = CanTpDispatcher(Connector())
+        dispatcher.register(tp1)
+        dispatcher.register(tp2)
+
+        self.assertEqual(
+            [canFilter["can_id"] for canFilter in Connector.bus.filters], [0x650, 0x651]
+        )
+
+        dispatcher.unregister(tp1)
+
+        self.assertEqual(Connector.bus.filters, tp2.can_filters)
+        self.assertEqual(dispatcher.can_filters, tp2.can_filters)
+
+    def test_functional_responses_go_to_the_collecting_instance(self):
+        class Connector:
+            def transmit(self, data, reqId):
+                pass
+
+        tester = make_tp(0x650, connector=Connector(), functional_ecus={0x651: 0x601})
+        ecu = make_tp(0x651)
+        dispatcher = CanTpDispatcher()
+        dispatcher.register(tester)
+        dispatcher.register(ecu)
+
+        tester.send([0x3E, 0x00], functionalReq=True)
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x650, data=[0x02, 0x7E, 0x00], is_extended_id=False))
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x651, data=[0x02, 0x7E, 0x00], is_extended_id=False))
+
+        self.assertEqual(tester.recv_functional(timeout_s=0.05), {0x650: [[0x7E, 0x00]], 0x651: [[0x7E, 0x00]]})
+        self.assertIsNone(ecu.getNextBufferedMessage())
+
+        # once the responses are collected, the frames go to the instance registered on the ID
+        dispatcher.callback_onReceive(can.Message(arbitration_id=0x651, data=[0x02, 0x50, 0x01], is_extended_id=False))
+
+        self.assertEqual(bytes(ecu.getNextBufferedMessage()), bytes([0x02, 0x50, 0x01]))
+
+
+if __name__ == "__main__":
+    unittest.main()
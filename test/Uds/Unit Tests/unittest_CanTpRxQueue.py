@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import queue
+import threading
+import unittest
+from time import perf_counter
+
+from parameterized import parameterized
+
+from uds.uds_communications.TransportProtocols.Can.CanTpRxQueue import DROP_NEWEST, RX_QUEUE_TYPES
+
+QUEUE_TYPES = [(name,) for name in RX_QUEUE_TYPES]
+
+
+class CanTpRxQueueTestCase(unittest.TestCase):
+    @parameterized.expand(QUEUE_TYPES)
+    def test_frames_come_out_in_order(self, name):
+        rxQueue = RX_QUEUE_TYPES[name]()
+        for i in range(3):
+            rxQueue.put(i)
+
+        self.assertEqual([rxQueue.get(), rxQueue.get(1), rxQueue.get_nowait()], [0, 1, 2])
+        self.assertTrue(rxQueue.empty())
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_empty_queue(self, name):
+        rxQueue = RX_QUEUE_TYPES[name]()
+
+        start = perf_counter()
+        self.assertIsNone(rxQueue.get(0.02))
+        self.assertGreaterEqual(perf_counter() - start, 0.02)
+        self.assertIsNone(rxQueue.get())
+        with self.assertRaises(queue.Empty):
+            rxQueue.get_nowait()
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_clear(self, name):
+        rxQueue = RX_QUEUE_TYPES[name]()
+        rxQueue.put(0)
+        rxQueue.put(1)
+
+        rxQueue.clear()
+
+        self.assertTrue(rxQueue.empty())
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_waiting_reader_is_woken_up(self, name):
+        rxQueue = RX_QUEUE_TYPES[name]()
+        threading.Timer(0.01, rxQueue.put, (0x42,)).start()
+
+        start = perf_counter()
+        self.assertEqual(rxQueue.get(1), 0x42)
+        self.assertLess(perf_counter() - start, 0.5)
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_full_queue_drops_oldest(self, name):
+        rxQueue = RX_QUEUE_TYPES[name](capacity=2)
+        for i in range(5):
+            rxQueue.put(i)
+
+        self.assertEqual([rxQueue.get(), rxQueue.get(), rxQueue.get()], [3, 4, None])
+        self.assertEqual(rxQueue.dropped_count, 3)
+        self.assertEqual(rxQueue.high_water_mark, 2)
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_full_queue_drops_newest(self, name):
+        rxQueue = RX_QUEUE_TYPES[name](capacity=2, overflow=DROP_NEWEST)
+        for i in range(5):
+            rxQueue.put(i)
+
+        self.assertEqual([rxQueue.get(), rxQueue.get(), rxQueue.get()], [0, 1, None])
+        self.assertEqual(rxQueue.dropped_count, 3)
+
+    @parameterized.expand(QUEUE_TYPES)
+    def test_unbounded_queue_tracks_high_water_mark(self, name):
+        rxQueue = RX_QUEUE_TYPES[name]()
+        for i in range(3):
+            rxQueue.put(i)
+        rxQueue.clear()
+        rxQueue.put(0)
+
+        self.assertEqual(rxQueue.high_water_mark, 3)
+        self.assertEqual(rxQueue.dropped_count, 0)
+
+    def test_invalid_overflow_raises(self):
+        with self.assertRaises(ValueError):
+            RX_QUEUE_TYPES["queue"](capacity=2, overflow="block")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import csv
+import os
+import tempfile
+import unittest
+
+from uds import CanTpTracer
+from uds.uds_communications.TransportProtocols.Can.CanTpTracer import TRACE_RX, TRACE_TX
+
+
+class CanTpTracerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_oldest_frames_are_overwritten(self):
+        tracer = CanTpTracer(capacity=3)
+        for i in range(5):
+            tracer.record(TRACE_TX, 0x600 + i, [0x02, 0x10, i])
+
+        frames = tracer.frames()
+
+        self.assertEqual(len(tracer), 3)
+        self.assertEqual(tracer.dropped, 2)
+        self.assertEqual([frame.can_id for frame in frames], [0x602, 0x603, 0x604])
+        self.assertEqual(frames[-1].data, bytes([0x02, 0x10, 0x04]))
+        self.assertTrue(all(a.timestamp_ns <= b.timestamp_ns for a, b in zip(frames, frames[1:])))
+
+    def test_data_is_copied_and_truncated(self):
+        tracer = CanTpTracer(capacity=2, max_data_length=8)
+        data = bytearray(range(12))
+        tracer.record(TRACE_RX, 0x650, memoryview(data))
+        data[0] = 0xFF
+
+        self.assertEqual(tracer.frames()[0].data, bytes(range(8)))
+
+        tracer.clear()
+        self.assertEqual(tracer.frames(), [])
+
+    def test_invalid_capacity_raises(self):
+        with self.assertRaises(ValueError):
+            CanTpTracer(capacity=0)
+
+    def test_write_csv(self):
+        tracer = CanTpTracer()
+        tracer.record(TRACE_TX, 0x600, [0x02, 0x10, 0x01])
+        tracer.record(TRACE_RX, 0x650, [0x02, 0x50, 0x01])
+        path = os.path.join(self.directory.name, "trace.csv")
+
+        tracer.write_csv(path)
+
+        with open(path, newline="") as csvFile:
+            rows = list(csv.reader(csvFile))
+        self.assertEqual(rows[0], ["timestamp_ns", "direction", "can_id", "dlc", "data"])
+        self.assertEqual(rows[1][1:], ["Tx", "600", "3", "02 10 01"])
+        self.assertEqual(rows[2][1:], ["Rx", "650", "3", "02 50 01"])
+
+    def test_write_asc(self):
+        tracer = CanTpTracer()
+        tracer.record(TRACE_TX, 0x18DA10F1, [0x02, 0x10, 0x01])
+        tracer.record(TRACE_RX, 0x650, bytes(64))
+        path = os.path.join(self.directory.name, "trace.asc")
+
+        tracer.write_asc(path)
+
+        with open(path) as ascFile:
+            lines = ascFile.read().splitlines()
+        self.assertTrue(lines[0].startswith("date "))
+        self.assertEqual(lines[1], "base hex  timestamps absolute")
+        self.assertTrue(lines[3].startswith("Begin Triggerblock"))
+        self.assertEqual(lines[4].split(), ["0.000000", "1", "18DA10F1x", "Tx", "d", "3", "02", "10", "01"])
+        fields = lines[5].split()
+        self.assertEqual(fields[1:9], ["CANFD", "1", "Rx", "650", "0", "0", "f", "64"])
+        self.assertEqual(fields[9:73], ["00"] * 64)
+        self.assertEqual(lines[-1], "End TriggerBlock")
+
+
+if __name__ == "__main__":
+    unittest.main()
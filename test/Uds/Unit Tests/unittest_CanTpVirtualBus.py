@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import asyncio
+import time
+import unittest
+
+import can
+
+from tp_helpers import make_tp
+
+from uds import CanTpTimeoutError, SimulatedIsoTpEcu, VirtualCanBus, VirtualCanConnector
+from uds.uds_communications.TransportProtocols.Can.CanTpTypes import N_Result
+
+
+def make_bus_tp(bus, tx_dl=8):
+    connector = VirtualCanConnector(bus)
+    tp = make_tp(connector=connector, tx_dl=tx_dl, st_min=0, n_bs=0.2, n_cr=0.2)
+    connector.listener = tp.callback_onReceive
+    return tp
+
+
+class Node:
+    def __init__(self, bus):
+        self.frames = []
+        bus.attach(self)
+
+    def receive(self, msg):
+        self.frames.append(msg)
+
+
+class VirtualCanBusTestCase(unittest.TestCase):
+    def test_frames_reach_every_node_but_the_sender(self):
+        bus = VirtualCanBus()
+        sender = Node(bus)
+        receiver = Node(bus)
+
+        bus.send(can.Message(arbitration_id=0x600, data=[1]), sender)
+
+        self.assertEqual(sender.frames, [])
+        self.assertEqual([bytes(msg.data) for msg in receiver.frames], [b"\x01"])
+
+    def test_lost_and_reordered_frames(self):
+        with VirtualCanBus(reorder_rate=1.0, reorder_delay=0.01) as bus:
+            receiver = Node(bus)
+            bus.send(can.Message(arbitration_id=0x600, data=[1]))
+            bus.reorder_rate = 0
+            bus.send(can.Message(arbitration_id=0x600, data=[2]))
+            bus.loss_rate = 1.0
+            bus.send(can.Message(arbitration_id=0x600, data=[3]))
+            # the held back frame comes after the delay
+            time.sleep(0.05)
+
+        self.assertEqual([bytes(msg.data) for msg in receiver.frames], [b"\x02", b"\x01"])
+        self.assertEqual((bus.sent_count, bus.lost_count, bus.reordered_count), (3, 1, 1))
+
+
+class SimulatedIsoTpEcuTestCase(unittest.TestCase):
+    def test_segmented_request_and_response(self):
+        bus = VirtualCanBus()
+        tp = make_bus_tp(bus)
+        response = bytes([0x62, 0xF1, 0x90]) + bytes(range(100))
+        with SimulatedIsoTpEcu(bus, 0x600, 0x650, handler=lambda request: response, block_size=2, wait_count=1) as ecu:
+            request = [0x2E, 0xF1, 0x90] + list(range(40))
+            tp.send(request)
+            received = tp.recv(1)
+
+        self.assertEqual(ecu.requests, [bytes(request)])
+        self.assertEqual(bytes(received), response)
+        # one wait before each of the 3 flow controls of the 6 consecutive frames
+        self.assertEqual(tp.last_tx_statistics.wait_count, 3)
+
+    def test_can_fd_with_latency(self):
+        with VirtualCanBus(latency=0.001, jitter=0.001) as bus:
+            tp = make_bus_tp(bus, tx_dl=64)
+            with SimulatedIsoTpEcu(bus, 0x600, 0x650, tx_dl=64, st_min=0.001) as ecu:
+                tp.send([0x31, 0x01] + list(range(200)))
+                received = tp.recv(1)
+
+        self.assertEqual(bytes(received), bytes([0x71, 0x01] + list(range(200))))
+
+    def test_blocking_and_async_calls_share_an_instance(self):
+        request = [0x31, 0x01] + list(range(20))
+        response = bytes([0x71, 0x01] + list(range(20)))
+
+        def exchange():
+            tp.send(request)
+            return bytes(tp.recv(1))
+
+        async def exchangeAsync():
+            await tp.send_async(request)
+            return bytes(await tp.recv_async(1))
+
+        async def exchanges():
+            loop = asyncio.get_running_loop()
+            return [
+                await exchangeAsync(),
+                # blocking calls from another thread while the loop is running
+                await loop.run_in_executor(None, exchange),
+                await exchangeAsync(),
+            ]
+
+        with VirtualCanBus() as bus:
+            tp = make_bus_tp(bus)
+            with SimulatedIsoTpEcu(bus, 0x600, 0x650, block_size=2):
+                self.assertEqual(asyncio.run(exchanges()), [response] * 3)
+                # and once the loop is closed
+                self.assertEqual(exchange(), response)
+
+    def test_lost_flow_control_times_out(self):
+        bus = VirtualCanBus()
+        tp = make_bus_tp(bus)
+        with SimulatedIsoTpEcu(bus, 0x600, 0x650):
+            bus.loss_rate = 1.0
+            with self.assertRaises(CanTpTimeoutError) as context:
+                tp.send(list(range(20)))
+
+        self.assertEqual(context.exception.result, N_Result.N_TIMEOUT_Bs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -111,6 +111,29 @@ class CanTpMessageTestCase(unittest.TestCase):
             delta = endTime - startTime
             self.assertAlmostEqual(delta, i, delta=0.001)
 
+    ##
+    # @brief tests the accuracy of the sleeping wait for expiry
+    def testWaitUntilExpiredAccuracy(self):
+        testTimes = [0.1, 0.02, 0.005, 0.001]
+        for i in testTimes:
+            a = ResettableTimer(i)
+            startTime = perf_counter()
+            a.start()
+            a.waitUntilExpired(spinThreshold=0.001)
+            endTime = perf_counter()
+            delta = endTime - startTime
+            self.assertEqual(True, a.isExpired())
+            self.assertAlmostEqual(delta, i, delta=0.001)
+
+    ##
+    # @brief tests that waiting on a timer that is not running returns immediately
+    def testWaitUntilExpiredWhenNotRunning(self):
+        a = ResettableTimer(10)
+        startTime = perf_counter()
+        a.waitUntilExpired()
+        self.assertLess(perf_counter() - startTime, 0.01)
+        self.assertEqual(False, a.isExpired())
+
 
 if __name__ == "__main__":
     unittest.main()
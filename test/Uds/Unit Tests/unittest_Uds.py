@@ -10,10 +10,33 @@ __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
 
+import asyncio
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import MethodType
 from unittest import mock
 
-from uds import Uds
+import can
+
+from uds import CanTp, SimulatedIsoTpEcu, Uds, VirtualCanBus, VirtualCanConnector
+from uds.config import Config
+
+
+def load_default_config(**udsConfig):
+    Config.load_com_layer_config(
+        {
+            "req_id": 0x600,
+            "res_id": 0x650,
+            "addressing_type": "NORMAL",
+            "n_sa": 0xFF,
+            "n_ta": 0xFF,
+            "n_ae": 0xFF,
+            "m_type": "DIAGNOSTICS",
+            "discard_neg_resp": False,
+        },
+        {"transport_protocol": "CAN", "p2_can_client": 1, "p2_can_server": 1, **udsConfig},
+    )
 
 
 class UdsTestCase(unittest.TestCase):
@@ -55,6 +78,312 @@ class UdsTestCase(unittest.TestCase):
 
         self.assertEqual(None, None)
 
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendAsBytes(self, tp_send, tp_recv):
+        load_default_config()
+        tp_recv.return_value = b"\x50\x01\x00\x32\x01\xF4"
+
+        udsConnection = Uds()
+
+        self.assertEqual(
+            udsConnection.send(b"\x10\x01", asBytes=True), b"\x50\x01\x00\x32\x01\xF4"
+        )
+        tp_send.assert_called_once_with(b"\x10\x01", False, 0.01)
+        tp_recv.assert_called_once_with(1, as_bytes=True)
+
+        tp_recv.reset_mock()
+        tp_recv.return_value = [0x50, 0x01, 0x00, 0x32, 0x01, 0xF4]
+        self.assertEqual(udsConnection.send([0x10, 0x01]), [0x50, 0x01, 0x00, 0x32, 0x01, 0xF4])
+        tp_recv.assert_called_once_with(1)
+
+    @mock.patch.object(CanTp, "recv_functional")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendFunctionalCollectsResponses(self, tp_send, tp_recv_functional):
+        load_default_config()
+        tp_recv_functional.return_value = {
+            0x650: [[0x7F, 0x22, 0x78], [0x62, 0xF1, 0x8C, 0x01]],
+            0x651: [[0x7F, 0x22, 0x78]],
+        }
+
+        udsConnection = Uds()
+
+        responses = udsConnection.send([0x22, 0xF1, 0x8C], functionalReq=True)
+
+        self.assertEqual(responses, {0x650: [0x62, 0xF1, 0x8C, 0x01], 0x651: [0x7F, 0x22, 0x78]})
+        tp_send.assert_called_once_with([0x22, 0xF1, 0x8C], True, 0.01)
+        tp_recv_functional.assert_called_once_with(1)
+        self.assertIsNone(udsConnection.send([0x3E, 0x80], responseRequired=False, functionalReq=True))
+
+    @mock.patch.object(CanTp, "end_functional_reception")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendFunctionalWithoutResponseEndsReception(self, tp_send, tp_end_functional_reception):
+        load_default_config()
+
+        udsConnection = Uds()
+
+        self.assertIsNone(udsConnection.send([0x3E, 0x80], responseRequired=False, functionalReq=True))
+        tp_end_functional_reception.assert_called_once_with()
+        udsConnection.send([0x3E, 0x80], responseRequired=False)
+        tp_end_functional_reception.assert_called_once_with()
+
+    @mock.patch.object(CanTp, "end_functional_reception")
+    @mock.patch.object(CanTp, "send_async")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendFunctionalFailureEndsReception(self, tp_send, tp_send_async, tp_end_functional_reception):
+        load_default_config()
+        tp_send.side_effect = OSError
+        tp_send_async.side_effect = OSError
+
+        udsConnection = Uds()
+
+        with self.assertRaises(OSError):
+            udsConnection.send([0x22, 0xF1, 0x8C], functionalReq=True)
+        tp_end_functional_reception.assert_called_once_with()
+        with self.assertRaises(OSError):
+            asyncio.run(udsConnection.send_async([0x22, 0xF1, 0x8C], functionalReq=True))
+        self.assertEqual(tp_end_functional_reception.call_count, 2)
+        # a physical request that failed leaves a functional collection going
+        with self.assertRaises(OSError):
+            udsConnection.send([0x22, 0xF1, 0x8C])
+        self.assertEqual(tp_end_functional_reception.call_count, 2)
+
+    @mock.patch.object(CanTp, "recv_async")
+    @mock.patch.object(CanTp, "send_async")
+    def test_udsSendAsyncWaitsThroughResponsePending(self, tp_send, tp_recv):
+        load_default_config()
+        tp_recv.side_effect = [[0x7F, 0x10, 0x78], [0x50, 0x01, 0x00, 0x32, 0x01, 0xF4]]
+
+        udsConnection = Uds()
+
+        response = asyncio.run(udsConnection.send_async([0x10, 0x01]))
+
+        self.assertEqual(response, [0x50, 0x01, 0x00, 0x32, 0x01, 0xF4])
+        tp_send.assert_awaited_once_with([0x10, 0x01], False)
+        self.assertEqual(tp_recv.await_count, 2)
+        self.assertEqual(len(udsConnection.last_pending_resp_times), 1)
+        self.assertFalse(udsConnection.isTransmitting())
+
+    @mock.patch.object(CanTp, "recv_async")
+    @mock.patch.object(CanTp, "send_async")
+    def test_udsSendAsyncKeepsResponsePendingPerCall(self, tp_send, tp_recv):
+        load_default_config()
+        # the two calls take the responses in turn, the second one ends first
+        responses = [[0x7F, 0x31, 0x78], [0x7F, 0x10, 0x78], [0x7F, 0x31, 0x78], [0x50, 0x01], [0x71, 0x01]]
+
+        async def recv(timeout, **kwargs):
+            await asyncio.sleep(0)
+            return responses.pop(0)
+
+        tp_recv.side_effect = recv
+
+        udsConnection = Uds()
+
+        async def main():
+            return await asyncio.gather(
+                udsConnection.send_async([0x31, 0x01, 0xFF, 0x00]), udsConnection.send_async([0x10, 0x01])
+            )
+
+        self.assertEqual(asyncio.run(main()), [[0x71, 0x01], [0x50, 0x01]])
+        # the pending responses of the first call are not counted in the last one
+        self.assertEqual(len(udsConnection.last_pending_resp_times), 1)
+
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendWaitsP2StarAfterResponsePending(self, tp_send, tp_recv):
+        load_default_config(p2_star_can_client=3)
+        tp_recv.side_effect = [[0x7F, 0x31, 0x78], [0x7F, 0x31, 0x78], [0x71, 0x01, 0xFF, 0x00]]
+
+        udsConnection = Uds()
+
+        self.assertEqual(udsConnection.send([0x31, 0x01, 0xFF, 0x00]), [0x71, 0x01, 0xFF, 0x00])
+        self.assertEqual([call.args[0] for call in tp_recv.call_args_list], [1, 3, 3])
+        self.assertEqual(len(udsConnection.last_pending_resp_times), 2)
+
+        # positive responses shorter than a negative one end the wait too
+        tp_recv.side_effect = [[0x7E]]
+        self.assertEqual(udsConnection.send([0x3E, 0x00]), [0x7E])
+        self.assertEqual(udsConnection.last_pending_resp_times, [])
+
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendResponseDeadline(self, tp_send, tp_recv):
+        load_default_config(p2_star_can_client=3, response_deadline=0.05)
+
+        def pending(timeout, **kwargs):
+            time.sleep(0.02)
+            return [0x7F, 0x31, 0x78]
+
+        tp_recv.side_effect = pending
+
+        udsConnection = Uds()
+
+        with self.assertRaises(TimeoutError):
+            udsConnection.send([0x31, 0x01, 0xFF, 0x00])
+        timeouts = [call.args[0] for call in tp_recv.call_args_list]
+        self.assertGreater(len(timeouts), 1)
+        self.assertTrue(all(timeout <= 0.05 for timeout in timeouts))
+
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSendLearnsFirstResponseTimeout(self, tp_send, tp_recv):
+        load_default_config(learn_response_timeouts=True)
+        tp_recv.return_value = [0x62, 0xF1, 0x8C, 0x01]
+
+        udsConnection = Uds()
+        udsConnection.timing.learn_samples = 2
+
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        # P2server is as long as P2, the ECU may take all of it to answer
+        self.assertEqual(tp_recv.call_args_list[1].args[0], 1)
+        self.assertEqual(tp_recv.call_args_list[2].args[0], 1)
+
+        load_default_config(learn_response_timeouts=True, p2_can_server=0.05)
+        tp_recv.reset_mock()
+        udsConnection = Uds()
+        udsConnection.timing.learn_samples = 2
+
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        udsConnection.send([0x22, 0xF1, 0x8C])
+        self.assertEqual(tp_recv.call_args_list[1].args[0], 1)
+        self.assertEqual(tp_recv.call_args_list[2].args[0], 0.05 + udsConnection.timing.learn_margin)
+
+        # a timeout goes back to P2 for the service
+        tp_recv.side_effect = TimeoutError
+        with self.assertRaises(TimeoutError):
+            udsConnection.send([0x22, 0xF1, 0x8C])
+        self.assertEqual(udsConnection.timing.p2_timeout(0x22), 1)
+
+    @mock.patch.object(CanTp, "send_async")
+    def test_udsCallServiceAsyncBeyondExecutorWorkers(self, tp_send):
+        load_default_config()
+
+        def receive(timeout):
+            # a blocking receive method holds a thread of the loop's default executor
+            time.sleep(0.01)
+            return [0x04, 0x62, 0xF1, 0x8C, 0x01, 0x00, 0x00, 0x00]
+
+        def readDataByIdentifier(target, parameter):
+            return target.send([0x22, 0xF1, parameter])[3]
+
+        udsConnection = Uds()
+        udsConnection.asyncServiceWorkers = 2
+        udsConnection.overwrite_receive_method(receive)
+        udsConnection.readDataByIdentifier = MethodType(readDataByIdentifier, udsConnection)
+
+        async def main():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+            calls = [udsConnection.call_service_async("readDataByIdentifier", 0x8C) for _ in range(6)]
+            return await asyncio.wait_for(asyncio.gather(*calls), 5)
+
+        self.assertEqual(asyncio.run(main()), [0x01] * 6)
+        udsConnection.shutdown_requests()
+
+    @mock.patch.object(CanTp, "recv_async")
+    @mock.patch.object(CanTp, "send_async")
+    def test_udsCallServiceAsync(self, tp_send, tp_recv):
+        load_default_config()
+        tp_recv.return_value = [0x62, 0xF1, 0x8C, 0x01]
+
+        def readDataByIdentifier(target, parameter):
+            # bound services send synchronously through their target
+            response = target.send([0x22, 0xF1, parameter])
+            return response[3]
+
+        udsConnection = Uds()
+        udsConnection.readDataByIdentifier = MethodType(readDataByIdentifier, udsConnection)
+
+        result = asyncio.run(udsConnection.call_service_async("readDataByIdentifier", 0x8C))
+
+        self.assertEqual(result, 0x01)
+        tp_send.assert_awaited_once_with([0x22, 0xF1, 0x8C], False)
+
+    def test_udsCanFiltersFromTransportProtocol(self):
+        load_default_config()
+
+        udsConnection = Uds()
+
+        self.assertEqual(udsConnection.can_filters, udsConnection.tp.can_filters)
+        self.assertEqual(udsConnection.can_filters[0]["can_id"], 0x650)
+
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSubmitSendsRequestsInOrder(self, tp_send, tp_recv):
+        load_default_config()
+        tp_recv.side_effect = [[0x50, 0x01, 0x00], [0x71, 0x01, 0x02], [0x7F, 0x22, 0x31]]
+
+        udsConnection = Uds()
+        futures = [
+            udsConnection.submit([0x10, 0x01]),
+            udsConnection.submit([0x31, 0x01]),
+            udsConnection.submit([0x22, 0xF1, 0x90]),
+        ]
+
+        self.assertEqual(
+            [future.result(1) for future in futures], [[0x50, 0x01, 0x00], [0x71, 0x01, 0x02], [0x7F, 0x22, 0x31]]
+        )
+        self.assertEqual(
+            [call.args[0] for call in tp_send.call_args_list], [[0x10, 0x01], [0x31, 0x01], [0x22, 0xF1, 0x90]]
+        )
+
+        tp_recv.side_effect = TimeoutError
+        future = udsConnection.submit([0x10, 0x01])
+        with self.assertRaises(TimeoutError):
+            future.result(1)
+        udsConnection.shutdown_requests()
+
+    @mock.patch.object(CanTp, "recv")
+    @mock.patch.object(CanTp, "send")
+    def test_udsSubmitService(self, tp_send, tp_recv):
+        load_default_config()
+        tp_recv.return_value = [0x62, 0xF1, 0x8C, 0x01]
+
+        def readDataByIdentifier(target, parameter):
+            return target.send([0x22, 0xF1, parameter])[3]
+
+        udsConnection = Uds()
+        udsConnection.readDataByIdentifier = MethodType(readDataByIdentifier, udsConnection)
+
+        self.assertEqual(udsConnection.submit_service("readDataByIdentifier", 0x8C).result(1), 0x01)
+        udsConnection.shutdown_requests()
+
+    def test_udsResponseTimeFromBusTimestamps(self):
+        load_default_config()
+        Config.isotp.st_min = 0
+        bus = VirtualCanBus()
+        connector = VirtualCanConnector(bus)
+        udsConnection = Uds(connector=connector)
+        connector.listener = udsConnection.tp.callback_onReceive
+
+        with SimulatedIsoTpEcu(bus, 0x600, 0x650, response_delay=0.02):
+            response = udsConnection.send([0x22, 0xF1, 0x90] + [0x00] * 10)
+
+        self.assertEqual(response[:3], [0x62, 0xF1, 0x90])
+        self.assertGreaterEqual(udsConnection.last_resp_bus_time, 0.02)
+        self.assertGreaterEqual(udsConnection.last_resp_overhead, 0)
+        self.assertLess(udsConnection.last_resp_bus_time, udsConnection.last_resp_time)
+
+    def test_udsResponseTimeFromEchoedRequest(self):
+        load_default_config()
+
+        class Connector:
+            def transmit(self, data, reqId):
+                # the request is echoed with its bus timestamp, the response follows 30 ms later
+                udsConnection.tp.callback_onReceive(
+                    can.Message(arbitration_id=reqId, data=data, is_rx=False, timestamp=100.0)
+                )
+                udsConnection.tp.callback_onReceive(
+                    can.Message(arbitration_id=0x650, data=[0x02, 0x50, 0x01], timestamp=100.03)
+                )
+
+        udsConnection = Uds(connector=Connector())
+
+        self.assertEqual(udsConnection.send([0x10, 0x01]), [0x50, 0x01])
+        self.assertAlmostEqual(udsConnection.last_resp_bus_time, 0.03)
+
 
 if __name__ == "__main__":
     unittest.main()
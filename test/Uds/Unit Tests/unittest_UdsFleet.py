@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import MethodType
+from unittest import mock
+
+from uds import CanTp, Uds, UdsFleet, UdsFleetBusyError
+from uds.config import Config
+
+
+class FakeEcu:
+    """Stands in for a Uds instance answering after a delay."""
+
+    def __init__(self, serial, delay=0.1, error=None):
+        self.serial = serial
+        self.delay = delay
+        self.error = error
+        self.start_time = None
+
+    def readDataByIdentifier(self, parameter):
+        self.start_time = time.perf_counter()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {parameter: self.serial}
+
+    async def call_service_async(self, service, *args, executor=None):
+        return await asyncio.get_running_loop().run_in_executor(executor, getattr(self, service), *args)
+
+
+class UdsFleetTestCase(unittest.TestCase):
+    def test_calls_run_in_parallel(self):
+        fleet = UdsFleet({f"ECU{i}": FakeEcu(i) for i in range(10)})
+
+        start = time.perf_counter()
+        results = fleet.run("readDataByIdentifier", "ECU Serial Number")
+
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(list(results), [f"ECU{i}" for i in range(10)])
+        self.assertEqual(results["ECU3"].value, {"ECU Serial Number": 3})
+        self.assertTrue(all(result.ok for result in results.values()))
+
+    def test_errors_and_timeouts_are_reported_per_ecu(self):
+        ecus = [FakeEcu(0), FakeEcu(1, error=ValueError("negative response")), FakeEcu(2, delay=1)]
+        fleet = UdsFleet(ecus, max_workers=2)
+
+        results = fleet.run(lambda uds, parameter: uds.readDataByIdentifier(parameter), "ECU Serial Number", timeout=0.3)
+
+        self.assertEqual(results[ecus[0]].value, {"ECU Serial Number": 0})
+        self.assertIsInstance(results[ecus[1]].error, ValueError)
+        self.assertIsInstance(results[ecus[2]].error, TimeoutError)
+        self.assertLess(results[ecus[2]].duration, 0.6)
+
+    def test_ecu_with_a_timed_out_call_is_skipped_until_it_ends(self):
+        ecus = {"fast": FakeEcu(0, delay=0), "slow": FakeEcu(1, delay=0.3)}
+        fleet = UdsFleet(ecus)
+
+        results = fleet.run("readDataByIdentifier", "ECU Serial Number", timeout=0.1)
+
+        self.assertIsInstance(results["slow"].error, TimeoutError)
+        self.assertEqual(fleet.busy, ["slow"])
+
+        results = asyncio.run(fleet.run_async("readDataByIdentifier", "ECU Serial Number"))
+
+        self.assertTrue(results["fast"].ok)
+        self.assertIsInstance(results["slow"].error, UdsFleetBusyError)
+
+        time.sleep(0.3)
+        results = fleet.run("readDataByIdentifier", "ECU Serial Number")
+
+        self.assertEqual(fleet.busy, [])
+        self.assertEqual(results["slow"].value, {"ECU Serial Number": 1})
+
+    def test_run_async(self):
+        ecus = {
+            "fast": FakeEcu(0),
+            "slow": FakeEcu(1, delay=1),
+            "timed out": FakeEcu(2, delay=0, error=TimeoutError("N_Cr")),
+        }
+        fleet = UdsFleet(ecus)
+
+        results = asyncio.run(fleet.run_async("readDataByIdentifier", "ECU Serial Number", timeout=0.3))
+
+        self.assertEqual(results["fast"].value, {"ECU Serial Number": 0})
+        self.assertIsInstance(results["slow"].error, TimeoutError)
+        self.assertEqual(str(results["timed out"].error), "N_Cr")
+
+    def test_run_async_keeps_the_place_of_a_timed_out_call(self):
+        ecus = {"slow": FakeEcu(0, delay=0.3), "next": FakeEcu(1, delay=0)}
+        fleet = UdsFleet(ecus, max_workers=1)
+
+        results = asyncio.run(fleet.run_async("readDataByIdentifier", "ECU Serial Number", timeout=0.1))
+
+        self.assertIsInstance(results["slow"].error, TimeoutError)
+        self.assertTrue(results["next"].ok)
+        self.assertGreaterEqual(ecus["next"].start_time - ecus["slow"].start_time, 0.25)
+        fleet.shutdown()
+
+    @mock.patch.object(CanTp, "send_async")
+    def test_run_async_beyond_the_default_executor_workers(self, tp_send):
+        Config.load_com_layer_config(
+            {
+                "req_id": 0x600,
+                "res_id": 0x650,
+                "addressing_type": "NORMAL",
+                "n_sa": 0xFF,
+                "n_ta": 0xFF,
+                "n_ae": 0xFF,
+                "m_type": "DIAGNOSTICS",
+                "discard_neg_resp": False,
+            },
+            {"transport_protocol": "CAN", "p2_can_client": 1, "p2_can_server": 1},
+        )
+
+        def receive(timeout):
+            # a blocking receive method holds a thread of the loop's default executor
+            time.sleep(0.01)
+            return [0x04, 0x62, 0xF1, 0x8C, 0x01, 0x00, 0x00, 0x00]
+
+        def readDataByIdentifier(target, parameter):
+            return target.send([0x22, 0xF1, parameter])[3]
+
+        ecus = [Uds() for _ in range(6)]
+        for uds in ecus:
+            uds.overwrite_receive_method(receive)
+            uds.readDataByIdentifier = MethodType(readDataByIdentifier, uds)
+        fleet = UdsFleet(ecus, max_workers=4)
+
+        async def main():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+            return await asyncio.wait_for(fleet.run_async("readDataByIdentifier", 0x8C), 5)
+
+        results = asyncio.run(main())
+
+        self.assertEqual([result.value for result in results.values()], [0x01] * 6)
+        fleet.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,16 @@ from uds.uds_communications.Utilities.UtilityFunctions import fillArray
 
 # CAN Imports
 from uds.uds_communications.TransportProtocols.Can import CanTpTypes
+from uds.uds_communications.TransportProtocols.Can.CanTpTypes import CanTpError, CanTpTimeoutError
 from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp
+from uds.uds_communications.TransportProtocols.Can.CanTpAdaptiveStMin import CanTpAdaptiveStMin
+from uds.uds_communications.TransportProtocols.Can.CanTpDispatcher import CanTpDispatcher
+from uds.uds_communications.TransportProtocols.Can.CanTpTracer import CanTpTracer
+from uds.uds_communications.TransportProtocols.Can.CanTpVirtualBus import (
+    SimulatedIsoTpEcu,
+    VirtualCanBus,
+    VirtualCanConnector,
+)
 
 # Uds-Config tool imports
 from uds.uds_config_tool.UdsConfigTool import UdsTool
@@ -29,6 +38,8 @@ from uds.uds_config_tool.ISOStandard.ISOStandard import (
 
 # main uds import
 from uds.uds_communications.Uds.Uds import Uds
+from uds.uds_communications.Uds.UdsFleet import UdsFleet, UdsFleetBusyError, UdsFleetResult
+from uds.uds_communications.Uds.UdsTiming import UdsResponseTiming
 
 from uds.config import Config
 from uds.interfaces import TpInterface
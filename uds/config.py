@@ -1,5 +1,6 @@
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict
 
 log = logging.getLogger(__name__)
 
@@ -11,6 +12,16 @@ class UdsConfig:
     transport_protocol: str
     p2_can_client: int
     p2_can_server: int
+    #: P2*, time in seconds the client waits for the next response after a
+    #: response pending (NRC 0x78)
+    p2_star_can_client: float = 5.0
+    #: time in seconds from a request to its final response, whatever the
+    #: number of response pending, 0 for no limit
+    response_deadline: float = 0
+    #: shorten the time waited for the first response of each service from
+    #: the response times seen, for ECUs that stop answering to fail sooner,
+    #: never below p2_can_server
+    learn_response_timeouts: bool = False
 
 
 @dataclass
@@ -25,6 +36,64 @@ class IsoTpConfig:
     n_ae: int
     m_type: str
     discard_neg_resp: bool
+    #: time in seconds before the STmin deadline at which the sender stops
+    #: sleeping and busy-waits for the next consecutive frame
+    st_min_spin_threshold: float = 0.001
+    #: CAN frame data length used when sending, 8 for classic CAN or one
+    #: of 12, 16, 20, 24, 32, 48 and 64 for CAN FD
+    tx_dl: int = 64
+    #: largest FF_DL accepted when receiving, bigger messages are refused
+    #: with a flow control overflow
+    max_rx_payload_length: int = 0x100000
+    #: N_WFTmax, number of consecutive FS=WAIT flow controls the sender
+    #: accepts before aborting the transfer, 0 refuses any wait
+    n_wft_max: int = 10
+    #: block size asked in the flow controls sent when receiving, 0 lets
+    #: the ECU send all consecutive frames without further flow control
+    block_size: int = 0
+    #: STmin in seconds asked in the flow controls sent when receiving
+    st_min: float = 0.030
+    #: learn the receive STmin per ECU, starting from st_min, see
+    #: CanTpAdaptiveStMin
+    adaptive_st_min: bool = False
+    #: N_As, time in seconds the connector may take to transmit a frame
+    #: when sending
+    n_as: float = 1.0
+    #: N_Ar, time in seconds the connector may take to transmit a flow
+    #: control when receiving
+    n_ar: float = 1.0
+    #: N_Bs, time in seconds the sender waits for a flow control
+    n_bs: float = 1.0
+    #: N_Cr, time in seconds the receiver waits for the next consecutive
+    #: frame
+    n_cr: float = 1.0
+    #: CAN identifier of functional requests, normal fixed addressing uses
+    #: 0x18DB followed by func_n_ta and N_SA instead, 29 bit mixed
+    #: addressing 0x18CD followed by func_n_ta and N_SA
+    func_req_id: int = 0x7DF
+    #: target address of functional requests, carried by the CAN identifier
+    #: with normal fixed and 29 bit mixed addressing and by the address byte
+    #: with extended addressing, 0x33 as in ISO 15765-4
+    func_n_ta: int = 0x33
+    #: physical response ID to physical request ID of the ECUs answering
+    #: functional requests, besides the one of res_id and req_id
+    functional_ecus: Dict[int, int] = field(default_factory=dict)
+    #: receive queue implementation, "queue" for queue.Queue, "simple" for
+    #: queue.SimpleQueue or "deque" for a deque only locked when a reader
+    #: waits, see CanTpRxQueue
+    rx_queue: str = "queue"
+    #: largest number of frames each receive queue holds, 0 for no limit
+    rx_queue_capacity: int = 0
+    #: frame given up when a receive queue is full, "drop_oldest" or
+    #: "drop_newest"
+    rx_queue_overflow: str = "drop_oldest"
+    #: set the CAN acceptance filters of the connector's bus to the
+    #: response IDs at creation, this drops every other frame of a bus
+    #: shared with other users
+    apply_can_filters: bool = False
+    #: number of frames kept by the CanTpTracer created when not 0, the
+    #: oldest frames are overwritten
+    trace_capacity: int = 0
 
 
 class Config:
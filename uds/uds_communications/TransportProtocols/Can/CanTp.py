@@ -11,13 +11,20 @@ __maintainer__ = "Richard Clubb"
 __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
+import asyncio
 import logging
-import queue
+import threading
+from itertools import islice
+from time import perf_counter, time
 
 from uds.config import Config
 from uds.interfaces import TpInterface
 from uds import ResettableTimer, fillArray
+from uds.uds_communications.TransportProtocols.Can.CanTpAdaptiveStMin import CanTpAdaptiveStMin
+from uds.uds_communications.TransportProtocols.Can.CanTpRxQueue import RX_QUEUE_TYPES
+from uds.uds_communications.TransportProtocols.Can.CanTpTracer import TRACE_RX, TRACE_TX, CanTpTracer
 from uds.uds_communications.TransportProtocols.Can.CanTpTypes import (
+    CANTP_MAX_ESCAPE_PAYLOAD_LENGTH,
     CANTP_MAX_PAYLOAD_LENGTH,
     CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX,
     CONSECUTIVE_FRAME_SEQUENCE_NUMBER_INDEX,
@@ -26,22 +33,64 @@ from uds.uds_communications.TransportProtocols.Can.CanTpTypes import (
     FIRST_FRAME_DATA_START_INDEX,
     FIRST_FRAME_DL_INDEX_HIGH,
     FIRST_FRAME_DL_INDEX_LOW,
+    FIRST_FRAME_ESCAPE_DATA_START_INDEX,
+    FIRST_FRAME_ESCAPE_DL_INDEX,
     FLOW_CONTROL_BS_INDEX,
     FLOW_CONTROL_STMIN_INDEX,
     N_PCI_INDEX,
     SINGLE_FRAME_DATA_START_INDEX,
     SINGLE_FRAME_DL_INDEX,
+    SINGLE_FRAME_ESCAPE_DATA_START_INDEX,
+    SINGLE_FRAME_ESCAPE_DL_INDEX,
     CanTpAddressingTypes,
+    CanTpError,
+    CanTpTimeoutError,
     CanTpFsTypes,
     CanTpMessageType,
     CanTpMTypes,
     CanTpState,
+    N_Result,
+    TransferStatistics,
 )
 
 logger = logging.getLogger(__name__)
 
 CAN_FD_DATA_LENGTHS = (8, 12, 16, 20, 24, 32, 48, 64)
 
+# 29 bit CAN identifiers of normal fixed addressing, N_TA and N_SA fill the two low bytes
+NORMAL_FIXED_PHYSICAL_ID = 0x18DA0000
+NORMAL_FIXED_FUNCTIONAL_ID = 0x18DB0000
+# 29 bit CAN identifiers of mixed addressing, N_TA and N_SA fill the two low bytes, N_AE is the first data byte
+MIXED_29_PHYSICAL_ID = 0x18CE0000
+MIXED_29_FUNCTIONAL_ID = 0x18CD0000
+
+CAN_STANDARD_ID_MASK = 0x7FF
+CAN_EXTENDED_ID_MASK = 0x1FFFFFFF
+
+
+def set_connector_filters(connector, can_filters: list) -> bool:
+    """Apply python-can acceptance filters to the bus of a connector.
+
+    The frames are then filtered by the CAN driver or controller instead
+    of reaching the receive callbacks.
+
+    :param connector: connector whose ``bus`` has python-can's ``set_filters``
+    :param can_filters: filters to apply, None lets every frame through
+    :return: True if the filters were applied, False if the connector has
+        no such bus
+    """
+    setFilters = getattr(getattr(connector, "bus", None), "set_filters", None)
+    if setFilters is None:
+        return False
+    setFilters(can_filters)
+    return True
+
+
+# operations yielded by the encoding and decoding state machines to their driver
+_RECEIVE = "receive"
+_RECEIVE_FLOW_CONTROL = "receive flow control"
+_WAIT = "wait"
+
 ##
 # @class CanTp
 # @brief This is the main class to support CAN transport protocol
@@ -74,32 +123,133 @@ class CanTp(TpInterface):
             self.__addressingType = CanTpAddressingTypes.NORMAL
         elif addressingType == "NORMAL_FIXED":
             self.__addressingType = CanTpAddressingTypes.NORMAL_FIXED
-        elif self.__addressingType == "EXTENDED":
+        elif addressingType == "EXTENDED":
             self.__addressingType = CanTpAddressingTypes.EXTENDED
         elif addressingType == "MIXED":
             self.__addressingType = CanTpAddressingTypes.MIXED
+        elif addressingType == "MIXED_29":
+            self.__addressingType = CanTpAddressingTypes.MIXED_29
         else:
             raise Exception("Do not understand the addressing config")
 
-        self.__reqId = Config.isotp.req_id
-        self.__resId = Config.isotp.res_id
+        if self.__addressingType == CanTpAddressingTypes.NORMAL_FIXED:
+            # the ECU answers with source and target addresses swapped
+            self.__reqId = NORMAL_FIXED_PHYSICAL_ID | (self.__N_TA << 8) | self.__N_SA
+            self.__resId = NORMAL_FIXED_PHYSICAL_ID | (self.__N_SA << 8) | self.__N_TA
+        elif self.__addressingType == CanTpAddressingTypes.MIXED_29:
+            self.__reqId = MIXED_29_PHYSICAL_ID | (self.__N_TA << 8) | self.__N_SA
+            self.__resId = MIXED_29_PHYSICAL_ID | (self.__N_SA << 8) | self.__N_TA
+        else:
+            self.__reqId = Config.isotp.req_id
+            self.__resId = Config.isotp.res_id
+
+        # target address of functional requests
+        funcN_TA = Config.isotp.func_n_ta
+        if self.__addressingType == CanTpAddressingTypes.NORMAL_FIXED:
+            self.__funcReqId = NORMAL_FIXED_FUNCTIONAL_ID | (funcN_TA << 8) | self.__N_SA
+        elif self.__addressingType == CanTpAddressingTypes.MIXED_29:
+            self.__funcReqId = MIXED_29_FUNCTIONAL_ID | (funcN_TA << 8) | self.__N_SA
+        else:
+            self.__funcReqId = Config.isotp.func_req_id
+        # physical response ID to request ID of the ECUs answering functional requests,
+        # besides the configured one
+        self.functional_ecus = dict(Config.isotp.functional_ecus)
+
+        # first data byte put in front of the sent frames and expected in the received ones,
+        # the target address with extended addressing and N_AE with mixed addressing
+        if self.__addressingType == CanTpAddressingTypes.EXTENDED:
+            self.__txAddressExtension = self.__N_TA
+            self.__txFunctionalAddressExtension = funcN_TA
+            self.__rxAddressExtension = self.__N_SA
+        elif self.__addressingType in (CanTpAddressingTypes.MIXED, CanTpAddressingTypes.MIXED_29):
+            self.__txAddressExtension = self.__N_AE
+            self.__txFunctionalAddressExtension = self.__N_AE
+            self.__rxAddressExtension = self.__N_AE
+        else:
+            self.__txAddressExtension = None
+            self.__txFunctionalAddressExtension = None
+            self.__rxAddressExtension = None
+
+        self.__txDl = Config.isotp.tx_dl
+        if self.__txDl not in CAN_FD_DATA_LENGTHS:
+            raise ValueError(f"Invalid TX_DL {self.__txDl}, should be one of {CAN_FD_DATA_LENGTHS}")
 
         # sets up the relevant parameters in the instance
         if self.__addressingType in (CanTpAddressingTypes.NORMAL, CanTpAddressingTypes.NORMAL_FIXED):
-            self.__minPduLength = 7
-            self.__maxPduLength = 63
             self.__pduStartIndex = 0
-        elif self.__addressingType in (CanTpAddressingTypes.EXTENDED, CanTpAddressingTypes.MIXED):
-            self.__minPduLength = 6
-            self.__maxPduLength = 62
+        else:
             self.__pduStartIndex = 1
+        # data bytes of a single frame without escape sequence
+        self.__minPduLength = 7 - self.__pduStartIndex
+        # data bytes of a consecutive frame
+        self.__maxPduLength = self.__txDl - 1 - self.__pduStartIndex
+        # CAN FD single frames use the escape sequence to carry more than 7 bytes
+        if self.__txDl > 8:
+            self.__maxSingleFrameLength = self.__txDl - 2 - self.__pduStartIndex
+        else:
+            self.__maxSingleFrameLength = self.__minPduLength
 
         self.__connection = connector
-        self.__recvBuffer = queue.Queue()
+        # flow controls go to the sender, the other frames to the receiver,
+        # so both directions can be used at the same time
+        rxQueueType = Config.isotp.rx_queue
+        if rxQueueType not in RX_QUEUE_TYPES:
+            raise ValueError(f"Invalid receive queue {rxQueueType}, should be one of {list(RX_QUEUE_TYPES)}")
+        rxQueue = RX_QUEUE_TYPES[rxQueueType]
+        # each queue holds at most rx_queue_capacity frames, 0 leaves them unbounded
+        self.__rxQueueCapacity = Config.isotp.rx_queue_capacity
+        self.__rxQueueOverflow = Config.isotp.rx_queue_overflow
+        self.__recvBuffer = rxQueue(self.__rxQueueCapacity, self.__rxQueueOverflow)
+        self.__fcBuffer = rxQueue(self.__rxQueueCapacity, self.__rxQueueOverflow)
+        # asyncio readers waiting for a frame of the receive or the flow control
+        # queue, as (loop, future), woken by the bus callback
+        self.__asyncRecvWaiters = []
+        self.__asyncFcWaiters = []
+        self.__asyncWaitersLock = threading.Lock()
+        # set by a functional request until recv_functional or end_functional_reception,
+        # responses of every ECU then go to the functional buffer
+        self.__functionalRx = False
+        self.__functionalBuffer = rxQueue(self.__rxQueueCapacity, self.__rxQueueOverflow)
+        # bus timestamp of the frame last handed to a reception state machine
+        self.__lastRxTimestamp = None
+        # statistics of the message sent, getting the timestamps of the echoes of its frames
+        # until the response starts
+        self.__txEchoStatistics = None
         self.__discardNegResp = Config.isotp.discard_neg_resp
 
-        # default STmin for flow control when receiving consecutive frames 
-        self.st_min = 0.030
+        # flow control parameters asked to the ECU when receiving consecutive frames
+        self.block_size = Config.isotp.block_size
+        self.st_min = Config.isotp.st_min
+        # when set, the receive STmin is learned per ECU instead of using st_min,
+        # assign the same CanTpAdaptiveStMin to several instances to share it
+        self.st_min_adapter = CanTpAdaptiveStMin(self.st_min) if Config.isotp.adaptive_st_min else None
+
+        # the sender sleeps between consecutive frames and only busy-waits
+        # for this last stretch before the STmin deadline
+        self.st_min_spin_threshold = Config.isotp.st_min_spin_threshold
+
+        # records the frames sent and received when set, see CanTpTracer
+        self.tracer = CanTpTracer(Config.isotp.trace_capacity) if Config.isotp.trace_capacity else None
+
+        if Config.isotp.apply_can_filters:
+            self.apply_can_filters()
+
+        # messages announcing a bigger FF_DL are refused with an overflow flow control
+        self.max_rx_payload_length = Config.isotp.max_rx_payload_length
+
+        # ISO-TP timeouts in seconds, see IsoTpConfig
+        self.n_as = Config.isotp.n_as
+        self.n_ar = Config.isotp.n_ar
+        self.n_bs = Config.isotp.n_bs
+        self.n_cr = Config.isotp.n_cr
+
+        # consecutive FS=WAIT flow controls accepted by the sender
+        self.n_wft_max = Config.isotp.n_wft_max
+        # statistics of the last message sent and received
+        self.last_tx_statistics = None
+        self.last_rx_statistics = None
+        # called with the TransferStatistics of each message sent or received
+        self.statistics_callback = None
 
     ##
     # @brief send method
@@ -109,48 +259,48 @@ class CanTp(TpInterface):
         result = self.encode_isotp(payload, functionalReq)
         return result
     
-    def make_single_frame(self, payload: list[int]) -> list[int]:
-        single_frame = [0x00] * 8
-        if len(payload) <= self.__minPduLength:   
-            single_frame[N_PCI_INDEX] += CanTpMessageType.SINGLE_FRAME << 4
-            single_frame[SINGLE_FRAME_DL_INDEX] += len(payload)
-            single_frame[SINGLE_FRAME_DATA_START_INDEX:] = fillArray(
-                payload, self.__minPduLength
-            )
+    def make_single_frame(self, payload: bytes | list[int]) -> bytearray:
+        payloadLength = len(payload)
+        if payloadLength <= self.__minPduLength:
+            single_frame = bytearray(((CanTpMessageType.SINGLE_FRAME << 4) + payloadLength,))
         else:
-            single_frame[N_PCI_INDEX] = 0
-            single_frame[FIRST_FRAME_DL_INDEX_LOW] = len(payload)
-            single_frame[FIRST_FRAME_DATA_START_INDEX:] = payload
-        return single_frame
-    
-    def make_first_frame(self, payload: list[int]) -> list[int]:
-        first_frame = [0x00] * 8
+            # CAN FD escape sequence, the data length is held in the second byte
+            single_frame = bytearray((0x00, payloadLength))
+        single_frame.extend(payload)
+        return self.pad_frame(single_frame)
+
+    def make_first_frame(self, payload: bytes | list[int]) -> bytearray:
         payload_len = len(payload)
-        payloadLength_highNibble = (payload_len & 0xF00) >> 8
-        payloadLength_lowNibble = payload_len & 0x0FF
-        first_frame[N_PCI_INDEX] += CanTpMessageType.FIRST_FRAME << 4
-        first_frame[FIRST_FRAME_DL_INDEX_HIGH] += payloadLength_highNibble
-        first_frame[FIRST_FRAME_DL_INDEX_LOW] = payloadLength_lowNibble
-        first_frame[FIRST_FRAME_DATA_START_INDEX:] = payload[0 : self.__maxPduLength - 1]
+        if payload_len <= CANTP_MAX_PAYLOAD_LENGTH:
+            payloadLength_highNibble = (payload_len & 0xF00) >> 8
+            payloadLength_lowNibble = payload_len & 0x0FF
+            first_frame = bytearray(
+                ((CanTpMessageType.FIRST_FRAME << 4) + payloadLength_highNibble, payloadLength_lowNibble)
+            )
+        else:
+            # escape sequence, a 12 bit FF_DL of 0 is followed by the 32 bit FF_DL
+            first_frame = bytearray((CanTpMessageType.FIRST_FRAME << 4, 0x00))
+            first_frame.extend(payload_len.to_bytes(4, "big"))
+        first_frame.extend(payload[0 : self.__maxPduLength + 1 - len(first_frame)])
         return first_frame
-    
-    def make_consecutive_frame(self, payload: list[int], sequence_number: int = 1) -> list[int]:
-        consecutive_frame = [0x00] * 8
-        consecutive_frame[N_PCI_INDEX] += CanTpMessageType.CONSECUTIVE_FRAME << 4
-        consecutive_frame[CONSECUTIVE_FRAME_SEQUENCE_NUMBER_INDEX] += sequence_number
-        consecutive_frame[CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX:] = payload
+
+    def make_consecutive_frame(self, payload: bytes | list[int], sequence_number: int = 1) -> bytearray:
+        consecutive_frame = bytearray(((CanTpMessageType.CONSECUTIVE_FRAME << 4) + sequence_number,))
+        consecutive_frame.extend(payload)
         return consecutive_frame
-    
-    def make_flow_control_frame(self, blocksize: int = 0, st_min: float = 0) -> list[int]:
-        flow_control = [0x00] * 8
-        flow_control[N_PCI_INDEX] = 0x30
+
+    def make_flow_control_frame(
+        self, blocksize: int = 0, st_min: float = 0, flow_status: CanTpFsTypes = CanTpFsTypes.CONTINUE_TO_SEND
+    ) -> bytearray:
+        flow_control = bytearray(8 - self.__pduStartIndex)
+        flow_control[N_PCI_INDEX] = (CanTpMessageType.FLOW_CONTROL << 4) + flow_status
         flow_control[FLOW_CONTROL_BS_INDEX] = blocksize
         flow_control[FLOW_CONTROL_STMIN_INDEX] = self.encode_stMin(st_min)
         return flow_control
 
     ##
     # @brief encoding method
-    # @param payload the payload to be sent
+    # @param payload the payload to be sent, a list of ints or a bytes-like object
     # @param use_external_snd_rcv_functions boolean to state if external sending and receiving functions shall be used
     # @param [in] tpWaitTime time to wait inside loop
     def encode_isotp(
@@ -159,63 +309,132 @@ class CanTp(TpInterface):
         functionalReq: bool = False,
         use_external_snd_rcv_functions: bool = False,
     ) -> list[int] | None:
+        return self._run_steps(
+            self._encode_isotp_steps(payload, functionalReq, use_external_snd_rcv_functions)
+        )
 
+    ##
+    # @brief asynchronous send method, flow control and STmin are awaited on the running event loop
+    # @param [in] payload the payload to be sent
+    async def send_async(self, payload, functionalReq=False) -> None:
+        return await self.encode_isotp_async(payload, functionalReq)
+
+    ##
+    # @brief asynchronous encoding method, see encode_isotp
+    async def encode_isotp_async(
+        self,
+        payload,
+        functionalReq: bool = False,
+        use_external_snd_rcv_functions: bool = False,
+    ) -> list[int] | None:
+        return await self._run_steps_async(
+            self._encode_isotp_steps(payload, functionalReq, use_external_snd_rcv_functions)
+        )
+
+    def _encode_isotp_steps(
+        self,
+        payload,
+        functionalReq: bool = False,
+        use_external_snd_rcv_functions: bool = False,
+    ):
+        """Segmentation state machine shared by the blocking and asyncio APIs.
+
+        The generator yields ``(_RECEIVE, timeout)`` to get the next PDU,
+        or ``(_RECEIVE_FLOW_CONTROL, timeout)`` for the next flow control,
+        which is sent back into it, and ``(_WAIT, timer)`` to wait for
+        a timer to expire. Its return value is the one of encode_isotp.
+        """
         payloadLength = len(payload)
         payloadPtr = 0
 
         state = CanTpState.IDLE
 
-        if payloadLength > CANTP_MAX_PAYLOAD_LENGTH:
+        if payloadLength > CANTP_MAX_ESCAPE_PAYLOAD_LENGTH:
             raise ValueError("Payload too large for CAN Transport Protocol")
 
-        if payloadLength < self.__maxPduLength:
+        # segmentation works on slices of a single buffer rather than on lists
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = bytes(payload)
+        payload = memoryview(payload)
+
+        if payloadLength <= self.__maxSingleFrameLength:
             state = CanTpState.SEND_SINGLE_FRAME
         else:
-            # we might need a check for functional request as we may not be able to service functional requests for
-            # multi frame requests
+            if functionalReq:
+                raise ValueError("Functional requests must fit in a single frame")
             state = CanTpState.SEND_FIRST_FRAME
 
-        sequenceNumber = 1
-        endOfMessage_flag = False
+        # responses to a functional request are collected by recv_functional,
+        # from frames received as soon as the request is out, physical requests
+        # sent meanwhile, e.g. by the tester present, leave the collection going
+        if functionalReq:
+            self.__functionalBuffer.clear()
+            self.__functionalRx = True
 
-        blockList = []
-        currBlock = []
+        endOfMessage_flag = False
 
-        # TODO this needs fixing to get the timing from the config
-        # general timeout when waiting for a flow control frame from the ECU
-        timeoutTimer = ResettableTimer(1)
+        # consecutive frames are only built when they are about to be sent
+        consecutiveFrames = None
+        blockSize = 0
+        blockFramesSent = 0
+        waitFrameCount = 0
+
+        statistics = TransferStatistics(payload_length=payloadLength, first_frame_timestamp=time())
+        self.last_tx_statistics = self.__txEchoStatistics = statistics
+        startTime = perf_counter()
+        # when the frame waiting for a flow control and the last consecutive frame were sent
+        flowControlRequestTime = startTime
+        consecutiveFrameTime = startTime
+
+        # N_Bs, timeout when waiting for a flow control frame from the ECU
+        timeoutTimer = ResettableTimer(self.n_bs)
         stMinTimer = ResettableTimer()
 
+        # blocks sent without STmin go through the connector in one call when it can
+        transmitMany = None if use_external_snd_rcv_functions else self.__getTransmitMany()
+
         data = None
 
         while endOfMessage_flag is False:
 
             if state == CanTpState.WAIT_FLOW_CONTROL:
-                rxPdu = self.getNextBufferedMessage(timeoutTimer.remainingTime)
+                rxPdu = yield _RECEIVE_FLOW_CONTROL, timeoutTimer.remainingTime
                 if rxPdu is None:
-                    raise TimeoutError("Timed out while waiting for flow control message")
+                    raise CanTpTimeoutError(N_Result.N_TIMEOUT_Bs, "Timed out while waiting for flow control message")
 
                 N_PCI = (rxPdu[0] & 0xF0) >> 4
                 if N_PCI == CanTpMessageType.FLOW_CONTROL:
                     fs = rxPdu[0] & 0x0F
+                    statistics.flow_control_count += 1
+                    flowControlTime = perf_counter()
+                    statistics.flow_control_latencies.append(flowControlTime - flowControlRequestTime)
+                    flowControlRequestTime = flowControlTime
                     if fs == CanTpFsTypes.CONTINUE_TO_SEND:
                         if state != CanTpState.WAIT_FLOW_CONTROL:
                             raise ValueError(
                                 "Received unexpected Flow Control Continue to Send request"
                             )
 
-                        block_size = rxPdu[FC_BS_INDEX]
-                        if block_size == 0:
-                            block_size = 585
-                        blockList = self.create_blockList(payload[payloadPtr:], block_size)
-                        currBlock = blockList.pop(0)
+                        # a block size of 0 means the rest of the message is sent without further flow control
+                        blockSize = rxPdu[FC_BS_INDEX]
+                        blockFramesSent = 0
+                        waitFrameCount = 0
                         stMin = self.decode_stMin(rxPdu[FC_STMIN_INDEX])
+                        statistics.st_min = stMin
                         stMinTimer.timeoutTime = stMin
                         stMinTimer.start()
                         timeoutTimer.stop()
                         state = CanTpState.SEND_CONSECUTIVE_FRAME
                     elif fs == CanTpFsTypes.WAIT:
-                        raise NotImplementedError("Wait not currently supported")
+                        statistics.wait_times.append(flowControlTime - startTime)
+                        waitFrameCount += 1
+                        if waitFrameCount > self.n_wft_max:
+                            raise CanTpError(
+                                N_Result.N_WFT_OVFLW,
+                                f"Received {waitFrameCount} consecutive wait flow controls, N_WFTmax is {self.n_wft_max}",
+                            )
+                        # the receiver asks for more time, N_Bs starts over for the next flow control
+                        timeoutTimer.restart()
                     elif fs == CanTpFsTypes.OVERFLOW:
                         raise Exception("Overflow received from ECU")
                     else:
@@ -225,26 +444,91 @@ class CanTp(TpInterface):
 
             if state == CanTpState.SEND_SINGLE_FRAME:
                 txPdu = self.make_single_frame(payload)
-                data = self.transmit(txPdu, functionalReq, use_external_snd_rcv_functions)
+                try:
+                    data = self.__transmitWithin(
+                        self.n_as,
+                        N_Result.N_TIMEOUT_A,
+                        txPdu,
+                        functionalReq,
+                        use_external_snd_rcv_functions,
+                        statistics=statistics,
+                    )
+                except BaseException:
+                    # a functional request that did not go out gets no response, physical
+                    # responses must not keep going to the functional buffer
+                    if functionalReq:
+                        self.__functionalRx = False
+                    raise
                 endOfMessage_flag = True
             elif state == CanTpState.SEND_FIRST_FRAME:
                 txPdu = self.make_first_frame(payload)
-                payloadPtr += self.__maxPduLength - 1
-                data = self.transmit(txPdu, functionalReq, use_external_snd_rcv_functions)
+                if payloadLength <= CANTP_MAX_PAYLOAD_LENGTH:
+                    payloadPtr += len(txPdu) - FIRST_FRAME_DATA_START_INDEX
+                else:
+                    payloadPtr += len(txPdu) - FIRST_FRAME_ESCAPE_DATA_START_INDEX
+                data = self.__transmitWithin(
+                    self.n_as,
+                    N_Result.N_TIMEOUT_A,
+                    txPdu,
+                    functionalReq,
+                    use_external_snd_rcv_functions,
+                    statistics=statistics,
+                )
+                consecutiveFrames = self.iter_consecutive_frames(payload[payloadPtr:])
+                flowControlRequestTime = perf_counter()
                 timeoutTimer.start()
                 state = CanTpState.WAIT_FLOW_CONTROL
-            elif state == CanTpState.SEND_CONSECUTIVE_FRAME and stMinTimer.isExpired():
-                txPdu = self.make_consecutive_frame(currBlock.pop(0), sequenceNumber)
+            elif state == CanTpState.SEND_CONSECUTIVE_FRAME and transmitMany is not None and stMin == 0:
+                framesLeft = -(-(payloadLength - payloadPtr) // self.__maxPduLength)
+                if blockSize:
+                    framesLeft = min(framesLeft, blockSize - blockFramesSent)
+                txPdus = [self.__addressFrame(txPdu) for txPdu in islice(consecutiveFrames, framesLeft)]
+                if self.tracer is not None:
+                    for txPdu in txPdus:
+                        self.tracer.record(TRACE_TX, self.__reqId, txPdu)
+                batchStartTime = perf_counter()
+                transmitMany(txPdus, self.__reqId)
+                flowControlRequestTime = perf_counter()
+                if flowControlRequestTime - batchStartTime > self.n_as * framesLeft:
+                    raise CanTpTimeoutError(N_Result.N_TIMEOUT_A, f"Transmission of {framesLeft} frames took too long")
+                statistics.max_transmit_time = max(
+                    statistics.max_transmit_time, (flowControlRequestTime - batchStartTime) / framesLeft
+                )
+                payloadPtr += self.__maxPduLength * framesLeft
+                blockFramesSent += framesLeft
+                if payloadPtr >= payloadLength:
+                    endOfMessage_flag = True
+                else:
+                    timeoutTimer.start()
+                    state = CanTpState.WAIT_FLOW_CONTROL
+            elif state == CanTpState.SEND_CONSECUTIVE_FRAME:
+                yield _WAIT, stMinTimer
+                txPdu = next(consecutiveFrames)
                 payloadPtr += self.__maxPduLength
-                data = self.transmit(txPdu, functionalReq, use_external_snd_rcv_functions)
-                sequenceNumber = (sequenceNumber + 1) % 16
+                data = self.__transmitWithin(
+                    self.n_as,
+                    N_Result.N_TIMEOUT_A,
+                    txPdu,
+                    functionalReq,
+                    use_external_snd_rcv_functions,
+                    statistics=statistics,
+                )
+                frameTime = perf_counter()
+                if blockFramesSent:
+                    statistics.cf_gaps.append(frameTime - consecutiveFrameTime)
+                consecutiveFrameTime = frameTime
+                blockFramesSent += 1
                 stMinTimer.restart()
-                if len(currBlock) == 0:
-                    if len(blockList) == 0:
-                        endOfMessage_flag = True
-                    else:
-                        timeoutTimer.start()
-                        state = CanTpState.WAIT_FLOW_CONTROL
+                if payloadPtr >= payloadLength:
+                    endOfMessage_flag = True
+                elif blockFramesSent == blockSize:
+                    flowControlRequestTime = frameTime
+                    timeoutTimer.start()
+                    state = CanTpState.WAIT_FLOW_CONTROL
+
+        statistics.total_time = perf_counter() - startTime
+        statistics.last_frame_timestamp = time()
+        self.__reportStatistics(statistics)
 
         if use_external_snd_rcv_functions:
             return data
@@ -252,28 +536,81 @@ class CanTp(TpInterface):
     ##
     # @brief recv method
     # @param [in] timeout_ms The timeout to wait before exiting
-    # @return a list
-    def recv(self, timeout_s=1):
-        return self.decode_isotp(timeout_s)
+    # @param [in] as_bytes return the payload as bytes instead of a list
+    # @return a list, or bytes if as_bytes is set
+    def recv(self, timeout_s=1, as_bytes: bool = False):
+        return self.decode_isotp(timeout_s, as_bytes=as_bytes)
+
+    ##
+    # @brief asynchronous recv method, frames are awaited without blocking the loop, the bus callback waking it
+    # @param [in] timeout_s The timeout to wait before exiting
+    # @param [in] as_bytes return the payload as bytes instead of a list
+    # @return a list, or bytes if as_bytes is set
+    async def recv_async(self, timeout_s=1, as_bytes: bool = False):
+        return await self.decode_isotp_async(timeout_s, as_bytes=as_bytes)
 
     ##
     # @brief decoding method
     # @param timeout_ms the timeout to wait before exiting
     # @param received_data the data that should be decoded in case of ITF Automation
     # @param use_external_snd_rcv_functions boolean to state if external sending and receiving functions shall be used
-    # @return a list
+    # @param as_bytes return the payload as bytes instead of a list
+    # @return a list, or bytes if as_bytes is set
     def decode_isotp(
         self,
         timeout_s=1,
         received_data=None,
         use_external_snd_rcv_functions: bool = False,
-    ) -> list:
+        as_bytes: bool = False,
+    ) -> list | bytes:
+        return self._run_steps(
+            self._decode_isotp_steps(timeout_s, received_data, use_external_snd_rcv_functions, as_bytes)
+        )
+
+    ##
+    # @brief asynchronous decoding method, see decode_isotp
+    async def decode_isotp_async(
+        self,
+        timeout_s=1,
+        received_data=None,
+        use_external_snd_rcv_functions: bool = False,
+        as_bytes: bool = False,
+    ) -> list | bytes:
+        return await self._run_steps_async(
+            self._decode_isotp_steps(timeout_s, received_data, use_external_snd_rcv_functions, as_bytes)
+        )
+
+    def _decode_isotp_steps(
+        self,
+        timeout_s=1,
+        received_data=None,
+        use_external_snd_rcv_functions: bool = False,
+        as_bytes: bool = False,
+        ecuIds: tuple[int, int] | None = None,
+    ):
+        """Reassembly state machine shared by the blocking and asyncio APIs.
+
+        Yields the same operations as :meth:`_encode_isotp_steps`, its
+        return value is the one of decode_isotp.
 
-        payload = []
+        :param ecuIds: response and request IDs of the sending ECU, the
+            configured ones by default
+        """
+        resId, reqId = (self.__resId, self.__reqId) if ecuIds is None else ecuIds
+        payload = None
         payloadPtr = 0
         payloadLength = None
 
         sequenceNumberExpected = 1
+        consecutiveFrameDataLength = None
+        blockFramesReceived = 0
+        rxStMin = None
+
+        statistics = TransferStatistics(sent=False)
+        startTime = None
+        # when the last flow control was sent and the last consecutive frame received
+        flowControlTime = None
+        consecutiveFrameTime = None
 
         endOfMessage_flag = False
 
@@ -286,31 +623,79 @@ class CanTp(TpInterface):
 
             if use_external_snd_rcv_functions and state != CanTpState.RECEIVING_CONSECUTIVE_FRAME:
                 rxPdu = received_data
+                rxTimestamp = None
             else:
-                rxPdu = self.getNextBufferedMessage(timeout=timeoutTimer.remainingTime)
+                rxPdu = yield _RECEIVE, timeoutTimer.remainingTime
+                rxTimestamp = self.__lastRxTimestamp
                 if rxPdu is None:
+                    if state == CanTpState.RECEIVING_CONSECUTIVE_FRAME:
+                        self.__recordStMinFailure(resId, rxStMin)
+                        raise CanTpTimeoutError(N_Result.N_TIMEOUT_Cr, "Timed out while waiting for consecutive frame")
                     raise TimeoutError(f"Timed out while waiting for message in state {state.name}")
 
-            if rxPdu[N_PCI_INDEX] == 0x00:
-                rxPdu = rxPdu[1:]
-                N_PCI = CanTpMessageType.SINGLE_FRAME
-            else:
-                N_PCI = (rxPdu[N_PCI_INDEX] & 0xF0) >> 4
+            N_PCI = (rxPdu[N_PCI_INDEX] & 0xF0) >> 4
 
             if state == CanTpState.IDLE:
+                startTime = perf_counter()
                 if N_PCI == CanTpMessageType.SINGLE_FRAME:
-                    payloadLength = rxPdu[N_PCI_INDEX & 0x0F]
-                    payload = rxPdu[
-                        SINGLE_FRAME_DATA_START_INDEX : SINGLE_FRAME_DATA_START_INDEX
-                        + payloadLength
-                    ]
+                    payloadLength = rxPdu[SINGLE_FRAME_DL_INDEX] & 0x0F
+                    dataStart = SINGLE_FRAME_DATA_START_INDEX
+                    if payloadLength == 0:
+                        # CAN FD escape sequence, the data length is held in the second byte,
+                        # ISO 15765-2 has it ignored on frames of classic CAN length
+                        frameLength = len(rxPdu) + (self.__rxAddressExtension is not None)
+                        if frameLength <= CAN_FD_DATA_LENGTHS[0]:
+                            raise ValueError(f"Single frame escape sequence in a frame of {frameLength} bytes")
+                        payloadLength = rxPdu[SINGLE_FRAME_ESCAPE_DL_INDEX]
+                        dataStart = SINGLE_FRAME_ESCAPE_DATA_START_INDEX
+                    if len(rxPdu) - dataStart < payloadLength:
+                        raise ValueError(
+                            f"Single frame declares {payloadLength} bytes but only carries {len(rxPdu) - dataStart}"
+                        )
+                    payload = bytearray(rxPdu[dataStart : dataStart + payloadLength])
+                    payloadPtr = payloadLength
+                    statistics.first_frame_timestamp = statistics.last_frame_timestamp = rxTimestamp
                     endOfMessage_flag = True
                 elif N_PCI == CanTpMessageType.FIRST_FRAME:
-                    payload = rxPdu[FIRST_FRAME_DATA_START_INDEX:]
                     payloadLength = (
                         (rxPdu[FIRST_FRAME_DL_INDEX_HIGH] & 0x0F) << 8
                     ) + rxPdu[FIRST_FRAME_DL_INDEX_LOW]
-                    payloadPtr = self.__maxPduLength - 1
+                    dataStart = FIRST_FRAME_DATA_START_INDEX
+                    if payloadLength == 0:
+                        # escape sequence, the 32 bit FF_DL follows the 12 bit one
+                        payloadLength = int.from_bytes(
+                            bytes(rxPdu[FIRST_FRAME_ESCAPE_DL_INDEX:FIRST_FRAME_ESCAPE_DATA_START_INDEX]), "big"
+                        )
+                        dataStart = FIRST_FRAME_ESCAPE_DATA_START_INDEX
+                        # ISO 15765-2 has an escape sequence ignored when the 12 bit FF_DL would do
+                        if payloadLength <= CANTP_MAX_PAYLOAD_LENGTH:
+                            raise ValueError(
+                                f"First frame escape sequence declares {payloadLength} bytes, which fits in 12 bits"
+                            )
+                    dataLength = len(rxPdu) - dataStart
+                    if payloadLength <= dataLength:
+                        raise ValueError(
+                            f"First frame declares {payloadLength} bytes which fits in the first frame itself"
+                        )
+                    if payloadLength > self.max_rx_payload_length:
+                        self.__transmitWithin(
+                            self.n_ar,
+                            N_Result.N_TIMEOUT_A,
+                            self.make_flow_control_frame(flow_status=CanTpFsTypes.OVERFLOW),
+                            reqId=reqId,
+                        )
+                        raise ValueError(
+                            f"First frame declares {payloadLength} bytes, more than the {self.max_rx_payload_length} bytes accepted"
+                        )
+                    # FF_DL gives the message size, so the buffer is allocated once
+                    # and each frame is copied straight to its offset
+                    payload = bytearray(payloadLength)
+                    payload[:dataLength] = rxPdu[dataStart:]
+                    payloadPtr = dataLength
+                    # the first frame gives the sender's RX_DL, every consecutive frame
+                    # but the last one has to carry the same amount of data
+                    consecutiveFrameDataLength = len(rxPdu) - CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX
+                    statistics.first_frame_timestamp = statistics.last_frame_timestamp = rxTimestamp
                     state = CanTpState.SEND_FLOW_CONTROL
             elif state == CanTpState.RECEIVING_CONSECUTIVE_FRAME:
                 if N_PCI == CanTpMessageType.CONSECUTIVE_FRAME:
@@ -318,56 +703,376 @@ class CanTp(TpInterface):
                         rxPdu[CONSECUTIVE_FRAME_SEQUENCE_NUMBER_INDEX] & 0x0F
                     )
                     if sequenceNumber != sequenceNumberExpected:
+                        self.__recordStMinFailure(resId, rxStMin)
                         raise ValueError(
                             f"Consecutive frame sequence out of order, expected {sequenceNumberExpected} got {sequenceNumber}"
                         )
                     
                     sequenceNumberExpected = (sequenceNumberExpected + 1) % 16
-                    payload += rxPdu[CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX:]
-                    payloadPtr += self.__maxPduLength
+                    # the last consecutive frame may carry padding beyond the declared length
+                    dataLength = min(
+                        len(rxPdu) - CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX,
+                        payloadLength - payloadPtr,
+                    )
+                    if dataLength < min(consecutiveFrameDataLength, payloadLength - payloadPtr):
+                        raise ValueError(
+                            f"Consecutive frame carries {dataLength} bytes, the first frame announced {consecutiveFrameDataLength}"
+                        )
+                    payload[payloadPtr : payloadPtr + dataLength] = rxPdu[
+                        CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX : CONSECUTIVE_FRAME_SEQUENCE_DATA_START_INDEX
+                        + dataLength
+                    ]
+                    payloadPtr += dataLength
                     timeoutTimer.restart()
+                    frameTime = perf_counter()
+                    if blockFramesReceived:
+                        statistics.cf_gaps.append(frameTime - consecutiveFrameTime)
+                    else:
+                        statistics.flow_control_latencies.append(frameTime - flowControlTime)
+                    consecutiveFrameTime = frameTime
+                    statistics.last_frame_timestamp = rxTimestamp
+                    blockFramesReceived += 1
+                    if blockFramesReceived == self.block_size and payloadPtr < payloadLength:
+                        state = CanTpState.SEND_FLOW_CONTROL
                 else:
                     logger.warning(
                         f"Unexpected PDU received while waiting for consecutive frame: 0x{bytes(rxPdu).hex()}"
                     )
 
             if state == CanTpState.SEND_FLOW_CONTROL:
-                txPdu = self.make_flow_control_frame(blocksize=0, st_min=self.st_min)
-                self.transmit(txPdu)
+                if rxStMin is None:
+                    rxStMin = self.st_min if self.st_min_adapter is None else self.st_min_adapter.st_min(resId)
+                txPdu = self.make_flow_control_frame(blocksize=self.block_size, st_min=rxStMin)
+                self.__transmitWithin(self.n_ar, N_Result.N_TIMEOUT_A, txPdu, reqId=reqId, statistics=statistics)
+                flowControlTime = perf_counter()
+                statistics.flow_control_count += 1
+                statistics.st_min = rxStMin
+                blockFramesReceived = 0
+                # N_Cr, timeout between the flow control or a consecutive frame and the next one
+                timeoutTimer.timeoutTime = self.n_cr
+                timeoutTimer.restart()
                 state = CanTpState.RECEIVING_CONSECUTIVE_FRAME
 
             if payloadLength is not None and payloadPtr >= payloadLength:
                 endOfMessage_flag = True
 
-        return list(payload[:payloadLength])
+        if rxStMin is not None and self.st_min_adapter is not None:
+            self.st_min_adapter.record_success(resId, rxStMin)
+
+        statistics.payload_length = payloadLength
+        statistics.total_time = perf_counter() - startTime
+        self.last_rx_statistics = statistics
+        self.__reportStatistics(statistics)
+
+        if as_bytes:
+            return bytes(payload)
+        return list(payload)
+
+    def _run_steps(self, steps):
+        """Drive a state machine with the blocking receive buffer and timers.
+
+        :param steps: generator from _encode_isotp_steps or _decode_isotp_steps
+        :return: the value returned by the state machine
+        """
+        result = None
+        try:
+            while True:
+                operation, argument = steps.send(result)
+                if operation == _RECEIVE:
+                    # a receive method overwritten on the instance gives no timestamp
+                    self.__lastRxTimestamp = None
+                    result = self.getNextBufferedMessage(argument)
+                elif operation == _RECEIVE_FLOW_CONTROL:
+                    result = self.__getFlowControlReceiver()(argument)
+                else:
+                    argument.waitUntilExpired(self.st_min_spin_threshold)
+                    result = None
+        except StopIteration as stop:
+            return stop.value
+
+    async def _run_steps_async(self, steps):
+        """Drive a state machine with awaited receive queues and loop timers.
+
+        A receive method overwritten on the instance, as done by
+        Uds.overwrite_receive_method, is blocking and runs in the loop's
+        default executor.
+
+        :param steps: generator from _encode_isotp_steps or _decode_isotp_steps
+        :return: the value returned by the state machine
+        """
+        loop = asyncio.get_running_loop()
+        externalReceive = vars(self).get("getNextBufferedMessage")
+        flowControlReceiver = self.__getFlowControlReceiver()
+        externalFlowControlReceive = None if flowControlReceiver == self.getNextFlowControlMessage else flowControlReceiver
+        result = None
+        try:
+            while True:
+                operation, argument = steps.send(result)
+                if operation == _RECEIVE:
+                    self.__lastRxTimestamp = None
+                    if externalReceive is not None:
+                        result = await loop.run_in_executor(None, externalReceive, argument)
+                    else:
+                        result = await self.getNextBufferedMessageAsync(argument)
+                elif operation == _RECEIVE_FLOW_CONTROL:
+                    if externalFlowControlReceive is not None:
+                        result = await loop.run_in_executor(None, externalFlowControlReceive, argument)
+                    else:
+                        result = await self.getNextFlowControlMessageAsync(argument)
+                else:
+                    # loop timers are not finer than a millisecond, the STmin
+                    # stays a lower bound since the timer is checked again
+                    while argument.isRunning():
+                        await asyncio.sleep(argument.remainingTime)
+                    result = None
+        except StopIteration as stop:
+            return stop.value
+
+    ##
+    # @brief the method used by the sender to wait for flow controls
+    # @return getNextFlowControlMessage, or getNextBufferedMessage when only that one was overwritten,
+    # since an external receive method gets every frame
+    def __getFlowControlReceiver(self):
+        overwritten = vars(self)
+        if "getNextBufferedMessage" in overwritten and "getNextFlowControlMessage" not in overwritten:
+            return self.getNextBufferedMessage
+        return self.getNextFlowControlMessage
+
+    ##
+    # @brief reports a lost consecutive frame or a sequence error to the STmin adapter
+    def __recordStMinFailure(self, resId, st_min):
+        if self.st_min_adapter is not None:
+            self.st_min_adapter.record_failure(resId, st_min)
+
+    ##
+    # @brief collects the responses of every ECU to the last functional request
+    # @param [in] timeout_s time to wait for responses to start, receptions started by then are completed
+    # @param [in] as_bytes return the payloads as bytes instead of lists
+    # @return dict of the physical response ID of each ECU that answered to the list of its messages
+    def recv_functional(self, timeout_s=1, as_bytes: bool = False) -> dict:
+        ecus = dict(self.functional_ecus)
+        ecus.setdefault(self.__resId, self.__reqId)
+        responses = {}
+        # response ID to the reassembly state machine and the timer of its pending receive
+        receptions = {}
+
+        deadline = ResettableTimer(timeout_s)
+        deadline.start()
+        try:
+            while deadline.isRunning() or receptions:
+                timeout = deadline.remainingTime if deadline.isRunning() else 0
+                if receptions:
+                    timeout = min(timer.remainingTime for _, timer in receptions.values())
+                    if deadline.isRunning():
+                        timeout = min(timeout, deadline.remainingTime)
+                resId, rxPdu, self.__lastRxTimestamp = self.__functionalBuffer.get(timeout) or (None, None, None)
+
+                if resId is not None and resId not in receptions and deadline.isRunning():
+                    steps = self._decode_isotp_steps(as_bytes=as_bytes, ecuIds=(resId, ecus[resId]))
+                    # the state machine first asks for the frame it is given here
+                    next(steps)
+                    receptions[resId] = (steps, None)
+                if resId in receptions:
+                    self.__stepFunctionalReception(receptions, responses, resId, rxPdu)
+
+                # a reception whose N_Cr expired is given no frame and gives up
+                self.__lastRxTimestamp = None
+                for expiredId in [ecu for ecu, (_, timer) in receptions.items() if timer.isExpired()]:
+                    self.__stepFunctionalReception(receptions, responses, expiredId, None)
+        finally:
+            self.__functionalRx = False
+        return responses
+
+    ##
+    # @brief stops collecting the responses to the last functional request, for requests whose
+    # responses are not awaited with recv_functional, the frames of the ECU go to the receive buffer again
+    def end_functional_reception(self):
+        self.__functionalRx = False
+        self.__functionalBuffer.clear()
+
+    @property
+    def functional_rx(self) -> bool:
+        """True while the responses to a functional request are collected."""
+        return self.__functionalRx
+
+    ##
+    # @brief gives a frame to the reassembly of one ECU's functional response
+    def __stepFunctionalReception(self, receptions, responses, resId, rxPdu):
+        steps, _ = receptions[resId]
+        try:
+            _, timeout = steps.send(rxPdu)
+        except StopIteration as stop:
+            responses.setdefault(resId, []).append(stop.value)
+            del receptions[resId]
+        except (ValueError, CanTpError, TimeoutError) as error:
+            logger.warning(f"Dropped the functional response of 0x{resId:X}: {error}")
+            del receptions[resId]
+        else:
+            timer = ResettableTimer(timeout)
+            timer.start()
+            receptions[resId] = (steps, timer)
 
     ##
-    # @brief clear out the receive list
+    # @brief clear out the receive and flow control lists
     def clearBufferedMessages(self):
-        with self.__recvBuffer.mutex:
-            self.__recvBuffer.queue.clear()
+        self.__recvBuffer.clear()
+        self.__fcBuffer.clear()
 
     ##
     # @brief retrieves the next message from the received message buffers
     # @return list, or None if nothing is on the receive list
     def getNextBufferedMessage(self, timeout: float = 0) -> list[int] | None:
-        try:
-            return self.__recvBuffer.get(timeout=timeout)
-        except queue.Empty:
+        return self.__unpackBufferedMessage(self.__recvBuffer.get(timeout))
+
+    ##
+    # @brief retrieves the next flow control from the flow control buffer, used by the sender
+    # @return list, or None if no flow control was received in time
+    def getNextFlowControlMessage(self, timeout: float = 0) -> list[int] | None:
+        return self.__fcBuffer.get(timeout)
+
+    async def getNextBufferedMessageAsync(self, timeout: float = 0) -> list[int] | None:
+        """Await the next message from the receive queue without blocking the event loop.
+
+        :param timeout: time in seconds to wait for a message
+        :return: the message, or None if nothing was received in time
+        """
+        return self.__unpackBufferedMessage(await self.__getAsync(self.__recvBuffer, self.__asyncRecvWaiters, timeout))
+
+    ##
+    # @brief splits a receive queue item into its frame, returned, and its bus timestamp, kept for the state machine
+    def __unpackBufferedMessage(self, item):
+        if item is None:
             return None
+        data, self.__lastRxTimestamp = item
+        return data
+
+    async def getNextFlowControlMessageAsync(self, timeout: float = 0) -> list[int] | None:
+        """Await the next flow control from the flow control queue without blocking the event loop.
+
+        :param timeout: time in seconds to wait for a flow control
+        :return: the flow control, or None if nothing was received in time
+        """
+        return await self.__getAsync(self.__fcBuffer, self.__asyncFcWaiters, timeout)
+
+    ##
+    # @brief takes a frame from a receive queue, the same one the blocking readers use, waiting on a future
+    # the bus callback completes instead of blocking the loop, so frames go to whichever reader is waiting
+    async def __getAsync(self, buffer, waiters, timeout):
+        item = buffer.get(0)
+        if item is not None or timeout <= 0:
+            return item
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = (loop, loop.create_future())
+            with self.__asyncWaitersLock:
+                waiters.append(waiter)
+            try:
+                # checked again once registered, a frame queued just before would not wake the waiter
+                item = buffer.get(0)
+                if item is not None:
+                    return item
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    return buffer.get(0)
+            finally:
+                with self.__asyncWaitersLock:
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+            # another reader may have taken the frame, wait again until the deadline
+            item = buffer.get(0)
+            if item is not None:
+                return item
+
+    ##
+    # @brief queues a received frame, flow controls for the sender and the others for the receiver,
+    # and wakes the asyncio readers waiting for one
+    def __bufferMessage(self, data, timestamp=None):
+        isFlowControl = len(data) > 0 and (data[N_PCI_INDEX] >> 4) == CanTpMessageType.FLOW_CONTROL
+        if isFlowControl:
+            self.__fcBuffer.put(data)
+            waiters = self.__asyncFcWaiters
+        else:
+            # the receive queue holds the bus timestamp along with each frame
+            self.__recvBuffer.put((data, timestamp))
+            waiters = self.__asyncRecvWaiters
+        if waiters:
+            self.__wakeAsyncWaiters(waiters)
+
+    ##
+    # @brief completes the futures of the asyncio readers of a queue, from the bus callback's thread
+    def __wakeAsyncWaiters(self, waiters):
+        with self.__asyncWaitersLock:
+            woken = waiters[:]
+            waiters.clear()
+        for loop, future in woken:
+            try:
+                loop.call_soon_threadsafe(self.__completeWaiter, future)
+            except RuntimeError:
+                # the loop has been closed, nobody waits on it anymore
+                pass
+
+    @staticmethod
+    def __completeWaiter(future):
+        if not future.done():
+            future.set_result(None)
+
+    @property
+    def rx_dropped_count(self) -> int:
+        """Number of received frames dropped because a receive queue was full."""
+        return sum(buffer.dropped_count for buffer in (self.__recvBuffer, self.__fcBuffer, self.__functionalBuffer))
+
+    @property
+    def rx_high_water_mark(self) -> int:
+        """Largest number of frames a receive queue held."""
+        return max(buffer.high_water_mark for buffer in (self.__recvBuffer, self.__fcBuffer, self.__functionalBuffer))
 
     ##
     # @brief the listener callback used when a message is received
     def callback_onReceive(self, msg):
-        if self.__addressingType == CanTpAddressingTypes.NORMAL:
-            if msg.arbitration_id == self.__resId:
-                self.__recvBuffer.put(list(msg.data[self.__pduStartIndex :]))
-        elif self.__addressingType == CanTpAddressingTypes.NORMAL_FIXED:
-            raise NotImplementedError("I do not know how to receive this addressing type yet")
-        elif self.__addressingType == CanTpAddressingTypes.MIXED:
-            raise NotImplementedError("I do not know how to receive this addressing type yet")
-        else:
-            raise NotImplementedError("I do not know how to receive this addressing type")
+        if not getattr(msg, "is_rx", True):
+            self.__recordTxEcho(msg)
+            return
+        if self.tracer is not None:
+            self.tracer.record(TRACE_RX, msg.arbitration_id, msg.data)
+        if self.__functionalRx and (msg.arbitration_id == self.__resId or msg.arbitration_id in self.functional_ecus):
+            rxPdu = self.__stripAddressExtension(msg.data)
+            if rxPdu is not None:
+                self.__txEchoStatistics = None
+                self.__functionalBuffer.put((msg.arbitration_id, rxPdu, msg.timestamp or None))
+        elif msg.arbitration_id == self.__resId:
+            rxPdu = self.__stripAddressExtension(msg.data)
+            if rxPdu is not None:
+                # the flow controls of the message sent come before its last frame
+                if len(rxPdu) and rxPdu[0] >> 4 != CanTpMessageType.FLOW_CONTROL:
+                    self.__txEchoStatistics = None
+                # python-can leaves the timestamp at 0 when the interface gives none
+                self.__bufferMessage(rxPdu, msg.timestamp or None)
+
+    ##
+    # @brief keeps the bus timestamp of a frame sent, given back by a bus echoing its own frames
+    #
+    # The echoes come before the response on the bus, the last one taken is the one of the last
+    # frame, the flow controls sent while receiving the response are not taken.
+    def __recordTxEcho(self, msg):
+        statistics = self.__txEchoStatistics
+        if statistics is not None and msg.timestamp and msg.arbitration_id in (self.__reqId, self.__funcReqId):
+            statistics.last_frame_echo_timestamp = msg.timestamp
+
+    ##
+    # @brief gets the PDU of a received frame, the frame buffer is used as is, without copying it
+    # @return the PDU, or None if the frame does not carry the expected address byte
+    def __stripAddressExtension(self, data):
+        if self.__rxAddressExtension is None:
+            return data
+        if len(data) > 1 and data[0] == self.__rxAddressExtension:
+            # the address byte is not part of the PDU, a view skips it without copying
+            return memoryview(data)[1:]
+        return None
 
     ##
     # @brief function to decode the StMin parameter
@@ -384,58 +1089,78 @@ class CanTp(TpInterface):
         
     @staticmethod
     def encode_stMin(val: float) -> int:
-        if (0x01 * 1e-3) <= val <= (0x7F * 1e-3):
-            # 1ms - 127ms -> 0x01 - 0x7F
-            return int(val * 1000)
+        if val == 0:
+            return 0x00
+        elif (0x01 * 1e-3) <= val <= (0x7F * 1e-3):
+            # 1ms - 127ms -> 0x01 - 0x7F, rounded since e.g. 0.0003 * 1e4 is just below 3
+            return round(val * 1000)
         elif 1e-4 <= val <= 9e-4:
             # 100us - 900us -> 0xF1 - 0xF9
-            return 0xF0 + int(val * 1e4)
+            return 0xF0 + round(val * 1e4)
         else:
             raise ValueError(
-                f"Invalid STMin time {val}, should be between 0.1 and 0.9 ms or between 1 and 127 ms"
+                f"Invalid STMin time {val}, should be 0, between 0.1 and 0.9 ms or between 1 and 127 ms"
             )
 
-    ##
-    # @brief creates the blocklist from the blocksize and payload
-    def create_blockList(self, payload, blockSize):
+    def iter_consecutive_frame_data(self, payload):
+        """Lazily cut a payload into the data of its consecutive frames.
 
-        blockList = []
-        currBlock = []
-        currPdu = []
-
-        payloadPtr = 0
-        blockPtr = 0
+        Each chunk is a slice of the payload, only the last one is copied
+        to pad it to a valid CAN FD frame length. A list payload gives
+        lists of ints, a bytes-like payload gives buffer slices.
 
+        :param payload: data remaining after the first frame
+        :return: generator of consecutive frame data chunks
+        """
         payloadLength = len(payload)
         pduLength = self.__maxPduLength
-        blockLength = blockSize * pduLength
-        working = True
-        while working:
-
+        for payloadPtr in range(0, payloadLength, pduLength):
+            currPdu = payload[payloadPtr : payloadPtr + pduLength]
             if (payloadPtr + pduLength) >= payloadLength:
-                working = False
-                curr_payload = payload[payloadPtr:]
-                currPdu = fillArray(
-                    curr_payload,
-                    self.get_padded_length(len(curr_payload) + 1) - 1,
-                    fillValue=self.PADDING_PATTERN,
-                )
-                currBlock.append(currPdu)
-                blockList.append(currBlock)
+                # the sequence number byte is not part of the chunk
+                paddedLength = self.get_padded_length(len(currPdu) + 1 + self.__pduStartIndex) - 1 - self.__pduStartIndex
+                if isinstance(payload, list):
+                    currPdu = fillArray(currPdu, paddedLength, fillValue=self.PADDING_PATTERN)
+                else:
+                    currPdu = bytearray(currPdu)
+                    currPdu.extend(bytes((self.PADDING_PATTERN,)) * (paddedLength - len(currPdu)))
+            yield currPdu
+
+    def iter_consecutive_frames(self, payload, sequence_number: int = 1):
+        """Lazily build the consecutive frames of a payload.
 
-            if working:
-                currPdu = payload[payloadPtr : payloadPtr + pduLength]
-                currBlock.append(currPdu)
-                payloadPtr += pduLength
-                blockPtr += pduLength
+        Frames are produced one at a time when the sender asks for them,
+        so each flow control only costs the frames of the next block.
 
-                if blockPtr == blockLength:
-                    blockList.append(currBlock)
-                    currBlock = []
-                    blockPtr = 0
+        :param payload: data remaining after the first frame
+        :param sequence_number: sequence number of the first frame
+        :return: generator of consecutive frames
+        """
+        for data in self.iter_consecutive_frame_data(payload):
+            yield self.make_consecutive_frame(data, sequence_number)
+            sequence_number = (sequence_number + 1) % 16
 
+    ##
+    # @brief creates the blocklist from the blocksize and payload
+    # a list payload gives lists of ints, a bytes-like payload gives buffer slices
+    def create_blockList(self, payload, blockSize):
+        blockList = []
+        for currPdu in self.iter_consecutive_frame_data(payload):
+            if not blockList or len(blockList[-1]) == blockSize:
+                blockList.append([])
+            blockList[-1].append(currPdu)
         return blockList
 
+    def pad_frame(self, frame: bytearray) -> bytearray:
+        """Pad a frame to the smallest valid CAN data length able to hold it.
+
+        :param frame: frame without the address extension byte
+        :return: the same frame, padded in place
+        """
+        paddedLength = self.get_padded_length(len(frame) + self.__pduStartIndex) - self.__pduStartIndex
+        frame.extend(bytes((self.PADDING_PATTERN,)) * (paddedLength - len(frame)))
+        return frame
+
     @staticmethod
     def get_padded_length(msg_length: int) -> int:
         """Get the size of the CAN FD message needed to send a message.
@@ -445,27 +1170,71 @@ class CanTp(TpInterface):
         """
         return next(size for size in CAN_FD_DATA_LENGTHS if size >= msg_length)
 
+    ##
+    # @brief transmits a frame, failing if the connector took longer than the N_As or N_Ar timeout
+    def __transmitWithin(
+        self,
+        timeout,
+        result,
+        data,
+        functionalReq=False,
+        use_external_snd_rcv_functions=False,
+        reqId=None,
+        statistics=None,
+    ):
+        startTime = perf_counter()
+        if reqId is None:
+            data = self.transmit(data, functionalReq, use_external_snd_rcv_functions)
+        else:
+            data = self.transmit(data, functionalReq, use_external_snd_rcv_functions, reqId=reqId)
+        transmitTime = perf_counter() - startTime
+        if transmitTime > timeout:
+            raise CanTpTimeoutError(result, f"Frame transmission took longer than {timeout} s")
+        if statistics is not None and transmitTime > statistics.max_transmit_time:
+            statistics.max_transmit_time = transmitTime
+        return data
+
+    ##
+    # @brief hands the statistics of a message to statistics_callback, if set
+    def __reportStatistics(self, statistics):
+        if self.statistics_callback is not None:
+            self.statistics_callback(statistics)
+
     ##
     # @brief transmits the data over can using can connection
+    # @param [in] functionalReq send on the functional request ID
+    # @param [in] reqId ID of a physical frame, the configured request ID by default
     def transmit(
-        self, data, functionalReq=False, use_external_snd_rcv_functions: bool = False
+        self, data, functionalReq=False, use_external_snd_rcv_functions: bool = False, reqId=None
     ):
-        # check functional request
         if functionalReq:
-            raise Exception("Functional requests are currently not supported")
+            canId = self.__funcReqId
+        else:
+            canId = self.__reqId if reqId is None else reqId
+        data = self.__addressFrame(data, functionalReq)
+        if self.tracer is not None:
+            self.tracer.record(TRACE_TX, canId, data)
+        self.__connection.transmit(data, canId)
 
-        transmitData = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+    ##
+    # @brief adds the address byte the addressing type puts in front of the frame
+    def __addressFrame(self, data, functionalReq=False):
+        addressExtension = self.__txFunctionalAddressExtension if functionalReq else self.__txAddressExtension
+        if addressExtension is None:
+            return data
+        transmitData = bytearray((addressExtension,))
+        transmitData.extend(data)
+        return transmitData
 
-        if (self.__addressingType == CanTpAddressingTypes.NORMAL) | (
-            self.__addressingType == CanTpAddressingTypes.NORMAL_FIXED
-        ):
-            transmitData = data
-        elif self.__addressingType == CanTpAddressingTypes.MIXED:
-            transmitData[0] = self.__N_AE
-            transmitData[1:] = data
-        else:
-            raise Exception("I do not know how to send this addressing type")
-        self.__connection.transmit(transmitData, self.__reqId)
+    ##
+    # @brief gets the optional transmit_many(frames, can_id) method of the connector
+    # @return None when the connector has none, or when a transmit method was overwritten
+    # since the frames would then bypass it
+    def __getTransmitMany(self):
+        transmitMany = getattr(self.__connection, "transmit_many", None)
+        if "transmit" in vars(self) or "transmit" in getattr(self.__connection, "__dict__", {}):
+            return None
+        return transmitMany
 
     @property
     def reqIdAddress(self):
@@ -483,6 +1252,48 @@ class CanTp(TpInterface):
     def resIdAddress(self, value):
         self.__resId = value
 
+    @property
+    def can_filters(self) -> list:
+        """python-can acceptance filters letting through the frames this
+        instance receives, on its response ID and the ones of the ECUs
+        answering functional requests.
+        """
+        return [self.make_can_filter(resId) for resId in dict.fromkeys([self.__resId, *self.functional_ecus])]
+
+    def make_can_filter(self, can_id: int) -> dict:
+        """Build the python-can filter matching exactly one identifier.
+
+        :param can_id: identifier to let through, 29 bit with normal fixed
+            and 29 bit mixed addressing or above 0x7FF
+        :return: filter as expected by python-can's ``set_filters``
+        """
+        extended = (
+            self.__addressingType in (CanTpAddressingTypes.NORMAL_FIXED, CanTpAddressingTypes.MIXED_29)
+            or can_id > CAN_STANDARD_ID_MASK
+        )
+        return {
+            "can_id": can_id,
+            "can_mask": CAN_EXTENDED_ID_MASK if extended else CAN_STANDARD_ID_MASK,
+            "extended": extended,
+        }
+
+    def apply_can_filters(self) -> bool:
+        """Apply :attr:`can_filters` to the bus of the connector.
+
+        The filters replace the ones of the bus, a bus shared with other
+        users is better filtered through :class:`CanTpDispatcher`.
+
+        :return: True if the filters were applied, False if the connector
+            has no python-can bus
+        """
+        return set_connector_filters(self.__connection, self.can_filters)
+
+    ##
+    # @brief the first data byte expected in received frames, None without address byte
+    @property
+    def rxAddressExtension(self):
+        return self.__rxAddressExtension
+
     @property
     def connection(self):
         return self.__connection
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import threading
+
+# largest STmin a flow control can request, 127 ms
+MAX_ST_MIN = 0.127
+
+
+##
+# @class CanTpAdaptiveStMin
+# @brief Learns the smallest receive STmin each ECU copes with
+#
+# Each successful multi-frame reception lowers the STmin asked to the ECU,
+# a lost frame or a sequence error backs off to the last value that worked
+# and stops the descent there. ECUs are told apart by their response ID,
+# one instance can be shared by several CanTp instances.
+class CanTpAdaptiveStMin:
+    def __init__(self, initial: float = 0.030, decrease_factor: float = 0.5):
+        """
+        :param initial: STmin in seconds asked to an ECU seen for the first time
+        :param decrease_factor: factor applied to the STmin after a success
+        """
+        self.initial = initial
+        self.decrease_factor = decrease_factor
+        #: STmin in seconds of the last successful reception per ECU
+        self.learned = {}
+        self.__current = {}
+        self.__floor = {}
+        self.__lock = threading.Lock()
+
+    def st_min(self, ecu: int) -> float:
+        """Get the STmin to ask for in the next flow control.
+
+        :param ecu: response ID of the ECU
+        :return: STmin in seconds
+        """
+        return self.__current.get(ecu, self.initial)
+
+    def record_success(self, ecu: int, st_min: float) -> None:
+        """Lower the STmin after a message was received without error.
+
+        :param ecu: response ID of the ECU
+        :param st_min: STmin in seconds the message was received with
+        """
+        with self.__lock:
+            self.learned[ecu] = st_min
+            lower = self.quantize(st_min * self.decrease_factor)
+            floor = self.__floor.get(ecu)
+            if floor is not None and lower <= floor:
+                # a smaller value already lost frames, stay on the one that works
+                lower = st_min
+            self.__current[ecu] = lower
+
+    def record_failure(self, ecu: int, st_min: float) -> None:
+        """Back off after a lost frame or a sequence error.
+
+        :param ecu: response ID of the ECU
+        :param st_min: STmin in seconds the failed reception was asked with
+        """
+        with self.__lock:
+            self.__floor[ecu] = max(st_min, self.__floor.get(ecu, 0))
+            learned = self.learned.get(ecu)
+            if learned is not None and learned > st_min:
+                self.__current[ecu] = learned
+            else:
+                self.__current[ecu] = self.quantize(min(max(st_min * 2, 0.001), MAX_ST_MIN))
+
+    @staticmethod
+    def quantize(st_min: float) -> float:
+        """Round an STmin down to a value a flow control can carry.
+
+        :param st_min: STmin in seconds
+        :return: 0, a multiple of 100 us below 1 ms or a multiple of 1 ms
+        """
+        if st_min < 1e-4:
+            return 0
+        elif st_min < 1e-3:
+            return int(st_min * 1e4 + 1e-9) / 1e4
+        return min(int(st_min * 1e3 + 1e-9) / 1e3, MAX_ST_MIN)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import threading
+
+from uds.uds_communications.TransportProtocols.Can.CanTp import CanTp, set_connector_filters
+
+
+##
+# @class CanTpDispatcher
+# @brief Routes the frames of one bus listener to the CanTp instances attached to it
+#
+# The response ID of each registered CanTp is mapped to its receive callback,
+# so each incoming frame costs one dictionary lookup, whatever the number of ECUs.
+# With extended and mixed addressing, ECUs sharing a response ID are told apart
+# by the first data byte, looked up with the ID in a second dictionary.
+# The response IDs of the ECUs answering functional requests, listed in
+# functional_ecus, go to the instance collecting the responses while it does.
+class CanTpDispatcher:
+    def __init__(self, connector=None):
+        """
+        :param connector: connector whose bus gets the CAN acceptance filters
+            of all registered instances each time they change, if given
+        """
+        self.__connector = connector
+        self.__routes = {}
+        self.__addressedRoutes = {}
+        # response ID of the functional_ecus of the registered instances to these instances
+        self.__functionalRoutes = {}
+        self.__owners = {}
+        # registration copies the routes, so the receive path never takes this lock
+        self.__lock = threading.Lock()
+
+    def register(self, tp: CanTp) -> None:
+        """Route the frames received on the response ID of a CanTp instance to it.
+
+        :param tp: CanTp instance to register, its response ID and its
+            functional_ecus must not change while it is registered
+
+        :raises ValueError: if another instance is registered on the same response ID
+            and address byte, or if instances with and without address byte would
+            share a response ID
+        """
+        key = (tp.resIdAddress, tp.rxAddressExtension)
+        with self.__lock:
+            owner = self.__owners.get(key)
+            if owner is not None and owner is not tp:
+                raise ValueError(f"response ID {hex(tp.resIdAddress)} is already registered")
+            if owner is None and any(
+                resId == tp.resIdAddress and (addressExtension is None) != (tp.rxAddressExtension is None)
+                for resId, addressExtension in self.__owners
+            ):
+                raise ValueError(
+                    f"response ID {hex(tp.resIdAddress)} is already registered with another addressing type"
+                )
+            if owner is None:
+                self.__owners[key] = tp
+                self.__updateRoutes(key, tp.callback_onReceive)
+                self.__updateFunctionalRoutes(tp, add=True)
+        self.__applyCanFilters()
+
+    def unregister(self, tp: CanTp) -> None:
+        """Stop routing frames to a CanTp instance.
+
+        :param tp: CanTp instance to unregister
+
+        :raises ValueError: if the instance is not registered
+        """
+        key = (tp.resIdAddress, tp.rxAddressExtension)
+        with self.__lock:
+            if self.__owners.get(key) is not tp:
+                raise ValueError(f"response ID {hex(tp.resIdAddress)} is not registered")
+            del self.__owners[key]
+            self.__updateRoutes(key, None)
+            self.__updateFunctionalRoutes(tp, add=False)
+        self.__applyCanFilters()
+
+    ##
+    # @brief replaces the route of a key by a callback, or removes it when callback is None
+    def __updateRoutes(self, key, callback):
+        resId, addressExtension = key
+        if addressExtension is None:
+            routes = dict(self.__routes)
+            routeKey = resId
+        else:
+            routes = dict(self.__addressedRoutes)
+            routeKey = key
+        if callback is None:
+            del routes[routeKey]
+        else:
+            routes[routeKey] = callback
+        if addressExtension is None:
+            self.__routes = routes
+        else:
+            self.__addressedRoutes = routes
+
+    ##
+    # @brief adds an instance to the functional routes of the response IDs of its functional_ecus, or removes it
+    def __updateFunctionalRoutes(self, tp, add):
+        routes = dict(self.__functionalRoutes)
+        for resId in tp.functional_ecus:
+            if resId == tp.resIdAddress:
+                # already routed to the instance
+                continue
+            tps = tuple(other for other in routes.get(resId, ()) if other is not tp)
+            if add:
+                tps += (tp,)
+            if tps:
+                routes[resId] = tps
+            else:
+                routes.pop(resId, None)
+        self.__functionalRoutes = routes
+
+    @property
+    def can_filters(self) -> list:
+        """python-can acceptance filters letting through the frames of all
+        registered instances, functional responses included.
+        """
+        with self.__lock:
+            tps = list(self.__owners.values())
+        filters = {}
+        for tp in tps:
+            for canFilter in tp.can_filters:
+                filters.setdefault((canFilter["can_id"], canFilter["extended"]), canFilter)
+        return list(filters.values())
+
+    ##
+    # @brief sets the filters of all registered instances on the connector's bus, if there is one
+    def __applyCanFilters(self):
+        if self.__connector is not None:
+            set_connector_filters(self.__connector, self.can_filters)
+
+    @property
+    def registeredIds(self) -> list:
+        with self.__lock:
+            return list(dict.fromkeys(resId for resId, _ in self.__owners))
+
+    ##
+    # @brief the listener callback to be called for every frame received on the bus
+    def callback_onReceive(self, msg):
+        collectors = self.__functionalRoutes.get(msg.arbitration_id)
+        if collectors is not None:
+            collecting = [tp for tp in collectors if tp.functional_rx]
+            if collecting:
+                for tp in collecting:
+                    tp.callback_onReceive(msg)
+                return
+        callback = self.__routes.get(msg.arbitration_id)
+        if callback is None:
+            if not msg.data:
+                return
+            callback = self.__addressedRoutes.get((msg.arbitration_id, msg.data[0]))
+            if callback is None:
+                return
+        callback(msg)
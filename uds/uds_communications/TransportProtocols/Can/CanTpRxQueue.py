@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import queue
+import threading
+from collections import deque
+from time import perf_counter
+
+#: what a full receive queue does with a new frame
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+##
+# @class RxQueueBase
+# @brief Capacity, overflow policy and counters shared by the receive queues
+#
+# All receive queues share the same interface: put, get with a timeout giving
+# None when nothing came in, get_nowait raising queue.Empty, empty and clear.
+# A capacity of 0 leaves the queue unbounded, otherwise a frame coming in when
+# it is full either replaces the oldest one or is dropped.
+class RxQueueBase:
+    def __init__(self, capacity: int = 0, overflow: str = DROP_OLDEST):
+        """
+        :param capacity: largest number of frames held, 0 for no limit
+        :param overflow: DROP_OLDEST or DROP_NEWEST, frame given up when full
+        """
+        if capacity < 0:
+            raise ValueError(f"Invalid receive queue capacity {capacity}")
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Invalid receive queue overflow {overflow!r}, should be {DROP_OLDEST!r} or {DROP_NEWEST!r}")
+        self.capacity = capacity
+        self.overflow = overflow
+        #: frames given up because the queue was full
+        self.dropped_count = 0
+        #: largest number of frames the queue held
+        self.high_water_mark = 0
+
+
+##
+# @class LockedRxQueue
+# @brief Receive queue on queue.Queue, each frame takes its lock and condition
+class LockedRxQueue(RxQueueBase):
+    def __init__(self, capacity: int = 0, overflow: str = DROP_OLDEST):
+        super().__init__(capacity, overflow)
+        self.__queue = queue.Queue()
+
+    def put(self, item) -> None:
+        # the frames are handled under the queue's own lock, as queue.Queue.put does
+        rxQueue = self.__queue
+        with rxQueue.not_empty:
+            if self.capacity and len(rxQueue.queue) >= self.capacity:
+                self.dropped_count += 1
+                if self.overflow == DROP_NEWEST:
+                    return
+                rxQueue.queue.popleft()
+            rxQueue.queue.append(item)
+            rxQueue.not_empty.notify()
+            if len(rxQueue.queue) > self.high_water_mark:
+                self.high_water_mark = len(rxQueue.queue)
+
+    def get(self, timeout: float = 0):
+        try:
+            return self.__queue.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        return self.__queue.get_nowait()
+
+    def empty(self) -> bool:
+        return self.__queue.empty()
+
+    def clear(self) -> None:
+        with self.__queue.mutex:
+            self.__queue.queue.clear()
+
+
+##
+# @class SimpleRxQueue
+# @brief Receive queue on queue.SimpleQueue, implemented in C without task tracking
+#
+# With a capacity, frames are dropped from the writer's side without a lock, a
+# reader taking a frame at the same time may leave the queue one frame short.
+class SimpleRxQueue(RxQueueBase):
+    def __init__(self, capacity: int = 0, overflow: str = DROP_OLDEST):
+        super().__init__(capacity, overflow)
+        self.__queue = queue.SimpleQueue()
+
+    def put(self, item) -> None:
+        if self.capacity and self.__queue.qsize() >= self.capacity:
+            self.dropped_count += 1
+            if self.overflow == DROP_NEWEST:
+                return
+            try:
+                self.__queue.get_nowait()
+            except queue.Empty:
+                pass
+        self.__queue.put(item)
+        size = self.__queue.qsize()
+        if size > self.high_water_mark:
+            self.high_water_mark = size
+
+    def get(self, timeout: float = 0):
+        try:
+            if timeout <= 0:
+                return self.__queue.get_nowait()
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        return self.__queue.get_nowait()
+
+    def empty(self) -> bool:
+        return self.__queue.empty()
+
+    def clear(self) -> None:
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+##
+# @class DequeRxQueue
+# @brief Receive queue on collections.deque, the condition is only taken when a reader waits
+#
+# deque appends and pops are atomic, so a frame is queued without any lock when
+# nobody is blocked on the queue. A reader announces itself before checking the
+# queue a last time, a writer seeing no reader is then sure its frame is seen.
+# With a capacity, the deque's maxlen drops the oldest frame in the same append.
+class DequeRxQueue(RxQueueBase):
+    def __init__(self, capacity: int = 0, overflow: str = DROP_OLDEST):
+        super().__init__(capacity, overflow)
+        self.__items = deque(maxlen=capacity or None)
+        self.__ready = threading.Condition(threading.Lock())
+        self.__waiting = 0
+
+    def put(self, item) -> None:
+        if self.capacity and len(self.__items) >= self.capacity:
+            self.dropped_count += 1
+            if self.overflow == DROP_NEWEST:
+                return
+        self.__items.append(item)
+        if len(self.__items) > self.high_water_mark:
+            self.high_water_mark = len(self.__items)
+        if self.__waiting:
+            with self.__ready:
+                self.__ready.notify()
+
+    def get(self, timeout: float = 0):
+        try:
+            return self.__items.popleft()
+        except IndexError:
+            if timeout <= 0:
+                return None
+        deadline = perf_counter() + timeout
+        with self.__ready:
+            self.__waiting += 1
+            try:
+                while True:
+                    try:
+                        return self.__items.popleft()
+                    except IndexError:
+                        remaining = deadline - perf_counter()
+                        if remaining <= 0:
+                            return None
+                        self.__ready.wait(remaining)
+            finally:
+                self.__waiting -= 1
+
+    def get_nowait(self):
+        try:
+            return self.__items.popleft()
+        except IndexError:
+            raise queue.Empty from None
+
+    def empty(self) -> bool:
+        return not self.__items
+
+    def clear(self) -> None:
+        self.__items.clear()
+
+
+#: receive queue implementations selectable with IsoTpConfig.rx_queue
+RX_QUEUE_TYPES = {
+    "queue": LockedRxQueue,
+    "simple": SimpleRxQueue,
+    "deque": DequeRxQueue,
+}
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import csv
+import threading
+from array import array
+from datetime import datetime
+from time import perf_counter_ns
+from typing import NamedTuple
+
+TRACE_RX = 0
+TRACE_TX = 1
+
+# data lengths a CAN FD frame can carry, indexed by DLC
+_CAN_FD_DATA_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+
+class TracedFrame(NamedTuple):
+    #: perf_counter_ns value when the frame was recorded
+    timestamp_ns: int
+    #: TRACE_RX or TRACE_TX
+    direction: int
+    can_id: int
+    data: bytes
+
+    @property
+    def is_extended_id(self) -> bool:
+        return self.can_id > 0x7FF
+
+
+##
+# @class CanTpTracer
+# @brief Records the last frames sent and received in preallocated arrays
+#
+# The buffers are allocated once, recording a frame only stores its fields in
+# the next slot, overwriting the oldest frame once the buffer is full. Nothing
+# is formatted before the trace is exported.
+class CanTpTracer:
+    def __init__(self, capacity: int = 4096, max_data_length: int = 64):
+        """
+        :param capacity: number of frames kept
+        :param max_data_length: bytes kept per frame, longer frames are truncated
+        """
+        if capacity <= 0:
+            raise ValueError(f"Tracer capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.max_data_length = max_data_length
+        self.__timestamps = array("q", bytes(8 * capacity))
+        self.__ids = array("L", [0]) * capacity
+        self.__directions = bytearray(capacity)
+        self.__lengths = bytearray(capacity)
+        self.__data = bytearray(capacity * max_data_length)
+        self.__recorded = 0
+        self.__lock = threading.Lock()
+
+    def record(self, direction: int, can_id: int, data) -> None:
+        """Store a frame, overwriting the oldest one when the buffer is full.
+
+        :param direction: TRACE_RX or TRACE_TX
+        :param can_id: arbitration ID of the frame
+        :param data: frame data as bytes, bytearray, memoryview or list
+        """
+        timestamp = perf_counter_ns()
+        length = min(len(data), self.max_data_length)
+        with self.__lock:
+            slot = self.__recorded % self.capacity
+            self.__recorded += 1
+            self.__timestamps[slot] = timestamp
+            self.__ids[slot] = can_id
+            self.__directions[slot] = direction
+            self.__lengths[slot] = length
+            offset = slot * self.max_data_length
+            self.__data[offset : offset + length] = data[:length]
+
+    def __len__(self) -> int:
+        return min(self.__recorded, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        """Number of frames overwritten since the tracer was created or cleared."""
+        return max(self.__recorded - self.capacity, 0)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__recorded = 0
+
+    def frames(self) -> list:
+        """Get the frames held, oldest first.
+
+        :return: list of TracedFrame
+        """
+        with self.__lock:
+            recorded = self.__recorded
+            count = min(recorded, self.capacity)
+            frames = []
+            for slot in (i % self.capacity for i in range(recorded - count, recorded)):
+                offset = slot * self.max_data_length
+                frames.append(
+                    TracedFrame(
+                        self.__timestamps[slot],
+                        self.__directions[slot],
+                        self.__ids[slot],
+                        bytes(self.__data[offset : offset + self.__lengths[slot]]),
+                    )
+                )
+        return frames
+
+    def write_csv(self, path) -> None:
+        """Write the frames held to a CSV file, one frame per row.
+
+        :param path: file to write
+        """
+        with open(path, "w", newline="") as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(["timestamp_ns", "direction", "can_id", "dlc", "data"])
+            for frame in self.frames():
+                writer.writerow(
+                    [
+                        frame.timestamp_ns,
+                        "Tx" if frame.direction == TRACE_TX else "Rx",
+                        f"{frame.can_id:X}",
+                        len(frame.data),
+                        " ".join(f"{byte:02X}" for byte in frame.data),
+                    ]
+                )
+
+    def write_asc(self, path, channel: int = 1) -> None:
+        """Write the frames held to a Vector ASC file, times relative to the oldest frame.
+
+        :param path: file to write
+        :param channel: CAN channel written on each line
+        """
+        frames = self.frames()
+        start = frames[0].timestamp_ns if frames else 0
+        now = datetime.now()
+        date = f"{now:%a %b %d %I:%M:%S}.{now.microsecond // 1000:03d} {now:%p %Y}"
+        with open(path, "w") as ascFile:
+            ascFile.write(f"date {date}\n")
+            ascFile.write("base hex  timestamps absolute\n")
+            ascFile.write("internal events logged\n")
+            ascFile.write(f"Begin Triggerblock {date}\n")
+            for frame in frames:
+                ascFile.write(self.__ascLine(frame, (frame.timestamp_ns - start) / 1e9, channel))
+            ascFile.write("End TriggerBlock\n")
+
+    ##
+    # @brief formats a frame as a classic CAN or a CAN FD line of an ASC file
+    @staticmethod
+    def __ascLine(frame, time, channel):
+        canId = f"{frame.can_id:X}x" if frame.is_extended_id else f"{frame.can_id:X}"
+        direction = "Tx" if frame.direction == TRACE_TX else "Rx"
+        data = " ".join(f"{byte:02X}" for byte in frame.data)
+        if len(frame.data) <= 8:
+            return f"{time:>11.6f} {channel}  {canId:<15} {direction:<4} d {len(frame.data)} {data}\n"
+        # frames longer than 8 bytes can only be CAN FD, padded to a valid length by the sender
+        dlc = next(
+            (dlc for dlc, length in enumerate(_CAN_FD_DATA_LENGTHS) if length >= len(frame.data)), 15
+        )
+        return (
+            f"{time:>11.6f} CANFD {channel:>3} {direction:<4} {canId:>8} {'':>32} 0 0 {dlc:x} "
+            f"{len(frame.data):>2} {data} {0:>8} {0:>4} {0x1000:>8X} {0:>8} {0:>8} {0:>8} {0:>8} {0:>8}\n"
+        )
@@ -10,7 +10,10 @@ __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
 
+from array import array
+from dataclasses import dataclass, field
 from enum import Enum, IntEnum
+from typing import List, Optional
 
 
 class N_Result(Enum):
@@ -25,11 +28,84 @@ class N_Result(Enum):
     N_ERROR = 8
 
 
+class CanTpError(Exception):
+    """ISO-TP transfer failure, ``result`` gives its N_Result."""
+
+    def __init__(self, result: N_Result, message: str = ""):
+        super().__init__(message or result.name)
+        self.result = result
+
+
+class CanTpTimeoutError(CanTpError, TimeoutError):
+    """ISO-TP timeout, ``result`` tells which of N_As/N_Ar, N_Bs or N_Cr expired."""
+
+
+@dataclass
+class TransferStatistics:
+    """Statistics of a message sent or received by CanTp.
+
+    Times are in seconds, taken with ``perf_counter`` when CanTp handles
+    a frame.
+    """
+
+    #: length of the payload
+    payload_length: int = 0
+    #: True for a sent message, False for a received one
+    sent: bool = True
+    #: number of flow control frames received when sending, the FS=WAIT
+    #: ones included, or sent when receiving
+    flow_control_count: int = 0
+    #: time from the first frame to each FS=WAIT flow control
+    wait_times: List[float] = field(default_factory=list)
+    #: when sending, time from the first frame or the last frame of a block
+    #: to the flow control answering it (N_Bs), when receiving, time from
+    #: each flow control sent to the next consecutive frame
+    flow_control_latencies: List[float] = field(default_factory=list)
+    #: STmin asked in the last flow control
+    st_min: Optional[float] = None
+    #: time between consecutive frames of a block, flow controls excluded,
+    #: blocks handed at once to the connector's transmit_many are not timed
+    cf_gaps: array = field(default_factory=lambda: array("d"))
+    #: longest time the connector took to transmit a frame (N_As or N_Ar)
+    max_transmit_time: float = 0.0
+    #: time from the first frame to the last one
+    total_time: float = 0.0
+    #: bus timestamps (python-can ``msg.timestamp``) of the first and last
+    #: frame received, for a sent message the host ``time.time()`` before
+    #: the first frame and after the last one, None when unknown
+    first_frame_timestamp: Optional[float] = None
+    last_frame_timestamp: Optional[float] = None
+    #: for a sent message, bus timestamp of the echo of its last frame when
+    #: the bus gives back the frames sent (python-can
+    #: ``receive_own_messages``), None otherwise
+    last_frame_echo_timestamp: Optional[float] = None
+
+    @property
+    def wait_count(self) -> int:
+        return len(self.wait_times)
+
+    @property
+    def mean_cf_gap(self) -> Optional[float]:
+        return sum(self.cf_gaps) / len(self.cf_gaps) if self.cf_gaps else None
+
+    @property
+    def max_cf_gap(self) -> Optional[float]:
+        return max(self.cf_gaps) if self.cf_gaps else None
+
+    @property
+    def st_min_jitter(self) -> Optional[float]:
+        """Mean time the consecutive frames were spaced beyond the STmin asked."""
+        if not self.cf_gaps or self.st_min is None:
+            return None
+        return sum(self.cf_gaps) / len(self.cf_gaps) - self.st_min
+
+
 class CanTpAddressingTypes(Enum):
     NORMAL = 0
     NORMAL_FIXED = 1
     EXTENDED = 2
     MIXED = 3
+    MIXED_29 = 4
 
 
 ##
@@ -65,12 +141,17 @@ class CanTpMTypes(Enum):
 
 
 CANTP_MAX_PAYLOAD_LENGTH = 4095  # hardcoded maximum based on the ISO 15765 standard
+CANTP_MAX_ESCAPE_PAYLOAD_LENGTH = 0xFFFFFFFF  # maximum with the ISO 15765-2:2016 FF_DL escape sequence
 N_PCI_INDEX = 0
 SINGLE_FRAME_DL_INDEX = 0
 SINGLE_FRAME_DATA_START_INDEX = 1
+SINGLE_FRAME_ESCAPE_DL_INDEX = 1
+SINGLE_FRAME_ESCAPE_DATA_START_INDEX = 2
 FIRST_FRAME_DL_INDEX_HIGH = 0
 FIRST_FRAME_DL_INDEX_LOW = 1
 FIRST_FRAME_DATA_START_INDEX = 2
+FIRST_FRAME_ESCAPE_DL_INDEX = 2
+FIRST_FRAME_ESCAPE_DATA_START_INDEX = 6
 FC_BS_INDEX = 1
 FC_STMIN_INDEX = 2
 CONSECUTIVE_FRAME_SEQUENCE_NUMBER_INDEX = 0
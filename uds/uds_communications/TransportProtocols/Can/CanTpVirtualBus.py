@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+
+from __future__ import annotations
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import heapq
+import logging
+import queue
+import random
+import threading
+import time
+from itertools import count
+from typing import Callable
+
+import can
+
+from uds.uds_communications.TransportProtocols.Can.CanTp import CAN_FD_DATA_LENGTHS, CanTp
+from uds.uds_communications.TransportProtocols.Can.CanTpTypes import CanTpFsTypes, CanTpMessageType
+
+log = logging.getLogger(__name__)
+
+
+##
+# @class VirtualCanBus
+# @brief In-process CAN bus delivering each frame to all attached nodes but its sender
+#
+# Without impairments a frame is delivered in the sender's thread before its
+# transmit call returns. Latency, jitter and reordered frames go through a
+# delivery thread ordering the frames by due time. The impairments are drawn
+# from a seeded random generator so a run can be repeated.
+class VirtualCanBus:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss_rate: float = 0.0,
+        reorder_rate: float = 0.0,
+        reorder_delay: float = 0.001,
+        seed: int = 0,
+    ):
+        """
+        :param latency: time in seconds a frame takes to reach the other nodes
+        :param jitter: largest random delay in seconds added to the latency,
+            frames still arrive in the order they were sent
+        :param loss_rate: probability of a frame being dropped
+        :param reorder_rate: probability of a frame being held back by
+            reorder_delay, so the following frames overtake it
+        :param reorder_delay: time in seconds a reordered frame is held back
+        :param seed: seed of the random generator drawing the impairments
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss_rate = loss_rate
+        self.reorder_rate = reorder_rate
+        self.reorder_delay = reorder_delay
+        #: frames sent, lost and reordered since the bus was created
+        self.sent_count = 0
+        self.lost_count = 0
+        self.reordered_count = 0
+        self.__random = random.Random(seed)
+        self.__nodes = ()
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__lastDue = 0.0
+        self.__sequence = count()
+        self.__ready = threading.Condition(threading.Lock())
+        self.__deliveryThread = None
+        self.__running = False
+
+    def attach(self, node) -> None:
+        """Connect a node, its ``receive(msg)`` method gets the frames of the other nodes.
+
+        :param node: VirtualCanConnector, SimulatedIsoTpEcu or any object with a receive method
+        """
+        with self.__lock:
+            self.__nodes = self.__nodes + (node,)
+
+    def detach(self, node) -> None:
+        with self.__lock:
+            self.__nodes = tuple(attached for attached in self.__nodes if attached is not node)
+
+    def send(self, msg: can.Message, sender=None) -> None:
+        """Put a frame on the bus.
+
+        :param msg: frame to deliver
+        :param sender: node the frame comes from, it does not receive it back
+        """
+        with self.__lock:
+            self.sent_count += 1
+            if self.loss_rate and self.__random.random() < self.loss_rate:
+                self.lost_count += 1
+                return
+            delay = self.latency
+            if self.jitter:
+                delay += self.__random.uniform(0, self.jitter)
+            reordered = self.reorder_rate and self.__random.random() < self.reorder_rate
+            if reordered:
+                self.reordered_count += 1
+                delay += self.reorder_delay
+        if delay <= 0:
+            self.__deliver(msg, sender)
+            return
+        with self.__ready:
+            due = time.perf_counter() + delay
+            if not reordered:
+                # a CAN bus keeps the frames in order, only the ones held back are overtaken
+                due = max(due, self.__lastDue)
+                self.__lastDue = due
+            heapq.heappush(self.__pending, (due, next(self.__sequence), msg, sender))
+            self.__startDelivery()
+            self.__ready.notify()
+
+    def shutdown(self) -> None:
+        """Stop the delivery thread, frames still in flight are dropped."""
+        with self.__ready:
+            self.__running = False
+            self.__pending.clear()
+            self.__ready.notify()
+        if self.__deliveryThread is not None:
+            self.__deliveryThread.join()
+            self.__deliveryThread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    ##
+    # @brief hands a frame to all nodes but its sender, stamped with the delivery time
+    def __deliver(self, msg, sender):
+        msg.timestamp = time.time()
+        for node in self.__nodes:
+            if node is not sender:
+                node.receive(msg)
+
+    ##
+    # @brief starts the delivery thread if it is not running, called with __ready held
+    def __startDelivery(self):
+        if self.__running:
+            return
+        self.__running = True
+        self.__deliveryThread = threading.Thread(target=self.__deliveryLoop, name="VirtualCanBus", daemon=True)
+        self.__deliveryThread.start()
+
+    def __deliveryLoop(self):
+        while True:
+            with self.__ready:
+                while self.__running:
+                    if self.__pending:
+                        remaining = self.__pending[0][0] - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        self.__ready.wait(remaining)
+                    else:
+                        self.__ready.wait()
+                if not self.__running:
+                    return
+                _, _, msg, sender = heapq.heappop(self.__pending)
+            self.__deliver(msg, sender)
+
+
+##
+# @class VirtualCanConnector
+# @brief Connector giving a CanTp instance access to a VirtualCanBus
+#
+# Frames received from the bus are passed to the listener, usually the
+# callback_onReceive method of the CanTp instance.
+class VirtualCanConnector:
+    def __init__(self, bus: VirtualCanBus, listener: Callable[[can.Message], None] | None = None):
+        """
+        :param bus: bus to send on and receive from
+        :param listener: callable getting each frame received
+        """
+        self.virtual_bus = bus
+        self.listener = listener
+        bus.attach(self)
+
+    def transmit(self, data, reqId: int) -> None:
+        self.virtual_bus.send(make_message(reqId, data), self)
+
+    def transmit_many(self, frames: list, can_id: int) -> None:
+        for data in frames:
+            self.virtual_bus.send(make_message(can_id, data), self)
+
+    def receive(self, msg: can.Message) -> None:
+        if self.listener is not None:
+            self.listener(msg)
+
+
+def make_message(can_id: int, data) -> can.Message:
+    """Build the python-can message of a frame, 29 bit above 0x7FF and CAN FD above 8 bytes.
+
+    :param can_id: arbitration ID
+    :param data: frame data, copied
+    :return: the message
+    """
+    return can.Message(
+        arbitration_id=can_id,
+        data=bytes(data),
+        is_extended_id=can_id > 0x7FF,
+        is_fd=len(data) > 8,
+    )
+
+
+##
+# @class SimulatedIsoTpEcu
+# @brief ECU on a VirtualCanBus answering ISO-TP requests from its own thread
+#
+# Requests are reassembled with the configured block size and STmin, the
+# flow controls can be preceded by FS=WAIT ones. The handler gets the whole
+# request and gives the response, sent following the tester's flow controls.
+# Only normal addressing is simulated.
+class SimulatedIsoTpEcu:
+    def __init__(
+        self,
+        bus: VirtualCanBus,
+        rx_id: int,
+        tx_id: int,
+        handler: Callable[[bytes], bytes | None] | None = None,
+        block_size: int = 0,
+        st_min: float = 0.0,
+        wait_count: int = 0,
+        tx_dl: int = 8,
+        response_delay: float = 0.0,
+        timeout: float = 1.0,
+        padding: int = 0x00,
+    ):
+        """
+        :param bus: bus the ECU is attached to
+        :param rx_id: ID the requests are received on
+        :param tx_id: ID the responses and flow controls are sent on
+        :param handler: gives the response to a request, None sends no
+            response, echoes the request as positive response by default
+        :param block_size: block size asked in the flow controls
+        :param st_min: STmin in seconds asked in the flow controls
+        :param wait_count: FS=WAIT flow controls sent before each one letting
+            the tester continue
+        :param tx_dl: CAN frame data length of the frames sent
+        :param response_delay: time in seconds between a request and its response
+        :param timeout: N_Bs and N_Cr of the ECU, in seconds
+        :param padding: byte the frames are padded with
+        """
+        if tx_dl not in CAN_FD_DATA_LENGTHS:
+            raise ValueError(f"Invalid TX_DL {tx_dl}, should be one of {CAN_FD_DATA_LENGTHS}")
+        self.bus = bus
+        self.rx_id = rx_id
+        self.tx_id = tx_id
+        self.handler = handler if handler is not None else self.positive_response
+        self.block_size = block_size
+        self.st_min = st_min
+        self.wait_count = wait_count
+        self.tx_dl = tx_dl
+        self.response_delay = response_delay
+        self.timeout = timeout
+        self.padding = padding
+        #: requests received, in order
+        self.requests = []
+        self.__rxQueue = queue.SimpleQueue()
+        self.__thread = None
+        self.__running = False
+        bus.attach(self)
+
+    @staticmethod
+    def positive_response(request: bytes) -> bytes:
+        """Echo a request with the positive response service ID."""
+        return bytes([request[0] + 0x40]) + request[1:]
+
+    def start(self) -> None:
+        if self.__thread is None:
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__run, name=f"SimulatedIsoTpEcu {self.rx_id:X}", daemon=True)
+            self.__thread.start()
+
+    def stop(self) -> None:
+        if self.__thread is not None:
+            self.__running = False
+            self.__rxQueue.put(None)
+            self.__thread.join()
+            self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.bus.detach(self)
+
+    def receive(self, msg: can.Message) -> None:
+        if msg.arbitration_id == self.rx_id:
+            self.__rxQueue.put(bytes(msg.data))
+
+    def __getFrame(self, timeout=None):
+        try:
+            frame = self.__rxQueue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if frame is None:
+            # woken up by stop
+            self.__running = False
+        return frame
+
+    def __run(self):
+        while self.__running:
+            frame = self.__getFrame()
+            if not frame:
+                continue
+            pci = frame[0] >> 4
+            if pci == CanTpMessageType.SINGLE_FRAME:
+                length = frame[0] & 0x0F
+                if length:
+                    request = frame[1 : 1 + length]
+                else:
+                    request = frame[2 : 2 + frame[1]]
+            elif pci == CanTpMessageType.FIRST_FRAME:
+                request = self.__receiveSegmented(frame)
+            else:
+                # consecutive frames out of a reception and stray flow controls
+                continue
+            if request is None:
+                continue
+            self.requests.append(request)
+            response = self.handler(request)
+            if response is None:
+                continue
+            if self.response_delay:
+                time.sleep(self.response_delay)
+            self.__sendMessage(response)
+
+    ##
+    # @brief reassembles a message started by a first frame
+    # @return the message, or None when a frame is lost or out of sequence
+    def __receiveSegmented(self, firstFrame):
+        length = ((firstFrame[0] & 0x0F) << 8) | firstFrame[1]
+        if length:
+            data = bytearray(firstFrame[2:])
+        else:
+            length = int.from_bytes(firstFrame[2:6], "big")
+            data = bytearray(firstFrame[6:])
+        sequenceNumber = 1
+        while True:
+            self.__sendFlowControl()
+            blockFrames = 0
+            while len(data) < length and (self.block_size == 0 or blockFrames < self.block_size):
+                frame = self.__getFrame(self.timeout)
+                if frame is None:
+                    log.warning("Simulated ECU timed out waiting for a consecutive frame")
+                    return None
+                if frame[0] >> 4 != CanTpMessageType.CONSECUTIVE_FRAME or frame[0] & 0x0F != sequenceNumber:
+                    log.warning(f"Simulated ECU got frame {frame.hex()} instead of consecutive frame {sequenceNumber}")
+                    return None
+                data.extend(frame[1:])
+                sequenceNumber = (sequenceNumber + 1) & 0x0F
+                blockFrames += 1
+            if len(data) >= length:
+                return bytes(data[:length])
+
+    def __sendFlowControl(self):
+        for _ in range(self.wait_count):
+            self.__sendFrame([0x30 | CanTpFsTypes.WAIT, 0, 0])
+        self.__sendFrame([0x30 | CanTpFsTypes.CONTINUE_TO_SEND, self.block_size, CanTp.encode_stMin(self.st_min)])
+
+    ##
+    # @brief sends a message as single frame or segmented, following the tester's flow controls
+    def __sendMessage(self, payload):
+        if len(payload) <= 7:
+            self.__sendFrame(bytes([len(payload)]) + payload)
+            return
+        if len(payload) <= self.tx_dl - 2:
+            self.__sendFrame(bytes([0x00, len(payload)]) + payload)
+            return
+        if len(payload) <= 0xFFF:
+            header = bytes([0x10 | (len(payload) >> 8), len(payload) & 0xFF])
+        else:
+            header = bytes([0x10, 0x00]) + len(payload).to_bytes(4, "big")
+        offset = self.tx_dl - len(header)
+        self.__sendFrame(header + payload[:offset])
+        sequenceNumber = 1
+        while offset < len(payload):
+            flowControl = self.__waitFlowControl()
+            if flowControl is None:
+                return
+            blockSize, stMin = flowControl
+            blockFrames = 0
+            while offset < len(payload) and (blockSize == 0 or blockFrames < blockSize):
+                if blockFrames:
+                    time.sleep(stMin)
+                end = offset + self.tx_dl - 1
+                self.__sendFrame(bytes([0x20 | sequenceNumber]) + payload[offset:end])
+                offset = end
+                sequenceNumber = (sequenceNumber + 1) & 0x0F
+                blockFrames += 1
+
+    ##
+    # @brief waits for a flow control letting the ECU send, going through the FS=WAIT ones
+    # @return (block size, STmin), or None when the tester timed out or refused the message
+    def __waitFlowControl(self):
+        while True:
+            frame = self.__getFrame(self.timeout)
+            if frame is None:
+                log.warning("Simulated ECU timed out waiting for a flow control")
+                return None
+            if frame[0] >> 4 != CanTpMessageType.FLOW_CONTROL:
+                continue
+            fs = frame[0] & 0x0F
+            if fs == CanTpFsTypes.CONTINUE_TO_SEND:
+                return frame[1], CanTp.decode_stMin(frame[2])
+            elif fs == CanTpFsTypes.OVERFLOW:
+                return None
+
+    def __sendFrame(self, data):
+        data = bytes(data)
+        if self.tx_dl == 8 or len(data) <= 8:
+            paddedLength = 8
+        else:
+            paddedLength = next(length for length in CAN_FD_DATA_LENGTHS if length >= len(data))
+        data += bytes([self.padding]) * (paddedLength - len(data))
+        self.bus.send(make_message(self.tx_id, data), self)
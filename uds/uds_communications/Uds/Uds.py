@@ -9,22 +9,63 @@ __maintainer__ = "Richard Clubb"
 __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
+import asyncio
 import time
 import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from typing import Callable
 
 from uds.config import Config
 from uds.factories import TpFactory
+from uds.uds_communications.Uds.UdsTiming import UdsResponseTiming
 from uds.uds_config_tool.IHexFunctions import ihexFile as ihexFileParser
 from uds.uds_config_tool.ISOStandard.ISOStandard import IsoDataFormatIdentifier
 from uds.uds_config_tool.UdsConfigTool import UdsTool
 
 
+##
+# @brief stands in for a Uds instance while a service runs in a worker thread,
+# its sends are awaited on the event loop with send_async
+class _AsyncServiceTarget(object):
+    def __init__(self, uds, loop):
+        self.__uds = uds
+        self.__loop = loop
+
+    def send(self, msg, responseRequired=True, functionalReq=False, tpWaitTime=0.01, asBytes=False):
+        return asyncio.run_coroutine_threadsafe(
+            self.__uds.send_async(msg, responseRequired, functionalReq, asBytes), self.__loop
+        ).result()
+
+    def __getattr__(self, name):
+        return getattr(self.__uds, name)
+
+
 ##
 # @brief a description is needed
 class Uds(object):
 
+    # services bound from the odx file that get an awaitable <service>_async counterpart
+    asyncServices = [
+        "diagnosticSessionControl",
+        "ecuReset",
+        "readDataByIdentifier",
+        "securityAccess",
+        "writeDataByIdentifier",
+        "routineControl",
+        "requestDownload",
+        "requestUpload",
+        "transferData",
+        "transferExit",
+        "testerPresent",
+        "clearDTC",
+        "readDTC",
+        "inputOutputControl",
+    ]
+    # services run at once by call_service_async on an instance, each one holds a worker thread
+    asyncServiceWorkers = 8
+
     ##
     # @brief a constructor
     # @param [in] reqId The request ID used by the UDS connection, defaults to None if not used
@@ -32,8 +73,14 @@ class Uds(object):
     def __init__(self, odx=None, ihexFile=None, **kwargs):
 
         self.__transportProtocol = Config.uds.transport_protocol
-        self.__P2_CAN_Client = Config.uds.p2_can_client
-        self.__P2_CAN_Server = Config.uds.p2_can_server
+        #: P2, P2* and deadline applied while waiting for responses
+        self.timing = UdsResponseTiming(
+            Config.uds.p2_can_client,
+            Config.uds.p2_star_can_client,
+            Config.uds.response_deadline,
+            Config.uds.learn_response_timeouts,
+            Config.uds.p2_can_server,
+        )
 
         self.tp = TpFactory.select_transport_protocol(
             self.__transportProtocol, **kwargs
@@ -41,12 +88,23 @@ class Uds(object):
 
         self.last_resp_time = None
         self.last_pending_resp_times = []
+        # time from the last request frame to the last response frame, from bus timestamps,
+        # and time the response then took to be handed over by the transport protocol
+        self.last_resp_bus_time = None
+        self.last_resp_overhead = None
 
         # used as a semaphore for the tester present
         self.__transmissionActive_flag = False
 
         # The above flag should prevent testerPresent operation, but in case of race conditions, this lock prevents actual overlapo in the sending
         self.sendLock = threading.Lock()
+        # asyncio counterpart of sendLock, created for the loop running send_async
+        self.__asyncSendLock = None
+        # single worker sending the requests queued with submit in order, created by the first one
+        self.__requestExecutor = None
+        self.__requestExecutorLock = threading.Lock()
+        # workers of call_service_async, created by the first call
+        self.__serviceExecutor = None
 
         # Process any ihex file that has been associated with the ecu at initialisation
         self.__ihexFile = ihexFileParser(ihexFile) if ihexFile is not None else None
@@ -62,6 +120,89 @@ class Uds(object):
             return
         UdsTool.create_service_containers(odx_file)
         UdsTool.bind_containers(self)
+        for service in self.asyncServices:
+            if hasattr(self, service):
+                setattr(self, f"{service}_async", partial(self.call_service_async, service))
+
+    async def call_service_async(self, service: str, *args, executor: Executor = None, **kwargs):
+        """Await a service bound from the odx file.
+
+        The service encodes its request and decodes its response in a
+        worker thread of the instance, every request it sends goes through
+        :meth:`send_async` on the event loop. At most
+        :attr:`asyncServiceWorkers` services of an instance run at once, the
+        next ones wait for a free worker. The loop's default executor is
+        left to the blocking receive methods awaited by send_async, e.g.
+        the one of :meth:`overwrite_receive_method`, which the services wait
+        for.
+
+        :param service: name of the bound service, e.g. "readDataByIdentifier"
+        :param executor: executor running the service instead of the
+            instance's workers, it must not be the loop's default executor
+        :return: the value returned by the service
+        """
+        loop = asyncio.get_running_loop()
+        serviceFunction = getattr(self, service).__func__
+        target = _AsyncServiceTarget(self, loop)
+        if executor is None:
+            executor = self.__getServiceExecutor()
+        return await loop.run_in_executor(executor, partial(serviceFunction, target, *args, **kwargs))
+
+    def submit(self, msg, responseRequired=True, functionalReq=False, asBytes=False) -> Future:
+        """Queue a request, sent with :meth:`send` once the ones queued before it are answered.
+
+        The requests are sent one at a time by a worker thread of this
+        instance, the caller can prepare the next request meanwhile.
+
+        :param msg: the request, a list of ints or a bytes-like object
+        :return: future of the response, or of the exception raised by send
+        """
+        return self.__getRequestExecutor().submit(self.send, msg, responseRequired, functionalReq, asBytes=asBytes)
+
+    def submit_service(self, service: str, *args, **kwargs) -> Future:
+        """Queue a call to a service bound from the odx file, see :meth:`submit`.
+
+        A service run by the worker must not wait for a request it submits,
+        the worker would wait for itself.
+
+        :param service: name of the bound service, e.g. "readDataByIdentifier"
+        :return: future of the value returned by the service
+        """
+        return self.__getRequestExecutor().submit(getattr(self, service), *args, **kwargs)
+
+    def shutdown_requests(self, wait: bool = True) -> None:
+        """Stop the workers of :meth:`submit` and :meth:`call_service_async`
+        once the queued requests are done.
+
+        A later submit or call_service_async starts new workers.
+
+        :param wait: wait for the queued requests to be done
+        """
+        with self.__requestExecutorLock:
+            executors = [self.__requestExecutor, self.__serviceExecutor]
+            self.__requestExecutor = self.__serviceExecutor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=wait)
+
+    ##
+    # @brief the single worker executor of submit, created on first use
+    def __getRequestExecutor(self):
+        with self.__requestExecutorLock:
+            if self.__requestExecutor is None:
+                self.__requestExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Uds")
+            return self.__requestExecutor
+
+    ##
+    # @brief the executor of call_service_async, created on first use, it is never the one running
+    # the blocking receives, so the services cannot take all the threads they wait for
+    def __getServiceExecutor(self):
+        with self.__requestExecutorLock:
+            if self.__serviceExecutor is None:
+                self.__serviceExecutor = ThreadPoolExecutor(
+                    max_workers=self.asyncServiceWorkers, thread_name_prefix="UdsService"
+                )
+            return self.__serviceExecutor
 
     def overwrite_transmit_method(self, func: Callable):
         """override transmit method from the asscociated __connection
@@ -75,10 +216,27 @@ class Uds(object):
         """override the TP reception method
 
         :param func: callable use to replace the current
-            getNextBufferedMessage method
+            getNextBufferedMessage method, it then also gets the flow
+            controls awaited by the sender, so sending and receiving can
+            no longer overlap
         """
         self.tp.getNextBufferedMessage = func
 
+    @property
+    def can_filters(self) -> list:
+        """python-can acceptance filters letting through the responses of
+        the ECUs this instance talks to, see CanTp.can_filters.
+        """
+        return self.tp.can_filters
+
+    def apply_can_filters(self) -> bool:
+        """Apply :attr:`can_filters` to the bus of the transport protocol's connector.
+
+        :return: True if the filters were applied, False if the connector
+            has no python-can bus
+        """
+        return self.tp.apply_can_filters()
+
     @property
     def ihexFile(self):
         return self.__ihexFile
@@ -121,39 +279,178 @@ class Uds(object):
             )
 
     ##
-    # @brief
-    def send(self, msg, responseRequired=True, functionalReq=False, tpWaitTime=0.01):
+    # @brief sends a request and waits for the response
+    # @param [in] msg the request, a list of ints or a bytes-like object
+    # @param [in] functionalReq send the request on the functional ID, the responses of every ECU
+    # received within P2 are returned as a dict of the ECU response ID to its response
+    # @param [in] asBytes return the response as bytes instead of a list
+    def send(self, msg, responseRequired=True, functionalReq=False, tpWaitTime=0.01, asBytes=False):
         # sets a current transmission in progress - tester present (if running) will not send if this flag is set to true
         self.__transmissionActive_flag = True
 
         before_send_time = time.perf_counter()
         # We're moving to threaded operation, so putting a lock around the send operation.
         with self.sendLock:
-            self.tp.send(msg, functionalReq, tpWaitTime)
-
-        if functionalReq is True:
-            responseRequired = False
+            try:
+                self.tp.send(msg, functionalReq, tpWaitTime)
+            except Exception:
+                # no response comes to a functional request that did not go out
+                if functionalReq:
+                    self.__endFunctionalReception()
+                raise
+        sent_time = time.perf_counter()
 
         # Note: in automated mode (unlikely to be used any other way), there is no response from tester present, so threading is not an issue here.
         response = None
-        previous_time = None
         self.last_resp_time = None
-        self.last_pending_resp_times = []
+        # kept by the call, the attribute may be replaced by a concurrent one
+        self.last_pending_resp_times = pendingTimes = []
+        self.last_resp_bus_time = None
+        self.last_resp_overhead = None
+
+        # only ask for the bytes mode when needed, so transport protocols without it keep working
+        recvKwargs = {"as_bytes": True} if asBytes else {}
 
-        if responseRequired:
+        if responseRequired and functionalReq:
+            responses = self.tp.recv_functional(self.timing.p2, **recvKwargs)
+            response = self.__selectFunctionalResponses(responses, time.perf_counter() - before_send_time)
+        elif functionalReq:
+            self.__endFunctionalReception()
+        elif responseRequired:
+            pending = False
+            while True:
+                timeout = self.timing.next_timeout(msg[0], before_send_time, pending)
+                try:
+                    response = self.tp.recv(timeout, **recvKwargs)
+                except TimeoutError:
+                    self.__responseTimedOut(msg[0], pending)
+                    raise
+                if not pending:
+                    self.timing.record(msg[0], time.perf_counter() - sent_time)
+                if self.__recordResponse(response, time.perf_counter() - before_send_time, pendingTimes):
+                    break
+                pending = True
+            self.__recordBusTiming()
+
+        return self.__endTransmission(response)
+
+    ##
+    # @brief sends a request and awaits the response on the running event loop
+    # @param [in] msg the request, a list of ints or a bytes-like object
+    # @param [in] asBytes return the response as bytes instead of a list
+    async def send_async(self, msg, responseRequired=True, functionalReq=False, asBytes=False):
+        self.__transmissionActive_flag = True
+
+        before_send_time = time.perf_counter()
+        async with self.__getAsyncSendLock():
+            try:
+                await self.tp.send_async(msg, functionalReq)
+            except BaseException:
+                if functionalReq:
+                    self.__endFunctionalReception()
+                raise
+        sent_time = time.perf_counter()
+
+        response = None
+        self.last_resp_time = None
+        # kept by the call, the attribute may be replaced by a concurrent one
+        self.last_pending_resp_times = pendingTimes = []
+        self.last_resp_bus_time = None
+        self.last_resp_overhead = None
+
+        recvKwargs = {"as_bytes": True} if asBytes else {}
+
+        if responseRequired and functionalReq:
+            # responses of several ECUs are collected in the executor
+            responses = await asyncio.get_running_loop().run_in_executor(
+                None, partial(self.tp.recv_functional, self.timing.p2, **recvKwargs)
+            )
+            response = self.__selectFunctionalResponses(responses, time.perf_counter() - before_send_time)
+        elif functionalReq:
+            self.__endFunctionalReception()
+        elif responseRequired:
+            pending = False
             while True:
-                response = self.tp.recv(self.__P2_CAN_Client)
-                current_time = time.perf_counter() - before_send_time
-                if response[2] == 0x78:
-                    if previous_time is None:
-                        self.last_pending_resp_times.append(current_time)
-                        previous_time = current_time
-                    else:
-                        self.last_pending_resp_times.append(current_time - previous_time)
-                if not ((response[0] == 0x7F) and (response[2] == 0x78)):
-                    self.last_resp_time = current_time
+                timeout = self.timing.next_timeout(msg[0], before_send_time, pending)
+                try:
+                    response = await self.tp.recv_async(timeout, **recvKwargs)
+                except TimeoutError:
+                    self.__responseTimedOut(msg[0], pending)
+                    raise
+                if not pending:
+                    self.timing.record(msg[0], time.perf_counter() - sent_time)
+                if self.__recordResponse(response, time.perf_counter() - before_send_time, pendingTimes):
                     break
-                
+                pending = True
+            self.__recordBusTiming()
+
+        return self.__endTransmission(response)
+
+    ##
+    # @brief records the timing of a response, pending responses (NRC 0x78) are waited through
+    # @param [in] pendingTimes pending response times of the call, the first one is from the request,
+    # the next ones from the first pending response
+    # @return True when the response is the final one
+    def __recordResponse(self, response, current_time, pendingTimes):
+        # positive responses can be shorter than the 3 bytes of a negative one
+        if not (len(response) > 2 and response[0] == 0x7F and response[2] == 0x78):
+            self.last_resp_time = current_time
+            return True
+        pendingTimes.append(current_time - pendingTimes[0] if pendingTimes else current_time)
+        return False
+
+    ##
+    # @brief a first response that timed out may have been waited for during a learned P2,
+    # the service goes back to P2 until it is learned again
+    def __responseTimedOut(self, serviceId, pending):
+        if not pending:
+            self.timing.forget(serviceId)
+
+    ##
+    # @brief nothing collects the responses to a functional request sent without waiting for them,
+    # the transport protocol then hands the frames of the ECU to the physical receptions again
+    def __endFunctionalReception(self):
+        endFunctionalReception = getattr(self.tp, "end_functional_reception", None)
+        if endFunctionalReception is not None:
+            endFunctionalReception()
+
+    ##
+    # @brief records the response latency in bus time, when the transport protocol gives the
+    # timestamps of the request's last frame and of the response's last frame
+    #
+    # The request side is the bus timestamp of the echo of its last frame when the bus gives
+    # back the frames sent (python-can receive_own_messages). Otherwise it is the host time.time()
+    # taken once the connector transmitted the frame, which keeps the TX queueing and scheduling
+    # delays. The overhead assumes the interface stamps the frames with the time.time() clock, as
+    # python-can interfaces do.
+    def __recordBusTiming(self):
+        txStatistics = getattr(self.tp, "last_tx_statistics", None)
+        rxStatistics = getattr(self.tp, "last_rx_statistics", None)
+        if txStatistics is None or rxStatistics is None:
+            return
+        txTimestamp = getattr(txStatistics, "last_frame_echo_timestamp", None) or txStatistics.last_frame_timestamp
+        if txTimestamp is None or rxStatistics.last_frame_timestamp is None:
+            return
+        self.last_resp_bus_time = rxStatistics.last_frame_timestamp - txTimestamp
+        self.last_resp_overhead = time.time() - rxStatistics.last_frame_timestamp
+
+    ##
+    # @brief keeps the final response of each ECU to a functional request,
+    # an ECU that only answered response pending (NRC 0x78) within P2 keeps that answer
+    # @return dict of the ECU response ID to its response
+    def __selectFunctionalResponses(self, responses, current_time):
+        selected = {}
+        for ecu, messages in responses.items():
+            finalMessages = [
+                message for message in messages if not (len(message) > 2 and message[0] == 0x7F and message[2] == 0x78)
+            ]
+            selected[ecu] = finalMessages[-1] if finalMessages else messages[-1]
+        self.last_resp_time = current_time
+        return selected
+
+    ##
+    # @brief bookkeeping shared by send and send_async once the response is in
+    def __endTransmission(self, response):
         # If the diagnostic session control service is supported, record the sending time for possible use by the tester present functionality (again, if present) ...
         if hasattr(self, "sessionSetLastSend"):
             self.sessionSetLastSend()
@@ -162,6 +459,14 @@ class Uds(object):
         self.__transmissionActive_flag = False
         return response
 
+    ##
+    # @brief the asyncio lock serialising send_async, an asyncio lock only serves the loop it was first used on
+    def __getAsyncSendLock(self):
+        loop = asyncio.get_running_loop()
+        if self.__asyncSendLock is None or self.__asyncSendLock[0] is not loop:
+            self.__asyncSendLock = (loop, asyncio.Lock())
+        return self.__asyncSendLock[1]
+
     ##
     # @brief
     def isTransmitting(self):
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+from __future__ import annotations
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Union
+
+
+class UdsFleetBusyError(RuntimeError):
+    """The ECU was skipped, a call of an earlier run that timed out on it is still going."""
+
+
+@dataclass
+class UdsFleetResult:
+    """Outcome of a call on one ECU of a fleet."""
+
+    #: value returned by the call, None when it failed
+    value: Any = None
+    #: exception raised by the call, TimeoutError when it did not finish in time,
+    #: UdsFleetBusyError when the ECU was skipped
+    error: Optional[BaseException] = None
+    #: time in seconds the call took, or waited before timing out
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+##
+# @class UdsFleet
+# @brief Runs the same call on many Uds instances at once
+#
+# Each ECU has its own Uds instance, and so its own transport protocol, so
+# the calls only share the bus. The wall time approaches the one of the
+# slowest ECU rather than the sum of all of them.
+# A call that timed out cannot be stopped, its ECU is skipped by the next runs
+# until it ends, so that an instance is never driven by two calls at once, and
+# it keeps its worker thread, so that max_workers remains a bound.
+class UdsFleet:
+    def __init__(self, ecus: Union[Mapping[Any, Any], Iterable[Any]], max_workers: int = 16):
+        """
+        :param ecus: Uds instances by name, or an iterable of them, each one
+            then being its own key in the results
+        :param max_workers: largest number of calls running at the same time
+        """
+        self.ecus = dict(ecus) if isinstance(ecus, Mapping) else {uds: uds for uds in ecus}
+        self.max_workers = max_workers
+        # key of the ECUs to the future or task of their call that timed out
+        self.__timedOutCalls = {}
+        # worker threads of the calls, created by the first run
+        self.__executor = None
+        self.__executorLock = threading.Lock()
+
+    @property
+    def busy(self) -> list:
+        """Keys of the ECUs still running a call that timed out."""
+        return [key for key, call in list(self.__timedOutCalls.items()) if not call.done()]
+
+    def run(
+        self, service: Union[str, Callable], *args, timeout: Optional[float] = None, **kwargs
+    ) -> Dict[Any, UdsFleetResult]:
+        """Call a service on every ECU from a bounded thread pool.
+
+        A call timing out is reported as such, its thread keeps running until
+        the transport protocol's own timeouts end it, and the ECU is reported
+        busy with UdsFleetBusyError by the runs started until then.
+
+        :param service: name of a bound service, e.g. "readDataByIdentifier",
+            or a callable taking the Uds instance
+        :param timeout: time in seconds each call may take once started,
+            None for no limit
+        :return: the result of each ECU by key
+        """
+        results = {}
+        ecus = self.__takeIdleEcus(results)
+        if not ecus:
+            return results
+        startTimes = {}
+
+        def call(key, uds):
+            startTimes[key] = perf_counter()
+            return self.__getCall(uds, service)(*args, **kwargs)
+
+        futures = {self.__getExecutor().submit(call, key, uds): key for key, uds in ecus.items()}
+        pending = set(futures)
+        while pending:
+            waitTime = None
+            if timeout is not None:
+                now = perf_counter()
+                deadlines = [
+                    startTimes[futures[future]] + timeout for future in pending if futures[future] in startTimes
+                ]
+                waitTime = max(min(deadlines) - now, 0) if deadlines else timeout
+            done, pending = wait(pending, timeout=waitTime, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = futures[future]
+                duration = perf_counter() - startTimes[key]
+                error = future.exception()
+                if error is None:
+                    results[key] = UdsFleetResult(value=future.result(), duration=duration)
+                else:
+                    results[key] = UdsFleetResult(error=error, duration=duration)
+            if timeout is not None:
+                now = perf_counter()
+                for future in [future for future in pending if futures[future] in startTimes]:
+                    key = futures[future]
+                    if now - startTimes[key] >= timeout:
+                        results[key] = UdsFleetResult(
+                            error=TimeoutError(f"No result within {timeout} s"), duration=now - startTimes[key]
+                        )
+                        pending.discard(future)
+                        self.__timedOutCalls[key] = future
+        return {key: results[key] for key in self.ecus}
+
+    async def run_async(
+        self, service: str, *args, timeout: Optional[float] = None, **kwargs
+    ) -> Dict[Any, UdsFleetResult]:
+        """Await a service on every ECU with Uds.call_service_async, see :meth:`run`.
+
+        The services run on the worker threads of the fleet, at most
+        max_workers calls go on at once, those that timed out included
+        until they end.
+
+        :param service: name of a bound service, "send" sends a raw request
+            with Uds.send_async
+        :param timeout: time in seconds each call may take once started,
+            None for no limit
+        :return: the result of each ECU by key
+        """
+        results = {}
+        ecus = self.__takeIdleEcus(results)
+        executor = self.__getExecutor()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def call(key, uds):
+            await semaphore.acquire()
+            startTime = perf_counter()
+            if service == "send":
+                coroutine = uds.send_async(*args, **kwargs)
+            else:
+                coroutine = uds.call_service_async(service, *args, executor=executor, **kwargs)
+            # asyncio.wait tells the call's own TimeoutError, e.g. from CanTp, from an expired timeout
+            task = asyncio.ensure_future(coroutine)
+            # the place of a call is only given back once it ends, even after it timed out
+            task.add_done_callback(lambda task: semaphore.release())
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            duration = perf_counter() - startTime
+            if not done:
+                # cancelling would not stop a service running in the executor, the task is left to end
+                self.__timedOutCalls[key] = task
+                task.add_done_callback(self.__discardResult)
+                return UdsFleetResult(error=TimeoutError(f"No result within {timeout} s"), duration=duration)
+            if task.exception() is not None:
+                return UdsFleetResult(error=task.exception(), duration=duration)
+            return UdsFleetResult(value=task.result(), duration=duration)
+
+        results.update(zip(ecus, await asyncio.gather(*(call(key, uds) for key, uds in ecus.items()))))
+        return {key: results[key] for key in self.ecus}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker threads of the fleet, a later run starts new ones.
+
+        :param wait: wait for the calls still running, those that timed out included
+        """
+        with self.__executorLock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    ##
+    # @brief the worker threads of the calls, shared by the runs so that the calls that timed out
+    # keep taking a worker until they end
+    def __getExecutor(self):
+        with self.__executorLock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="UdsFleet")
+            return self.__executor
+
+    ##
+    # @brief gets the ECUs free to be called, the ones still running a call that timed out get a busy result
+    def __takeIdleEcus(self, results):
+        ecus = {}
+        for key, uds in self.ecus.items():
+            timedOutCall = self.__timedOutCalls.get(key)
+            if timedOutCall is not None and not timedOutCall.done():
+                results[key] = UdsFleetResult(error=UdsFleetBusyError(f"A call that timed out on {key!r} is still running"))
+            else:
+                self.__timedOutCalls.pop(key, None)
+                ecus[key] = uds
+        return ecus
+
+    ##
+    # @brief retrieves the outcome of a task that timed out, nobody else awaits it
+    @staticmethod
+    def __discardResult(task):
+        if not task.cancelled():
+            task.exception()
+
+    @staticmethod
+    def __getCall(uds, service):
+        return getattr(uds, service) if isinstance(service, str) else partial(service, uds)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+__author__ = "Richard Clubb"
+__copyrights__ = "Copyright 2018, the python-uds project"
+__credits__ = ["Richard Clubb"]
+
+__license__ = "MIT"
+__maintainer__ = "Richard Clubb"
+__email__ = "richard.clubb@embeduk.com"
+__status__ = "Development"
+
+import threading
+from collections import deque
+from time import perf_counter
+
+
+##
+# @class UdsResponseTiming
+# @brief Timeouts used while waiting for the response to a request
+#
+# The first response is waited for during P2, each response pending (NRC 0x78)
+# then grants the ECU P2* more, and an optional deadline bounds the whole
+# exchange. When learning, the P2 of a service shrinks to a multiple of the
+# first response times seen for it, so an ECU that stopped answering is given
+# up on sooner. It never goes below P2server, the time the ECU may take to
+# answer, plus a margin. A timeout forgets what was learned for the service.
+class UdsResponseTiming:
+    def __init__(
+        self,
+        p2: float,
+        p2_star: float,
+        deadline: float = 0,
+        learn: bool = False,
+        p2_server: float = 0,
+        learn_factor: float = 4.0,
+        learn_margin: float = 0.05,
+        learn_samples: int = 8,
+    ):
+        """
+        :param p2: time in seconds to wait for the first response
+        :param p2_star: time in seconds to wait for the next response after a response pending
+        :param deadline: time in seconds from the request to its final response, 0 for no limit
+        :param learn: shorten P2 per service from the first response times seen
+        :param p2_server: P2server, time in seconds the ECU may take to start its response
+        :param learn_factor: learned P2 as a multiple of the slowest first response time kept
+        :param learn_margin: time in seconds added to P2server for the shortest learned P2,
+            for the bus and the tester to carry the response
+        :param learn_samples: first response times kept per service, P2 is learned once all are in
+        """
+        self.p2 = p2
+        self.p2_star = p2_star
+        self.deadline = deadline
+        self.learn = learn
+        self.p2_server = p2_server
+        self.learn_factor = learn_factor
+        self.learn_margin = learn_margin
+        self.learn_samples = learn_samples
+        self.__responseTimes = {}
+        self.__lock = threading.Lock()
+
+    def p2_timeout(self, service_id: int) -> float:
+        """Get the time to wait for the first response to a service.
+
+        :param service_id: service ID of the request
+        :return: P2, or the learned P2 of the service when shorter, never below
+            P2server plus the margin so a compliant ECU is always waited for
+        """
+        responseTimes = self.__responseTimes.get(service_id)
+        if not self.learn or responseTimes is None or len(responseTimes) < self.learn_samples:
+            return self.p2
+        return min(self.p2, max(self.p2_server + self.learn_margin, max(responseTimes) * self.learn_factor))
+
+    def next_timeout(self, service_id: int, start_time: float, pending: bool) -> float:
+        """Get the time to wait for the next response of a request.
+
+        :param service_id: service ID of the request
+        :param start_time: perf_counter value when the request was sent, start of the deadline
+        :param pending: the ECU already answered response pending
+        :return: timeout in seconds
+        :raises TimeoutError: the deadline has passed
+        """
+        timeout = self.p2_star if pending else self.p2_timeout(service_id)
+        if self.deadline:
+            remaining = start_time + self.deadline - perf_counter()
+            if remaining <= 0:
+                raise TimeoutError(f"No final response within the {self.deadline} s deadline")
+            timeout = min(timeout, remaining)
+        return timeout
+
+    def record(self, service_id: int, response_time: float) -> None:
+        """Keep the time the first response to a service took.
+
+        :param service_id: service ID of the request
+        :param response_time: time in seconds from the end of the request to the first response
+        """
+        if not self.learn:
+            return
+        with self.__lock:
+            responseTimes = self.__responseTimes.get(service_id)
+            if responseTimes is None:
+                responseTimes = self.__responseTimes[service_id] = deque(maxlen=self.learn_samples)
+            responseTimes.append(response_time)
+
+    def forget(self, service_id: int) -> None:
+        """Go back to P2 for a service, e.g. after its first response timed out.
+
+        :param service_id: service ID of the request
+        """
+        with self.__lock:
+            self.__responseTimes.pop(service_id, None)
@@ -10,7 +10,7 @@ __email__ = "richard.clubb@embeduk.com"
 __status__ = "Development"
 
 
-from time import perf_counter
+from time import perf_counter, sleep
 
 from uds.uds_communications.Utilities.iResettableTimer import iResettableTimer
 
@@ -64,6 +64,23 @@ class ResettableTimer(iResettableTimer):
         self.__timerCheck()
         return self.__expired_flag
 
+    def waitUntilExpired(self, spinThreshold: float = 0) -> None:
+        """Block until a running timer expires.
+
+        The thread sleeps until ``spinThreshold`` seconds before the
+        deadline and busy-waits only for that last stretch, which keeps
+        the expiry accurate without holding a CPU core for the whole wait.
+
+        :param spinThreshold: time in seconds to busy-wait before expiry
+        """
+        if not self.isRunning():
+            return
+        sleepTime = self.remainingTime - spinThreshold
+        if sleepTime > 0:
+            sleep(sleepTime)
+        while not self.isExpired():
+            pass
+
     def __timerCheck(self):
         if self.__active_flag:
             currTime = perf_counter()